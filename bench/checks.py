@@ -0,0 +1,273 @@
+"""
+Offline behavioural checks for the parts of the pipeline that are hard to
+see go wrong from the benchmarks: the send limiter and outbox recovery, the
+Gmail sync, the memory write-behind journal, pre-draft claims and Chroma
+compaction.
+
+Each check runs in its own scratch directory (so `data/` is never touched)
+against the in-memory Gmail fake (bench/fake_gmail.py) and, where memory is
+involved, the stub Ollama server (bench/stub_ollama.py). Clocks and sleeps
+are injected or patched, so the whole run takes seconds.
+
+    python -m bench.checks                      # run from the repo root
+    python -m bench.checks --only outbox-crash,compaction
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import traceback
+import subprocess
+from unittest.mock import patch
+import click
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+from bench.fake_gmail import FakeGmail
+
+
+def expect(condition: bool, what: str):
+    """Fail the current check with `what` unless `condition` holds."""
+    if not condition:
+        raise AssertionError(what)
+
+
+class FakeClock:
+    """Monotonic clock whose `sleep` just moves time forward."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def _no_sleep():
+    """Patch out the Gmail client's backoff sleeps (the delays are still computed)."""
+    return patch("src.gmail_client.time.sleep", lambda s: None)
+
+
+def _outbox(svc, store):
+    from src.outbox import Outbox, TokenBucket
+    return Outbox(svc, store, bucket=TokenBucket(1e9), base_delay=0.001, max_delay=0.01)
+
+
+def _queue_reply(svc, store, msg_id: str, body: str = "Thanks, on it.") -> dict:
+    from src.outbox import reply_item
+    item = reply_item(svc, store, msg_id, body)
+    store.enqueue_send(item)
+    return item
+
+
+# ---------------------------------------------------------------------- #
+# Checks
+# ---------------------------------------------------------------------- #
+def check_token_bucket() -> str:
+    from src.outbox import SEND_COST, TokenBucket
+    clock = FakeClock()
+    bucket = TokenBucket(250, clock=clock, sleep=clock.sleep)
+    waits = [bucket.take(SEND_COST) for _ in range(4)]
+    expect(waits[:2] == [0.0, 0.0], f"a full bucket should not wait: {waits}")
+    expect(abs(waits[2] - 0.2) < 1e-9 and abs(waits[3] - 0.4) < 1e-9, f"refill at 250/s: {waits}")
+    bucket.drain()
+    waited = bucket.take(SEND_COST)
+    expect(abs(waited - 0.4) < 1e-9, f"a drained bucket waits for a full refill: {waited}")
+    clock.now += 60
+    bucket.take(0)
+    expect(bucket.tokens == bucket.capacity, f"tokens capped at capacity: {bucket.tokens}")
+    return f"waits {', '.join(f'{w:.1f}s' for w in waits)}"
+
+
+def check_backoff() -> str:
+    from src.gmail_client import backoff
+    for attempt in range(1, 10):
+        cap = min(32.0, 2 ** (attempt - 1))
+        delays = [backoff(attempt, 1.0, 32.0) for _ in range(200)]
+        expect(all(0 <= d <= cap for d in delays), f"attempt {attempt} outside [0, {cap}]")
+    expect(backoff(1, 1.0, 32.0, retry_after=7.0) >= 7.0, "Retry-After is a floor")
+    return "full jitter within [0, min(cap, base·2ⁿ⁻¹)]"
+
+
+def check_outbox_crash() -> str:
+    """A process died after Gmail accepted the send: recover() must find it, not send again."""
+    from src.gmail_client import send_message
+    from src.store import MessageStore
+    svc, store = FakeGmail(6), MessageStore()
+    svc.rewrite_message_ids = True  # the sent copy keeps only our X-Outbox-Id
+    first, second = svc.order[:2]
+    sent_item = _queue_reply(svc, store, first)
+    lost_item = _queue_reply(svc, store, second)
+    for item in (sent_item, lost_item):
+        expect(store.claim_send(item["msg_id"]), "claim a queued row")
+    send_message(svc, sent_item["to_addr"], sent_item["subject"], sent_item["body"], sent_item["thread_id"],
+                 in_reply_to=sent_item["in_reply_to"], references=sent_item["refs"],
+                 message_id=sent_item["message_id"], outbox_id=sent_item["message_id"].strip("<>"))
+    outbox = _outbox(svc, store)
+    expect(outbox.recover(stale_after=60) == 0, "fresh 'sending' rows belong to a live process")
+    expect(outbox.recover(stale_after=0) == 1, "only the unsent row is re-queued")
+    row = store.get_send(sent_item["msg_id"])
+    expect(row["status"] == "sent" and row["sent_id"], f"sent row settled: {row['status']}")
+    expect(store.get_send(lost_item["msg_id"])["status"] == "queued", "unsent row back in the queue")
+    stats = outbox.run()
+    expect(stats["sent"] == 1 and len(svc.sent) == 2, f"one send each, no duplicates: {stats}, {len(svc.sent)}")
+    return "sent copy found by X-Outbox-Id; no double send"
+
+
+def check_outbox_retry() -> str:
+    from src.session import Session
+    from src.store import MessageStore
+    svc, store = FakeGmail(6), MessageStore()
+    first, second = svc.order[:2]  # before sends put our replies at the top of the mailbox
+    svc.send_errors = [429, 503]
+    _queue_reply(svc, store, first)
+    stats = _outbox(svc, store).run()
+    expect(stats["sent"] == 1 and stats["retried"] == 2, f"429 and 503 retried, then sent: {stats}")
+    svc.send_errors = [400]
+    item = _queue_reply(svc, store, second)
+    stats = _outbox(svc, store).run()
+    expect(stats["failed"] == 1 and store.get_send(item["msg_id"])["status"] == "failed", f"400 fails: {stats}")
+    with patch("src.gmail_client.get_service", return_value=svc):
+        result = Session().retry([item["msg_id"][:8]])
+    expect(result["requeued"] == 1 and result["sent"] == 1, f"`outbox --retry` sends it: {result}")
+    expect(store.get_send(item["msg_id"])["status"] == "sent", "retried row ends up sent")
+    return "429/503 backed off; failed row re-queued and sent"
+
+
+def check_sync() -> str:
+    from src.store import MessageStore, sync
+    svc, store = FakeGmail(40), MessageStore()
+    svc.get_errors = [429] * 5 + [503] * 3
+    with _no_sleep(), patch.dict(os.environ, {"SYNC_BASELINE": "25"}):
+        expect(sync(svc, store) == [], "first sync is the baseline")
+    stored = store.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    expect(stored == 25, f"baseline stores SYNC_BASELINE messages despite 429/503s: {stored}")
+    expect(store.missing(svc.order[:25]) == [], "the newest messages are the ones stored")
+    new = svc.deliver(3)
+    with _no_sleep():
+        added = sync(svc, store)
+    expect(added == new, f"delta returns the new ids: {added}")
+    expect(store.missing(new) == [], "delta messages stored")
+    with _no_sleep():
+        expect(sync(svc, store) == [], "an idle mailbox adds nothing")
+    return f"baseline {stored}, delta {len(added)}"
+
+
+def check_write_behind() -> str:
+    """Journals of exited processes are replayed once; a torn last line is skipped."""
+    from src.memory import WriteBehind
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    prefix = os.path.join("data", "memory_journal.checks")
+    os.makedirs("data", exist_ok=True)
+    records = [{"id": f"r{i}", "document": f"doc {i}", "metadata": {"type": "draft"}} for i in range(3)]
+    with open(f"{prefix}.{dead.pid}.jsonl", "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(r) + "\n" for r in records + [{**records[0], "document": "doc 0 v2"}])
+        f.write('{"id": "torn", "docu')
+    stored = {}
+
+    def write(docs, metas, ids):
+        stored.update(zip(ids, docs))
+
+    wb = WriteBehind(write, prefix, max_delay=60)
+    replayed = wb.recover()
+    expect(replayed == 3, f"three records replayed: {replayed}")
+    expect(stored == {"r0": "doc 0 v2", "r1": "doc 1", "r2": "doc 2"}, f"last write per id wins: {stored}")
+    expect(os.listdir("data") == [], f"claimed journals removed: {os.listdir('data')}")
+    expect(WriteBehind(write, prefix).recover() == 0, "nothing replayed twice")
+    return f"{replayed} record(s) replayed"
+
+
+def check_predraft_claims() -> str:
+    from src.store import MessageStore
+    store = MessageStore()
+    store.queue_predrafts(["m1"])
+    expect(store.claim_predraft("m1", stale_after=60), "a pending message can be claimed")
+    expect(not store.claim_predraft("m1", stale_after=60), "a live claim is exclusive")
+    time.sleep(0.01)
+    expect(store.claim_predraft("m1", stale_after=0.001), "a stale claim is taken over")
+    store.save_predraft("m1", "k", "Draft text")
+    store.queue_predrafts(["m1"])
+    expect(store.get_predraft("m1")["status"] == "ready", "queueing keeps a ready draft")
+    return "exclusive claims, stale takeover"
+
+
+def check_compaction() -> str:
+    """Repeated compactions leave one HNSW segment directory and a flat on-disk size."""
+    from src.memory import CHROMA_DIR, Memory, _SEGMENT_DIR
+    from bench.stub_ollama import StubOllama
+    with StubOllama() as stub, patch.dict(os.environ, {"OLLAMA_BASE_URL": stub.url, "OLLAMA_WARMUP": "0",
+                                                       "MEMORY_WRITE_BEHIND": "0"}):
+        mem = Memory("checks", backend="chroma")
+        docs = [f"SUBJECT: Invoice {n}\nBODY: Payment {n} is due.\nDRAFT: Thanks, paying {n}." for n in range(300)]
+        metas = [{"type": "draft", "sender": f"s{n % 7}@x.io"} for n in range(300)]
+        ids = [f"m{n}" for n in range(300)]
+        sizes = []
+        for _ in range(4):
+            mem.add(docs, metas, ids)
+            mem.compact(dup_distance=None)
+            sizes.append(mem.store.size_bytes())
+        segments = [d for d in os.listdir(CHROMA_DIR) if _SEGMENT_DIR.fullmatch(d)]
+        expect(mem.store.count() == 300, f"compaction keeps every record: {mem.store.count()}")
+    expect(len(segments) == 1, f"one live segment directory: {segments}")
+    expect(sizes[-1] <= sizes[0] * 1.1, f"size stays flat: {sizes}")
+    return " → ".join(f"{s / 1e6:.1f}" for s in sizes) + " MB"
+
+
+CHECKS = {
+    "token-bucket":   check_token_bucket,
+    "backoff":        check_backoff,
+    "outbox-crash":   check_outbox_crash,
+    "outbox-retry":   check_outbox_retry,
+    "sync":           check_sync,
+    "write-behind":   check_write_behind,
+    "predraft-claim": check_predraft_claims,
+    "compaction":     check_compaction,
+}
+
+
+def run_check(fn) -> tuple:
+    """(passed, detail) for one check, run inside a fresh scratch directory."""
+    cwd, workdir = os.getcwd(), tempfile.mkdtemp(prefix="check-")
+    os.chdir(workdir)
+    try:
+        return True, fn()
+    except AssertionError as e:
+        return False, str(e)
+    except Exception:
+        return False, traceback.format_exc(limit=3)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@click.command()
+@click.option("--only", default=",".join(CHECKS), help="Comma-separated checks to run")
+def main(only):
+    names = [n.strip() for n in only.split(",") if n.strip()]
+    unknown = [n for n in names if n not in CHECKS]
+    if unknown:
+        raise click.BadParameter(f"unknown check(s) {', '.join(unknown)} (choose from {', '.join(CHECKS)})",
+                                 param_hint="--only")
+    console = Console()
+    table = Table(title="Behavioural checks", box=box.ROUNDED)
+    for col in ("Check", "Status", "Detail"):
+        table.add_column(col)
+    failed = False
+    for name in names:
+        ok, detail = run_check(CHECKS[name])
+        failed |= not ok
+        table.add_row(name, "[green]ok[/]" if ok else "[red]FAIL[/]", detail)
+    console.print(table)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+In-memory stand-in for the `googleapiclient` Gmail service.
+
+Covers the surface `src/gmail_client.py` uses – messages list/get/send,
+threads get, attachments get, batch requests, getProfile and history list –
+with the same resource shapes, page tokens, the 500-id list cap, `HttpError`
+on unknown ids or expired history, and injectable send and get failures
+(`send_errors`, `get_errors`). Every `execute()` (a batch counts once) sleeps `rtt_ms` to
+model the network round trip and is counted in `calls`.
+
+    svc = FakeGmail(size=1000, rtt_ms=40)
+    svc = FakeGmail(size=1000, replies=400)   # plus 400 sent replies, threaded under inbox mail
+    with patch("src.gmail_client.get_service", return_value=svc): ...
+"""
+import re
+import base64
+import random
+import time
+from email import message_from_bytes
+from typing import Callable, Dict, List, Optional
+
+MAX_LIST = 500
+
+SENDERS = [
+    ("Priya Raman", "priya@acme-corp.com"), ("Tom Becker", "tom.becker@gmail.com"),
+    ("Billing", "billing@vendor.io"), ("Ana Silva", "ana@university.edu"),
+    ("Ops Alerts", "alerts@acme-corp.com"), ("Lee Wong", "lee.wong@outlook.com"),
+]
+SUBJECTS = ["Invoice #{n} overdue", "Meeting notes for sprint {n}", "Urgent: server {n} down",
+            "Dinner on Friday?", "Re: contract renewal {n}", "Weekly report {n}"]
+SENTENCES = ["Please review the attached proposal before our call.",
+             "The deployment is blocked until the migration finishes.",
+             "Can we move the meeting to Thursday afternoon?",
+             "Payment is due by the end of the month.",
+             "Let me know if the timeline still works for your team.",
+             "We noticed elevated error rates after the last release."]
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode()
+
+
+def _http_error(status: int, reason: str):
+    from googleapiclient.errors import HttpError
+    from httplib2 import Response
+    return HttpError(Response({"status": status, "reason": reason}), reason.encode())
+
+
+class _Request:
+    def __init__(self, svc: "FakeGmail", fn: Callable[[], Dict]):
+        self._svc = svc
+        self._fn = fn
+
+    def execute(self) -> Dict:
+        self._svc._round_trip("execute")
+        return self._fn()
+
+
+class _Batch:
+    def __init__(self, svc: "FakeGmail", callback):
+        self._svc = svc
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request: _Request, request_id: str = None, callback=None):
+        self._requests.append((request_id or str(len(self._requests)), request, callback))
+
+    def execute(self):
+        self._svc._round_trip("batch")
+        for request_id, request, callback in self._requests:
+            try:
+                response, error = request._fn(), None
+            except Exception as e:
+                response, error = None, e
+            (callback or self._callback)(request_id, response, error)
+
+
+class FakeGmail:
+    """
+    Synthetic mailbox of `size` messages; bodies are ~`body_chars` long, every
+    `html_every`th is HTML. `replies` of them (spread evenly) get a sent reply
+    in the same thread, quoting the original like a mail client does.
+    """
+
+    def __init__(self, size: int = 100, rtt_ms: float = 0.0, body_chars: int = 1500,
+                 html_every: int = 3, seed: int = 7, replies: int = 0):
+        self.rtt_ms = rtt_ms
+        self.calls: Dict[str, int] = {}
+        self.sent: List[Dict] = []
+        self.send_errors: List[int] = []  # HTTP statuses the next sends fail with (e.g. [429, 503])
+        self.get_errors: List[int] = []  # HTTP statuses the next message gets fail with
+        self.rewrite_message_ids = False  # True = replace the Message-ID of sent mail, as a server may
+        self.records: List[Dict] = []  # history records, oldest first
+        self.mailbox: Dict[str, Dict] = {}
+        self.order: List[str] = []  # newest first, as Gmail lists
+        self.by_thread: Dict[str, List[str]] = {}  # threadId -> message ids, oldest first
+        self.history_id = 1000
+        self._rng = random.Random(seed)
+        self._body_chars = body_chars
+        self._html_every = html_every
+        self._next = 0
+        for _ in range(size):
+            self._add(self._synth(), record=False)
+        inbox = list(reversed(self.order))
+        for i in range(min(replies, size)):
+            self._add(self._reply(self.mailbox[inbox[i * size // replies]]), record=False)
+
+    # -- mailbox ------------------------------------------------------------ #
+    def _synth(self) -> Dict:
+        n = self._next
+        name, addr = SENDERS[n % len(SENDERS)]
+        subject = SUBJECTS[n % len(SUBJECTS)].format(n=n)
+        text = ""
+        while len(text) < self._body_chars:
+            text += self._rng.choice(SENTENCES) + " "
+        if self._html_every and n % self._html_every == 0:
+            mime, text = "text/html", f"<html><body><div><p>{text}</p></div></body></html>"
+        else:
+            mime = "text/plain"
+        headers = [{"name": "From", "value": f"{name} <{addr}>"}, {"name": "To", "value": "me@example.com"},
+                   {"name": "Subject", "value": subject}, {"name": "Message-ID", "value": f"<{n}@fake.mail>"},
+                   {"name": "Date", "value": "Mon, 6 Oct 2025 09:00:00 +0000"}]
+        return {
+            "threadId": f"t{n:015x}",
+            "labelIds": ["INBOX", "UNREAD"] if n % 2 else ["INBOX"],
+            "snippet": text[:100],
+            "payload": {
+                "mimeType": "multipart/alternative",
+                "headers": headers,
+                "parts": [{"partId": "0", "mimeType": mime, "filename": "",
+                           "headers": [{"name": "Content-Type", "value": f"{mime}; charset=utf-8"}],
+                           "body": {"size": len(text), "data": _b64(text)}}],
+            },
+        }
+
+    def _reply(self, parent: Dict) -> Dict:
+        headers = {h["name"]: h["value"] for h in parent["payload"]["headers"]}
+        text = (f"Hi,\n\n{self._rng.choice(SENTENCES)} {self._rng.choice(SENTENCES)}\n\nBest,\nMe\n\n"
+                f"On Mon, 6 Oct 2025, {headers['From']} wrote:\n> {parent['snippet'][:80]}\n")
+        return {
+            "threadId": parent["threadId"],
+            "labelIds": ["SENT"],
+            "snippet": text[:100],
+            "payload": {
+                "mimeType": "text/plain",
+                "headers": [{"name": "From", "value": "Me <me@example.com>"},
+                            {"name": "To", "value": headers["From"]},
+                            {"name": "Subject", "value": f"Re: {headers['Subject']}"},
+                            {"name": "In-Reply-To", "value": headers["Message-ID"]},
+                            {"name": "Message-ID", "value": f"<r{self._next}@fake.mail>"}],
+                "body": {"size": len(text), "data": _b64(text)},
+            },
+        }
+
+    def _add(self, msg: Dict, record: bool = True) -> str:
+        # Gmail ids are 16 hex digits; random low bits keep 8-char short ids unique
+        msg_id = f"{0x1900000000000000 + self._rng.getrandbits(56):016x}"
+        self._next += 1
+        self.history_id += 1
+        msg.update(id=msg_id, historyId=str(self.history_id),
+                   internalDate=str(1_700_000_000_000 + self._next * 60_000),
+                   sizeEstimate=len(str(msg)))
+        self.mailbox[msg_id] = msg
+        self.order.insert(0, msg_id)
+        self.by_thread.setdefault(msg["threadId"], []).append(msg_id)
+        if record:
+            self.records.append({"id": str(self.history_id), "messagesAdded": [
+                {"message": {"id": msg_id, "threadId": msg["threadId"], "labelIds": msg["labelIds"]}}]})
+        return msg_id
+
+    def deliver(self, count: int = 1) -> List[str]:
+        """Simulate new mail arriving (shows up in history deltas)."""
+        return [self._add(self._synth()) for _ in range(count)]
+
+    def _round_trip(self, kind: str):
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        if self.rtt_ms:
+            time.sleep(self.rtt_ms / 1000)
+
+    # -- resource tree ------------------------------------------------------ #
+    def users(self):
+        return self
+
+    def messages(self):
+        return _Messages(self)
+
+    def threads(self):
+        return _Threads(self)
+
+    def history(self):
+        return _History(self)
+
+    def getProfile(self, userId: str):
+        return _Request(self, lambda: {"emailAddress": "me@example.com", "historyId": str(self.history_id),
+                                       "messagesTotal": len(self.mailbox)})
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+
+class _Messages:
+    def __init__(self, svc: FakeGmail):
+        self.svc = svc
+
+    def list(self, userId: str, q: str = "", maxResults: int = 100, pageToken: Optional[str] = None, **_):
+        def run():
+            labels = {"in:sent": "SENT", "in:inbox": "INBOX", "is:unread": "UNREAD"}
+            wanted = [label for token, label in labels.items() if token in (q or "")]
+            ids = [i for i in self.svc.order if all(w in self.svc.mailbox[i]["labelIds"] for w in wanted)]
+            msgid = re.search(r"rfc822msgid:(\S+)", q or "")
+            if msgid:
+                ids = [i for i in ids if any(h["name"].lower() == "message-id" and h["value"].strip("<>") == msgid[1]
+                                             for h in self.svc.mailbox[i]["payload"]["headers"])]
+            start = int(pageToken or 0)
+            page = ids[start:start + min(maxResults, MAX_LIST)]
+            resp = {"messages": [{"id": i, "threadId": self.svc.mailbox[i]["threadId"]} for i in page],
+                    "resultSizeEstimate": len(ids)}
+            if start + len(page) < len(ids):
+                resp["nextPageToken"] = str(start + len(page))
+            return resp
+        return _Request(self.svc, run)
+
+    def get(self, userId: str, id: str, format: str = "full", metadataHeaders: Optional[List[str]] = None):
+        def run():
+            if self.svc.get_errors:
+                status = self.svc.get_errors.pop(0)
+                raise _http_error(status, "rateLimitExceeded" if status == 429 else "Backend Error")
+            msg = self.svc.mailbox.get(id)
+            if msg is None:
+                raise _http_error(404, "Not Found")
+            if format == "full":
+                return msg
+            out = {k: v for k, v in msg.items() if k != "payload"}
+            if format == "metadata":
+                wanted = {h.lower() for h in metadataHeaders or []}
+                headers = [h for h in msg["payload"]["headers"] if not wanted or h["name"].lower() in wanted]
+                out["payload"] = {"mimeType": msg["payload"]["mimeType"], "headers": headers}
+            return out
+        return _Request(self.svc, run)
+
+    def send(self, userId: str, body: Dict):
+        def run():
+            if self.svc.send_errors:
+                status = self.svc.send_errors.pop(0)
+                raise _http_error(status, "rateLimitExceeded" if status == 429 else "Backend Error")
+            parsed = message_from_bytes(base64.urlsafe_b64decode(body["raw"]))
+            headers = [{"name": k, "value": v} for k, v in parsed.items()]
+            if self.svc.rewrite_message_ids:
+                headers = [h if h["name"].lower() != "message-id" else
+                           {"name": h["name"], "value": f"<sent{len(self.svc.sent)}@fake.mail>"} for h in headers]
+            text = parsed.get_payload(decode=True).decode("utf-8", errors="ignore")
+            msg = {"threadId": body.get("threadId") or f"s{len(self.svc.sent):015x}",
+                   "labelIds": ["SENT"], "snippet": text[:100],
+                   "payload": {"mimeType": "text/plain", "headers": headers,
+                               "body": {"size": len(text), "data": _b64(text)}}}
+            msg_id = self.svc._add(msg)
+            self.svc.sent.append(msg)
+            return {"id": msg_id, "threadId": msg["threadId"], "labelIds": ["SENT"]}
+        return _Request(self.svc, run)
+
+    def attachments(self):
+        return _Attachments(self.svc)
+
+
+class _Threads:
+    def __init__(self, svc: FakeGmail):
+        self.svc = svc
+
+    def get(self, userId: str, id: str, format: str = "full", **_):
+        def run():
+            if id not in self.svc.by_thread:
+                raise _http_error(404, "Not Found")
+            return {"id": id, "messages": [self.svc.mailbox[i] for i in self.svc.by_thread[id]]}
+        return _Request(self.svc, run)
+
+
+class _Attachments:
+    def __init__(self, svc: FakeGmail):
+        self.svc = svc
+
+    def get(self, userId: str, messageId: str, id: str):
+        def run():
+            raise _http_error(404, "Attachment not found")
+        return _Request(self.svc, run)
+
+
+class _History:
+    def __init__(self, svc: FakeGmail):
+        self.svc = svc
+
+    def list(self, userId: str, startHistoryId: str, pageToken: Optional[str] = None, **_):
+        def run():
+            start = int(startHistoryId)
+            records = [h for h in self.svc.records if int(h["id"]) > start]
+            offset = int(pageToken or 0)
+            page = records[offset:offset + 100]
+            resp = {"history": page, "historyId": str(self.svc.history_id)}
+            if offset + len(page) < len(records):
+                resp["nextPageToken"] = str(offset + len(page))
+            return resp
+        return _Request(self.svc, run)
@@ -0,0 +1,169 @@
+"""
+Startup-time budget for each CLI command.
+
+Every command imports its subsystems lazily (see src/main.py). This script
+runs each command for real, in a fresh interpreter under
+`python -X importtime`, against the stub Ollama server (in this process) and
+the Gmail fake (in the child, behind a real service built offline).
+One untimed run first creates the command's data/ files in a scratch
+directory, so measured runs start the way a user's second command does.
+The clock covers `import src.main` plus the whole invocation, so modules a
+command only loads at run time (chromadb for `memory`, …) count too. The
+script reports that wall time and the import time inside it, and fails when
+a command goes over its budget or pulls in a subsystem it should not need
+(e.g. `memory` loading the Gmail client stack).
+
+    python -m bench.startup              # run from the repo root
+    python -m bench.startup --runs 5 --scale 2.0
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+import click
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT = "STARTUP_RESULT "
+MARK = "STARTUP_CLOCK"
+MAILBOX = 20
+
+GOOGLE = ("googleapiclient", "google_auth_oauthlib")
+CHROMA = ("chromadb",)
+
+# command: (CLI arguments, wall-time budget in ms, packages it must not load); {msg} = a fake message id
+COMMANDS = {
+    "--help":  (["--help"], 250, GOOGLE + CHROMA),
+    "queue":   (["queue"], 300, GOOGLE + CHROMA),
+    "fetch":   (["fetch", "--n", "5"], 800, CHROMA),
+    "memory":  (["memory", "invoice overdue", "--k", "3"], 2000, GOOGLE),
+    "suggest": (["suggest", "Invoice overdue", "Payment is due by the end of the month."], 2000, GOOGLE),
+    "reply":   (["reply", "{msg}"], 2500, ()),
+    "triage":  (["triage", "--n", "1"], 2500, ()),
+    "ingest":  (["ingest", "--limit", "5"], 2500, ()),
+}
+
+# Modules each command loads when it runs; bench/suite.py imports them before its clock starts
+PRELOAD = {
+    "fetch":   ["src.daemon", "src.session", "src.store", "googleapiclient.discovery", "google_auth_oauthlib.flow"],
+    "memory":  ["src.daemon", "src.session", "src.memory", "chromadb"],
+    "suggest": ["src.daemon", "src.session", "src.agent", "chromadb"],
+    "reply":   ["src.daemon", "src.session", "src.store", "src.agent", "chromadb", "googleapiclient.discovery",
+                "google_auth_oauthlib.flow"],
+    "triage":  ["src.daemon", "src.session", "src.store", "src.agent", "src.triage", "chromadb",
+                "googleapiclient.discovery", "google_auth_oauthlib.flow"],
+    "ingest":  ["src.daemon", "src.session", "src.ingest", "chromadb", "googleapiclient.discovery",
+                "google_auth_oauthlib.flow"],
+}
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def child(cmd: str):
+    """Run one command in this interpreter (cwd = its scratch dir) and print the timing result."""
+    from unittest.mock import patch
+    from bench.fake_gmail import FakeGmail
+
+    svc = FakeGmail(MAILBOX, replies=5)
+    args, _, forbidden = COMMANDS[cmd]
+    args = [a.format(msg=svc.order[0]) for a in args]
+    if args != ["--help"]:
+        args = ["--local", *args]  # never hand the command to a running `watch` daemon
+
+    def gmail_service():
+        # What a user with a saved token pays: the auth libraries plus a service
+        # built from the bundled discovery document; requests then go to the fake
+        from google.oauth2.credentials import Credentials  # noqa: F401
+        from google_auth_httplib2 import AuthorizedHttp  # noqa: F401
+        from googleapiclient.http import HttpMock
+        from src.gmail_client import build_service
+        build_service(http=HttpMock())
+        return svc
+
+    print(MARK, file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    from src.main import cli
+    code = 0
+    with patch("src.gmail_client.get_service", gmail_service):
+        try:
+            cli.main(args, prog_name="src.main", standalone_mode=False)
+        except SystemExit as e:
+            code = e.code or 0
+        except Exception as e:  # report, don't hide, a command that crashed
+            code, _ = 1, print(f"{type(e).__name__}: {e}")
+    elapsed = time.perf_counter() - start
+    loaded = {m.split(".")[0] for m in sys.modules}
+    print(RESULT + json.dumps({"ms": elapsed * 1000, "exit": code,
+                               "leaked": sorted(p for p in forbidden if p in loaded)}), flush=True)
+
+
+def run(cmd: str, workdir: str, ollama_url: str) -> dict:
+    """One fresh interpreter; adds the import time counted after the clock started."""
+    env = {**os.environ, "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+           "OLLAMA_BASE_URL": ollama_url, "OLLAMA_WARMUP": "0"}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-m", "bench.startup", "--child", cmd],
+                          cwd=workdir, env=env, capture_output=True, text=True)
+    result = next((json.loads(line[len(RESULT):]) for line in reversed(proc.stdout.splitlines())
+                   if line.startswith(RESULT)), None)
+    if result is None or result["exit"]:
+        raise click.ClickException(f"`{cmd}` failed:\n{proc.stdout[-2000:]}{proc.stderr[-2000:]}")
+    imports, timed = 0, False
+    for line in proc.stderr.splitlines():
+        if line == MARK:
+            timed = True
+            continue
+        m = _LINE.match(line)
+        if timed and m and len(m.group(3)) == 1:  # top-level import: its cumulative time includes children
+            imports += int(m.group(2))
+    return {**result, "import_ms": imports / 1000}
+
+
+def measure(cmd: str, runs: int, ollama_url: str) -> dict:
+    """Median wall and import time of `runs` invocations after one untimed setup run."""
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    try:
+        run(cmd, workdir, ollama_url)
+        results = [run(cmd, workdir, ollama_url) for _ in range(runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"ms": statistics.median(r["ms"] for r in results),
+            "import_ms": statistics.median(r["import_ms"] for r in results),
+            "leaked": sorted({p for r in results for p in r["leaked"]})}
+
+
+@click.command()
+@click.option("--runs", default=3, help="Fresh interpreters per command (median is reported)")
+@click.option("--scale", default=1.0, help="Multiply every budget (slow CI machines)")
+@click.option("--child", "single", default=None, hidden=True)
+def main(runs, scale, single):
+    if single:
+        return child(single)
+
+    console = Console()
+    table = Table(title="CLI startup (real invocation)", box=box.ROUNDED)
+    for col in ("Command", "Wall ms", "Import ms", "Budget ms", "Unexpected packages", "Status"):
+        table.add_column(col)
+
+    from bench.stub_ollama import StubOllama
+    failed = False
+    with StubOllama() as stub:  # in this process, so the children's clocks only see the CLI
+        results = {cmd: measure(cmd, runs, stub.url) for cmd in COMMANDS}
+    for cmd, (_, budget, _) in COMMANDS.items():
+        r = results[cmd]
+        ok = r["ms"] <= budget * scale and not r["leaked"]
+        failed |= not ok
+        table.add_row(cmd, f"{r['ms']:.0f}", f"{r['import_ms']:.0f}", f"{budget * scale:.0f}",
+                      ", ".join(r["leaked"]) or "-", "[green]ok[/]" if ok else "[red]over[/]")
+    console.print(table)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Stub Ollama server for offline benchmarks.
+
+Implements the endpoints the app calls – `/api/generate` (streamed and not),
+`/api/embed`, the legacy `/api/embeddings` and `/api/tags` – with a
+configurable per-request latency and per-token generation delay, so
+`reply`/`suggest`/`memory` can be timed without a model on the machine.
+Embeddings are deterministic (hash of the text), unit-length and
+`dim`-dimensional, so vector search behaves like it does on real data.
+
+    python -m bench.stub_ollama --port 11434 --latency-ms 30 --token-ms 5
+"""
+import re
+import json
+import math
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import click
+
+REPLY = ("Thanks for the update. I have reviewed the details and will follow up "
+         "with the remaining items by end of day tomorrow.")
+
+
+def fake_embedding(text: str, dim: int = 768) -> List[float]:
+    """Deterministic unit vector for `text`."""
+    raw = b""
+    seed = text.encode("utf-8")
+    while len(raw) < dim:
+        seed = hashlib.sha256(seed).digest()
+        raw += seed
+    vec = [b / 127.5 - 1.0 for b in raw[:dim]]
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class StubOllama:
+    """
+    In-process stub server; use as a context manager or call start()/stop().
+    `latency_ms` is added to every request, `token_ms` to every generated token.
+    """
+
+    def __init__(self, port: int = 0, latency_ms: float = 0.0, token_ms: float = 0.0,
+                 dim: int = 768, reply: str = REPLY):
+        self.port = port
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.dim = dim
+        self.reply = reply
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self) -> "StubOllama":
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _count(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code: int, obj):
+                data = json.dumps(obj).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _chunk(self, obj):
+                data = (json.dumps(obj) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self):
+                stub._count(self.path)
+                if self.path == "/api/tags":
+                    return self._send(200, {"models": []})
+                self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                stub._count(self.path)
+                time.sleep(stub.latency_ms / 1000)
+                # Like Ollama: a string keep_alive must be a duration with a unit ("30m", "-1m")
+                ka = body.get("keep_alive")
+                if isinstance(ka, str) and not re.fullmatch(r"-?(\d+(\.\d+)?(ns|us|µs|ms|s|m|h))+", ka):
+                    return self._send(400, {"error": f'time: missing unit in duration "{ka}"'})
+
+                if self.path == "/api/embed":
+                    texts = body.get("input") or []
+                    texts = [texts] if isinstance(texts, str) else texts
+                    return self._send(200, {"embeddings": [fake_embedding(t, stub.dim) for t in texts]})
+                if self.path == "/api/embeddings":
+                    return self._send(200, {"embedding": fake_embedding(body.get("prompt", ""), stub.dim)})
+                if self.path == "/api/generate":
+                    return self._generate(body)
+                self._send(404, {"error": "not found"})
+
+            def _generate(self, body):
+                words = stub.reply.split()
+                prompt_tokens = len(body.get("prompt", "")) // 4
+                stats = {"prompt_eval_count": prompt_tokens, "eval_count": len(words)}
+                if not body.get("stream", True):
+                    time.sleep(stub.token_ms * len(words) / 1000)
+                    return self._send(200, {"response": stub.reply, "done": True, **stats})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    time.sleep(stub.token_ms / 1000)
+                    self._chunk({"response": word if i == 0 else " " + word, "done": False})
+                self._chunk({"response": "", "done": True, **stats})
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+@click.command()
+@click.option("--port", default=11434, help="Port to listen on")
+@click.option("--latency-ms", default=0.0, help="Delay added to every request")
+@click.option("--token-ms", default=0.0, help="Delay per generated token")
+def main(port, latency_ms, token_ms):
+    with StubOllama(port, latency_ms, token_ms) as stub:
+        click.echo(f"Stub Ollama listening on {stub.url} (Ctrl+C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
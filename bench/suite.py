@@ -0,0 +1,218 @@
+"""
+Offline end-to-end benchmarks for the CLI commands.
+
+Runs `fetch`, `triage`, `ingest`, `reply`, `memory` and `suggest` against the stub
+Ollama server (bench/stub_ollama.py) and the in-memory Gmail fake
+(bench/fake_gmail.py), at several mailbox and memory-store sizes. Each case
+runs in a fresh interpreter inside a scratch directory, so the real `data/`
+is never touched and peak RSS is per case. Imports are done before the clock
+starts – import time is bench/startup.py's job; this measures the work.
+
+    python -m bench.suite                                   # run from the repo root
+    python -m bench.suite --mailbox-sizes 100,500 --memory-sizes 100,5000 --repeat 5
+    python -m bench.suite --save bench/baseline.json
+    python -m bench.suite --baseline bench/baseline.json --tolerance 0.25
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+import click
+from rich.console import Console
+from rich.table import Table
+from rich import box
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT = "BENCH_RESULT "
+
+# case: (CLI command, what the size means)
+CASES = {
+    "fetch-cold": ("fetch", "mailbox"),
+    "fetch-warm": ("fetch", "mailbox"),
+    "triage":     ("triage", "mailbox"),
+    "ingest":     ("ingest", "mailbox"),
+    "reply":      ("reply", "memory"),
+    "memory":     ("memory", "memory"),
+    "suggest":    ("suggest", "memory"),
+}
+
+
+def _sizes(raw: str):
+    return [int(s) for s in raw.split(",") if s.strip()]
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def _seed_memory(count: int):
+    from src.memory import Memory
+    from bench.fake_gmail import SENDERS, SENTENCES, SUBJECTS
+    mem = Memory("emails")
+    for start in range(0, count, 500):
+        docs, metas, ids = [], [], []
+        for n in range(start, min(start + 500, count)):
+            name, addr = SENDERS[n % len(SENDERS)]
+            body = " ".join(SENTENCES[(n + i) % len(SENTENCES)] for i in range(4))
+            docs.append(f"SUBJECT: {SUBJECTS[n % len(SUBJECTS)].format(n=n)}\nLABEL: work\n"
+                        f"FROM: {name} <{addr}>\nBODY: {body}\nDRAFT: Thanks, noted. Reply {n}.")
+            metas.append({"label": "work", "sender": f"{name} <{addr}>", "type": "draft"})
+            ids.append(f"seed-{n}")
+        mem.add(docs, metas, ids)
+    mem.flush()
+
+
+def run_case(case: str, size: int, rtt_ms: float, latency_ms: float, token_ms: float) -> dict:
+    """Set up, time and measure one case in this process (called in a child interpreter)."""
+    from unittest.mock import patch
+    from click.testing import CliRunner
+    from bench.startup import PRELOAD
+    from bench.stub_ollama import StubOllama
+    from bench.fake_gmail import FakeGmail, MAX_LIST
+
+    command, scale = CASES[case]
+    for module in PRELOAD[command]:
+        __import__(module)
+    from src.main import cli, short_id
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    stub = StubOllama(latency_ms=latency_ms, token_ms=token_ms).start()
+    os.environ.update(OLLAMA_BASE_URL=stub.url, OLLAMA_WARMUP="0")
+    svc = FakeGmail(size=size if scale == "mailbox" else 200, rtt_ms=rtt_ms,
+                    replies=size if case == "ingest" else 0)
+    runner = CliRunner()
+
+    def invoke(*args):
+        # --local: never hand the command to a `watch` daemon that happens to be running
+        result = runner.invoke(cli, ["--local", *args], catch_exceptions=False)
+        if result.exit_code:
+            raise SystemExit(f"{case}: {' '.join(args)} exited {result.exit_code}\n{result.output}")
+
+    try:
+        with patch("src.gmail_client.get_service", return_value=svc):
+            n = min(size, MAX_LIST)
+            if case == "fetch-cold":
+                args, items = ["fetch", "--n", str(n)], n
+            elif case == "fetch-warm":
+                invoke("fetch", "--n", str(n))
+                svc.deliver(10)
+                args, items = ["fetch", "--n", str(n)], n
+            elif case == "triage":
+                n = min(size, 200)
+                args, items = ["triage", "--n", str(n)], n
+            elif case == "ingest":
+                args, items = ["ingest"], size
+            else:
+                _seed_memory(size)
+                invoke("fetch", "--n", "50")
+                target = svc.order[7]
+                args, items = {
+                    "reply":   (["reply", short_id(target)], 1),
+                    "memory":  (["memory", "invoice overdue payment", "--k", "5"], 1),
+                    "suggest": (["suggest", "Invoice overdue", "Payment is due by the end of the month."], 1),
+                }[case]
+
+            svc.calls.clear()
+            stub.requests.clear()
+            start = time.perf_counter()
+            invoke(*args)
+            elapsed = time.perf_counter() - start
+    finally:
+        stub.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "case": case, "size": size, "ms": elapsed * 1000, "items": items,
+        "per_s": items / elapsed if elapsed else 0.0, "rss_mb": _peak_rss_mb(),
+        "gmail_calls": sum(svc.calls.values()), "ollama_calls": sum(stub.requests.values()),
+    }
+
+
+def spawn(case: str, size: int, rtt_ms: float, latency_ms: float, token_ms: float) -> dict:
+    """Run one case in a fresh interpreter and parse its result line."""
+    env = {**os.environ, "PYTHONPATH": ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    proc = subprocess.run(
+        [sys.executable, "-m", "bench.suite", "--case", case, "--size", str(size), "--rtt-ms", str(rtt_ms),
+         "--latency-ms", str(latency_ms), "--token-ms", str(token_ms)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    for line in reversed(proc.stdout.splitlines()):
+        if line.startswith(RESULT):
+            return json.loads(line[len(RESULT):])
+    raise click.ClickException(f"{case} (size {size}) failed:\n{proc.stdout[-2000:]}{proc.stderr[-2000:]}")
+
+
+def compare(results, baseline, tolerance: float):
+    """Keys of results that are slower or larger than the baseline by more than `tolerance`."""
+    base = {(b["case"], b["size"]): b for b in baseline}
+    regressions = set()
+    for r in results:
+        b = base.get((r["case"], r["size"]))
+        if b and (r["ms"] > b["ms"] * (1 + tolerance) or r["rss_mb"] > b["rss_mb"] * (1 + tolerance)):
+            regressions.add((r["case"], r["size"]))
+    return regressions
+
+
+@click.command()
+@click.option("--cases", default=",".join(CASES), help="Comma-separated cases to run")
+@click.option("--mailbox-sizes", default="100,500", help="Mailbox sizes for fetch/triage/ingest")
+@click.option("--memory-sizes", default="100,2000", help="Memory-store sizes for reply/memory/suggest")
+@click.option("--repeat", default=3, help="Fresh runs per case (median latency, max RSS)")
+@click.option("--rtt-ms", default=20.0, help="Simulated Gmail round-trip time")
+@click.option("--latency-ms", default=5.0, help="Simulated Ollama per-request latency")
+@click.option("--token-ms", default=2.0, help="Simulated Ollama per-token generation time")
+@click.option("--save", type=click.Path(dir_okay=False), default=None, help="Write results as JSON")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Fail when a case regresses against this saved JSON")
+@click.option("--tolerance", default=0.25, help="Allowed slowdown / RSS growth vs the baseline")
+@click.option("--case", "single", default=None, hidden=True)
+@click.option("--size", default=0, hidden=True)
+def main(cases, mailbox_sizes, memory_sizes, repeat, rtt_ms, latency_ms, token_ms, save, baseline,
+         tolerance, single, size):
+    if single:
+        print(RESULT + json.dumps(run_case(single, size, rtt_ms, latency_ms, token_ms)), flush=True)
+        return
+
+    console = Console()
+    results = []
+    for case in [c.strip() for c in cases.split(",") if c.strip()]:
+        if case not in CASES:
+            raise click.BadParameter(f"unknown case {case!r} (choose from {', '.join(CASES)})")
+        for n in _sizes(mailbox_sizes if CASES[case][1] == "mailbox" else memory_sizes):
+            console.print(f"[dim]{case} @ {n}…[/]")
+            runs = [spawn(case, n, rtt_ms, latency_ms, token_ms) for _ in range(repeat)]
+            results.append({**runs[0], "ms": statistics.median(r["ms"] for r in runs),
+                            "per_s": statistics.median(r["per_s"] for r in runs),
+                            "rss_mb": max(r["rss_mb"] for r in runs)})
+
+    regressions = set()
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), tolerance)
+
+    table = Table(title="Offline benchmarks", box=box.ROUNDED)
+    for col in ("Case", "Size", "Median ms", "Items/s", "Peak RSS MB", "Gmail calls", "Ollama calls", "Status"):
+        table.add_column(col)
+    for r in results:
+        bad = (r["case"], r["size"]) in regressions
+        table.add_row(r["case"], str(r["size"]), f"{r['ms']:.0f}", f"{r['per_s']:.1f}", f"{r['rss_mb']:.0f}",
+                      str(r["gmail_calls"]), str(r["ollama_calls"]),
+                      "[red]regressed[/]" if bad else "[green]ok[/]")
+    console.print(table)
+
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
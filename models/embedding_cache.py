@@ -0,0 +1,145 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Dict, List
+from pydantic import BaseModel, Field, PrivateAttr
+from models.embeddings import OllamaEmbeddingFunction
+from src.utils.metrics import count
+
+CACHE_PATH = os.path.join("data", "embed_cache.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model     TEXT NOT NULL,
+    digest    TEXT NOT NULL,
+    vec       BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, digest)
+);
+CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used);
+"""
+
+
+class CachedEmbeddingFunction(BaseModel):
+    """
+    Content-addressed, on-disk cache in front of an embedding function.
+
+    Vectors are keyed by (model name, SHA-256 of the text) and stored as
+    packed float32. When the cache grows past `max_bytes` the least recently
+    used entries are evicted. Only texts not seen before reach the server.
+    """
+    inner: OllamaEmbeddingFunction = Field(default_factory=OllamaEmbeddingFunction)
+    path: str = CACHE_PATH
+    max_bytes: int = Field(default_factory=lambda: int(os.getenv("EMBED_CACHE_MB", "256")) * 1024 * 1024)
+
+    _conn: sqlite3.Connection = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _bytes: int = PrivateAttr(default=0)
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        row = self._conn.execute("SELECT COALESCE(SUM(length(vec)), 0) FROM embeddings").fetchone()
+        self._bytes = row[0]
+
+    # Same name as the wrapped function so Chroma sees no embedding-function change
+    def name(self) -> str:
+        return self.inner.name()
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        if not input:
+            return []
+        model = self.inner.model
+        digests = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in input]
+        found = self._lookup(model, set(digests))
+
+        todo = {}  # digest -> text, de-duplicated
+        for d, t in zip(digests, input):
+            if d not in found:
+                todo.setdefault(d, t)
+        hits = len(input) - sum(1 for d in digests if d in todo)
+        with self._lock:
+            self._hits += hits
+            self._misses += len(todo)
+        count("embed_cache_hits", hits)
+        count("embed_cache_misses", len(todo))
+
+        if todo:
+            vectors = self.inner(list(todo.values()))
+            # Round through float32 so cached and fresh results are identical
+            fresh = {d: array("f", v).tolist() for d, v in zip(todo.keys(), vectors)}
+            self._store(model, fresh)
+            found.update(fresh)
+        return [found[d] for d in digests]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {"hits": self._hits, "misses": self._misses, "entries": entries, "bytes": self._bytes}
+
+    # ------------------------------------------------------------------ #
+    # Storage
+    # ------------------------------------------------------------------ #
+    def _lookup(self, model: str, digests: set) -> Dict[str, List[float]]:
+        found = {}
+        keys = list(digests)
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT digest, vec FROM embeddings WHERE model = ? AND digest IN ({marks})",
+                    [model, *chunk],
+                )
+                for digest, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[digest] = vec.tolist()
+            if found:
+                now = time.time()
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND digest = ?",
+                        [(now, model, d) for d in found],
+                    )
+        return found
+
+    def _store(self, model: str, vectors: Dict[str, List[float]]):
+        now = time.time()
+        rows = [(model, d, array("f", v).tobytes(), now) for d, v in vectors.items()]
+        digests = list(vectors)
+        with self._lock, self._conn:
+            replaced = 0  # bytes of rows being overwritten (another process may have cached them first)
+            for start in range(0, len(digests), 500):
+                chunk = digests[start:start + 500]
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(length(vec)), 0) FROM embeddings "
+                    f"WHERE model = ? AND digest IN ({','.join('?' * len(chunk))})",
+                    (model, *chunk),
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, digest, vec, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._bytes += sum(len(r[2]) for r in rows) - replaced
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is at 90% of its budget."""
+        target = int(self.max_bytes * 0.9)
+        freed, doomed = 0, []
+        cur = self._conn.execute("SELECT model, digest, length(vec) FROM embeddings ORDER BY last_used")
+        for model, digest, size in cur:
+            if self._bytes - freed <= target:
+                break
+            doomed.append((model, digest))
+            freed += size
+        cur.close()
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND digest = ?", doomed)
+        self._bytes -= freed
@@ -1,26 +1,72 @@
 import os
-import requests
-from typing import List
-from pydantic import BaseModel, Field
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+from pydantic import BaseModel, Field, PrivateAttr
+from models.ollama_client import base_url, get_session, keep_alive
+from src.utils.metrics import count, span
+
+
+def _normalize(vec: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vec))
+    return [x / norm for x in vec] if norm else vec
 
 
 class OllamaEmbeddingFunction(BaseModel):
-    """Lightweight embedding function using Ollama's local API."""
+    """
+    Lightweight embedding function using Ollama's local API.
+
+    Texts are sent `batch_size` at a time to the multi-input `/api/embed`
+    endpoint over the shared keep-alive session; with `max_workers > 1`
+    batches are sent in parallel. Servers without `/api/embed` fall back to
+    the per-text `/api/embeddings` endpoint. Vectors are always unit length,
+    matching what `/api/embed` returns.
+    """
     model: str = Field(default_factory=lambda: os.getenv("EMBED_MODEL", "nomic-embed-text"))
-    base_url: str = Field(default_factory=lambda: os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
+    base_url: str = Field(default_factory=base_url)
+    keep_alive: Union[str, int] = Field(default_factory=keep_alive)
     timeout: int = 120
+    batch_size: int = Field(default_factory=lambda: int(os.getenv("EMBED_BATCH_SIZE", "64")))
+    max_workers: int = Field(default_factory=lambda: int(os.getenv("EMBED_WORKERS", "1")))
+
+    _batch_supported: Optional[bool] = PrivateAttr(default=None)
 
     # Chroma calls this to compare persisted vs. supplied embedding functions
     def name(self) -> str:
         return f"ollama_{self.model}"
 
     def __call__(self, input: List[str]) -> List[List[float]]:
-        url = f"{self.base_url}/api/embeddings"
-        vectors = []
-        for text in input:
-            payload = {"model": self.model, "prompt": text}
-            r = requests.post(url, json=payload, timeout=self.timeout)
-            r.raise_for_status()
-            data = r.json()
-            vectors.append(data.get("embedding", []))
-        return vectors
\ No newline at end of file
+        if not input:
+            return []
+        size = max(1, self.batch_size)
+        batches = [input[i:i + size] for i in range(0, len(input), size)]
+        count("embed_texts", len(input), model=self.model)
+        with span("embed", model=self.model):
+            if self.max_workers > 1 and len(batches) > 1:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+                    results = list(pool.map(self._embed_batch, batches))
+            else:
+                results = [self._embed_batch(b) for b in batches]
+        return [vec for batch in results for vec in batch]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if self._batch_supported is not False:
+            r = get_session().post(
+                f"{self.base_url}/api/embed",
+                json={"model": self.model, "input": texts, "keep_alive": self.keep_alive},
+                timeout=self.timeout,
+            )
+            if r.status_code not in (404, 405):
+                r.raise_for_status()
+                self._batch_supported = True
+                return r.json().get("embeddings", [])
+            # Older Ollama without /api/embed (a missing model also 404s and
+            # is then reported by the per-text endpoint below)
+            self._batch_supported = False
+        return [self._embed_one(t) for t in texts]
+
+    def _embed_one(self, text: str) -> List[float]:
+        payload = {"model": self.model, "prompt": text, "keep_alive": self.keep_alive}
+        r = get_session().post(f"{self.base_url}/api/embeddings", json=payload, timeout=self.timeout)
+        r.raise_for_status()
+        return _normalize(r.json().get("embedding", []))
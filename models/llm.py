@@ -1,10 +1,17 @@
 import os
-import requests
+import json
+import time
+from typing import Iterator, Union
 from pydantic import BaseModel, Field
+from models.ollama_client import base_url, get_session, keep_alive
+from src.utils.metrics import count, metrics, span
 
 class LocalLLM(BaseModel):
     model: str = Field(default_factory=lambda: os.getenv("OLLAMA_MODEL", "gemma3:270m"))
-    base_url: str = Field(default_factory=lambda: os.getenv("OLLAMA_BASE_URL", "http://localhost:11434"))
+    base_url: str = Field(default_factory=base_url)
+    keep_alive: Union[str, int] = Field(default_factory=keep_alive)
+    # Context window requested from Ollama; the prompt builder budgets against the same value
+    num_ctx: int = Field(default_factory=lambda: int(os.getenv("OLLAMA_NUM_CTX", "2048")))
     timeout: int = 120
 
     def generate(self, prompt: str, temperature: float = 0.2) -> str:
@@ -13,10 +20,45 @@ class LocalLLM(BaseModel):
         payload = {
             "model": self.model,
             "prompt": prompt,
-            "options": {"temperature": temperature},
-            "stream": False
+            "options": {"temperature": temperature, "num_ctx": self.num_ctx},
+            "stream": False,
+            "keep_alive": self.keep_alive
         }
-        r = requests.post(url, json=payload, timeout=self.timeout)
-        r.raise_for_status()
-        data = r.json()
+        with span("llm.generate", model=self.model):
+            r = get_session().post(url, json=payload, timeout=self.timeout)
+            r.raise_for_status()
+            data = r.json()
+        self._count_tokens(data)
         return data.get("response", "").strip()
+
+    def generate_stream(self, prompt: str, temperature: float = 0.2) -> Iterator[str]:
+        """Yield response tokens as the local Ollama model produces them."""
+        url = f"{self.base_url}/api/generate"
+        payload = {
+            "model": self.model,
+            "prompt": prompt,
+            "options": {"temperature": temperature, "num_ctx": self.num_ctx},
+            "stream": True,
+            "keep_alive": self.keep_alive
+        }
+        start, first = time.perf_counter(), True
+        with span("llm.generate_stream", model=self.model), \
+                get_session().post(url, json=payload, timeout=self.timeout, stream=True) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("response"):
+                    if first:
+                        metrics.observe("llm.first_token", time.perf_counter() - start, model=self.model)
+                        first = False
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    self._count_tokens(chunk)
+                    break
+
+    def _count_tokens(self, data: dict):
+        # Ollama reports prompt/completion token counts on the final response
+        count("llm_prompt_tokens", data.get("prompt_eval_count", 0), model=self.model)
+        count("llm_completion_tokens", data.get("eval_count", 0), model=self.model)
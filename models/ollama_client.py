@@ -0,0 +1,112 @@
+import os
+import re
+import threading
+import requests
+from typing import Dict, List, Optional, Union
+from requests.adapters import HTTPAdapter
+from src.utils.logger import warn
+
+# Shared by LocalLLM and OllamaEmbeddingFunction: one keep-alive pool per process
+POOL_SIZE = 16
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def base_url() -> str:
+    return os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+
+def keep_alive() -> Union[str, int]:
+    """
+    How long Ollama keeps a model loaded after a request (e.g. "30m", -1 = forever).
+    Ollama parses a string as a duration with a unit, so a bare number is sent
+    as an int (seconds; negative = forever).
+    """
+    value = os.getenv("OLLAMA_KEEP_ALIVE", "30m").strip()
+    return int(value) if re.fullmatch(r"-?\d+", value) else value
+
+
+def get_session() -> requests.Session:
+    """Process-wide pooled session, so every Ollama call reuses warm TCP connections."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _session = s
+    return _session
+
+
+def warm_up(llm_model: Optional[str] = None, embed_model: Optional[str] = None, timeout: int = 120):
+    """
+    Load the generation and embedding models into Ollama memory ahead of use.
+    An empty generate prompt only loads the model; failures are non-fatal but
+    logged, so a request Ollama rejects does not go unnoticed until first use.
+    """
+    session = get_session()
+    llm_model = llm_model or os.getenv("OLLAMA_MODEL", "gemma3:270m")
+    embed_model = embed_model or os.getenv("EMBED_MODEL", "nomic-embed-text")
+    calls = [
+        ("/api/generate", {"model": llm_model, "keep_alive": keep_alive()}),
+        ("/api/embed", {"model": embed_model, "input": [""], "keep_alive": keep_alive()}),
+    ]
+    for path, payload in calls:
+        try:
+            r = session.post(f"{base_url()}{path}", json=payload, timeout=timeout)
+        except requests.RequestException as e:
+            warn(f"Ollama warm-up of {payload['model']} failed: {e}")
+            continue
+        if not r.ok:
+            warn(f"Ollama warm-up of {payload['model']} rejected ({r.status_code}): {r.text[:200]}")
+
+
+def warm_up_background() -> threading.Thread:
+    """Start `warm_up` on a daemon thread so model loading overlaps other startup work."""
+    t = threading.Thread(target=warm_up, name="ollama-warmup", daemon=True)
+    t.start()
+    return t
+
+
+class AsyncOllamaClient:
+    """
+    Async variant over a pooled httpx client, for callers that overlap many
+    generate/embed requests from one event loop.
+
+        async with AsyncOllamaClient() as client:
+            text = await client.generate("gemma3:270m", prompt)
+    """
+
+    def __init__(self, url: Optional[str] = None, timeout: float = 120, max_connections: int = POOL_SIZE):
+        import httpx  # only async callers pay for httpx
+        self.base_url = url or base_url()
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def generate(self, model: str, prompt: str, options: Optional[Dict] = None) -> str:
+        payload = {"model": model, "prompt": prompt, "options": options or {},
+                   "stream": False, "keep_alive": keep_alive()}
+        r = await self.client.post("/api/generate", json=payload)
+        r.raise_for_status()
+        return r.json().get("response", "").strip()
+
+    async def embed(self, model: str, texts: List[str]) -> List[List[float]]:
+        payload = {"model": model, "input": texts, "keep_alive": keep_alive()}
+        r = await self.client.post("/api/embed", json=payload)
+        r.raise_for_status()
+        return r.json().get("embeddings", [])
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -1,14 +1,21 @@
 import os
 import re
+import hashlib
 import textwrap
-from typing import Optional
+from typing import Callable, Dict, Optional, Tuple
 from models.llm import LocalLLM
-from src.prompts import REFINE_TEMPLATE
-from src.utils.text import clean_html
+from src.prompts import AGENT_PREAMBLE, DRAFT_TEMPLATE, PROMPT_VERSION, REFINE_TEMPLATE, SUGGEST_TEMPLATE
+from src.prompt_builder import PromptBuilder
+from src.utils.html_text import extract_text
 from src.utils.logger import info
-from src.memory import Memory
+from src.utils.metrics import span
+from src.memory import MEMORY_BODY_CHARS, Memory
 from src.classifier import classify_email
 
+# Upper bound on visible body text extracted per email; the prompt builder
+# decides how much of it fits the model's context window
+BODY_CHARS = 4000
+
 
 class EmailAgent:
     """
@@ -26,10 +33,20 @@ class EmailAgent:
         self.org = os.getenv("ORG_NAME", "One Data Software Solutions").strip()
 
         self.signature = f"Sincerely,\n{self.name}\n{self.title}\n{self.org}"
+        self.prompts = PromptBuilder(
+            AGENT_PREAMBLE.format(name=self.name, title=self.title, org=self.org, signature=self.signature),
+            num_ctx=self.llm.num_ctx,
+        )
 
     # ------------------------------------------------------------------ #
     # Utilities
     # ------------------------------------------------------------------ #
+    @staticmethod
+    def _content_id(prefix: str, *parts: str) -> str:
+        """Stable memory id (unlike the salted built-in hash(), identical across processes)."""
+        digest = hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+        return f"{prefix}::{digest}"
+
     @staticmethod
     def _extract_email(header: str) -> str:
         """Extract only the email address."""
@@ -46,62 +63,97 @@ class EmailAgent:
         part = part.replace(".", " ").strip().title()
         return part.split()[0] if part else "there"
 
+    def _generate(self, prompt: str, temperature: float,
+                  on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Run the LLM, streaming tokens to `on_token` when given."""
+        if on_token is None:
+            return self.llm.generate(prompt, temperature=temperature)
+        parts = []
+        for tok in self.llm.generate_stream(prompt, temperature=temperature):
+            parts.append(tok)
+            on_token(tok)
+        return "".join(parts).strip()
+
     # ------------------------------------------------------------------ #
     # Draft Generation
     # ------------------------------------------------------------------ #
-    def draft_reply(self, subject: str, sender: str, body_html: str) -> str:
-        """Generate a natural, human-style reply in Kapil Anandh’s tone."""
-        body = clean_html(body_html)
+    @span("agent.draft_reply")
+    def draft_reply(self, subject: str, sender: str, body_html: str,
+                    on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Generate a natural, human-style reply in Kapil Anandh’s tone.
+        Raw tokens are passed to `on_token` as they arrive; the returned draft is cleaned."""
+        draft, record = self.compose_reply(subject, sender, body_html, on_token)
+        self.remember([record])
+        return draft
+
+    @span("agent.compose_reply")
+    def compose_reply(self, subject: str, sender: str, body_html: str,
+                      on_token: Optional[Callable[[str], None]] = None) -> Tuple[str, Optional[Dict]]:
+        """
+        Draft a reply without writing memory; returns (draft, memory record for `remember`).
+        The record's metadata carries the label the draft was written for. A message
+        drafted before with the same model and prompt version returns the stored draft
+        without calling the LLM; its record is marked "stored" and `remember` skips it.
+        """
+        # Visible text only, capped at what the prompt and memory use; keywords in the same pass
+        with span("draft.extract"):
+            body, keywords = extract_text(body_html, limit=BODY_CHARS, keyword_limit=5)
         sender_name = self._sender_name(sender)
 
         # 1️⃣ Classify tone
-        cat = classify_email(subject, body[:200], sender, body_html)
+        with span("draft.classify"):
+            cat = classify_email(subject, body[:200], sender, body_html)
         label = cat.get("label", "general")
 
+        # Memoized draft for this exact input?
+        draft_id = self._content_id("draft", subject, sender, body, label, self.llm.model, PROMPT_VERSION)
+        with span("draft.memo_lookup"):
+            cached = self.mem.get([draft_id])
+        if cached:
+            draft = cached[0]["document"].rpartition("\nDRAFT: ")[2]
+            if on_token:
+                on_token(draft)
+            info("Reusing memoized draft (message unchanged since last draft).")
+            return draft.strip(), {**cached[0], "stored": True}
+
         # 2️⃣ Greeting and tone
         greeting, tone = self._context_style(label, sender_name)
-        keywords = self._extract_keywords(body)
         context_line = f"Key context: {', '.join(keywords)}.\n" if keywords else ""
 
-        # 3️⃣ Role-aware prompt
-        prompt = textwrap.dedent(f"""
-        You are {self.name}, {self.title} at {self.org}.
-        You are replying to an email from {sender_name}.
-        The sender wrote the message below — you are responding to them.
-
-        Assume you fully understand their request already.
-        Write your reply as Kapil Anandh would — direct, polite, and confident.
-        Avoid robotic phrasing or unnecessary explanations.
-
-        Tone: {tone}
-        {context_line}
-        Greeting: {greeting}
-        End with this signature exactly:\n{self.signature}
-
-        Original Email:
-        Subject: {subject}
-        Body: {body[:1200]}
-
-        Write a short reply (≤120 words) that:
-        - Sounds conversational and natural
-        - Directly answers or acknowledges the sender
-        - Uses short, clear sentences
-        - Ends with the exact signature above
-        """)
-
-        draft = self.llm.generate(prompt, temperature=0.25)
+        # 3️⃣ Role-aware prompt: shared preamble + budgeted email
+        with span("draft.prompt"):
+            prompt = self.prompts.build(
+                DRAFT_TEMPLATE,
+                fields={"sender_name": sender_name, "tone": tone, "context_line": context_line,
+                        "greeting": greeting, "subject": subject},
+                budgeted={"body": body},
+            )
+
+        with span("draft.generate"):
+            draft = self._generate(prompt, 0.25, on_token)
         draft = self._clean_output(draft, greeting)
 
-        # Save draft to memory
-        doc = f"SUBJECT: {subject}\nLABEL: {label}\nFROM: {sender}\nBODY: {body}\nDRAFT: {draft}"
+        # Memory record for the draft (persisted by `remember`)
+        doc = f"SUBJECT: {subject}\nLABEL: {label}\nFROM: {sender}\nBODY: {body[:MEMORY_BODY_CHARS]}\nDRAFT: {draft}"
+        record = {
+            "document": doc,
+            "metadata": {"label": label, "sender": sender, "type": "draft"},
+            "id": draft_id,
+        }
+        return draft.strip(), record
+
+    @span("draft.remember")
+    def remember(self, records: list):
+        """Persist draft records in one batched embedding + upsert."""
+        records = [r for r in records if r and not r.get("stored")]
+        if not records:
+            return
         self.mem.add(
-            [doc],
-            metadatas=[{"label": label, "sender": sender, "type": "draft"}],
-            ids=[f"draft::{abs(hash(doc))}"],
+            [r["document"] for r in records],
+            metadatas=[r["metadata"] for r in records],
+            ids=[r["id"] for r in records],
         )
 
-        return draft.strip()
-
     # ------------------------------------------------------------------ #
     # Tone + Greeting Mapping
     # ------------------------------------------------------------------ #
@@ -115,18 +167,6 @@ class EmailAgent:
         else:
             return f"Hello {sender_name},", "Polite and neutral"
 
-    # ------------------------------------------------------------------ #
-    # Keyword Extraction
-    # ------------------------------------------------------------------ #
-    def _extract_keywords(self, body: str, limit: int = 5) -> list:
-        words = re.findall(r"\b[a-zA-Z]{4,}\b", body.lower())
-        ignores = {"thank", "please", "email", "hello", "regards", "from", "that", "this"}
-        result = []
-        for w in words:
-            if w not in ignores and w not in result:
-                result.append(w)
-        return result[:limit]
-
     # ------------------------------------------------------------------ #
     # Cleanup Output (Improved)
     # ------------------------------------------------------------------ #
@@ -159,37 +199,26 @@ class EmailAgent:
     # ------------------------------------------------------------------ #
     # Refinement (Improved)
     # ------------------------------------------------------------------ #
-    def refine(self, draft: str, feedback: str) -> str:
+    @span("agent.refine")
+    def refine(self, draft: str, feedback: str,
+               on_token: Optional[Callable[[str], None]] = None) -> str:
         """Refine the draft naturally based on Kapil's feedback."""
         greeting = draft.splitlines()[0] if draft.splitlines() else "Hi there,"
 
-        prompt = textwrap.dedent(f"""
-        You are improving an email reply written by {self.name}, {self.title} at {self.org}.
-
-        Original draft:
-        {draft.strip()}
-
-        Feedback from Kapil (the author):
-        "{feedback.strip()}"
-
-        Task:
-        - Apply the feedback directly to the draft.
-        - Keep the same meaning and tone — do not rewrite it entirely.
-        - Do NOT repeat the feedback text literally.
-        - Preserve the greeting and closing signature exactly as they were.
-        - Make the final version sound natural and human.
-
-        Output ONLY the improved email text.
-        """)
+        prompt = self.prompts.build(
+            REFINE_TEMPLATE,
+            fields={"feedback": feedback.strip()},
+            budgeted={"draft": draft.strip()},
+        )
 
-        improved = self.llm.generate(prompt, temperature=0.25)
+        improved = self._generate(prompt, 0.25, on_token)
         improved = self._clean_output(improved, greeting)
 
         # Store refined version in memory
         self.mem.add(
             [f"FEEDBACK: {feedback}\nIMPROVED: {improved}"],
             metadatas=[{"type": "refine"}],
-            ids=[f"refine::{abs(hash(draft + feedback))}"],
+            ids=[self._content_id("refine", draft, feedback)],
         )
 
         return improved.strip()
@@ -197,18 +226,18 @@ class EmailAgent:
     # ------------------------------------------------------------------ #
     # Memory Recall
     # ------------------------------------------------------------------ #
-    def suggest_with_memory(self, subject: str, body: str) -> Optional[str]:
+    @span("agent.suggest")
+    def suggest_with_memory(self, subject: str, body: str,
+                            on_token: Optional[Callable[[str], None]] = None) -> Optional[str]:
         """Use vector memory to find similar past replies."""
         results = self.mem.search(f"{subject} {body}", k=3)
         if not results:
             return None
-        ctx = "\n\n".join([r["document"][:600] for r in results])
-        prompt = textwrap.dedent(f"""
-        You are {self.name}, {self.title} at {self.org}.
-        Use similar phrasing or tone from these past drafts:
-        {ctx}
-
-        Write a concise (≤120 words) and human-like reply in your tone.
-        Always end with your real signature.
-        """)
-        return self.llm.generate(prompt, temperature=0.2).strip()
+        # The email gets twice the share of any one example when the context is tight
+        prompt = self.prompts.build(
+            SUGGEST_TEMPLATE,
+            fields={"subject": subject},
+            budgeted={"body": body, "examples": [r["document"] for r in results]},
+            weights={"body": 1.0, "examples": 1.5},
+        )
+        return self._generate(prompt, 0.2, on_token).strip()
@@ -1,7 +1,13 @@
-from src.utils.text import heuristic_classify
+from typing import Iterable, List, Tuple
+from src.utils.text import classify_batch, heuristic_classify
 from src.utils.logger import info
 
 
 def classify_email(subject: str, snippet: str, sender: str, body: str) -> dict:
     """Fast heuristic classification (LLM is optional and removed)."""
-    return heuristic_classify(subject, snippet, sender)
\ No newline at end of file
+    return heuristic_classify(subject, snippet, sender)
+
+
+def classify_emails(emails: Iterable[Tuple[str, str, str]]) -> List[dict]:
+    """Classify many (subject, snippet, sender) tuples in one call (compiled rules are shared)."""
+    return classify_batch(emails)
@@ -0,0 +1,256 @@
+import os
+import hmac
+import json
+import time
+import base64
+import secrets
+import threading
+import urllib.error
+import urllib.request
+from typing import Dict, Iterator, Optional
+from src.utils.logger import info, warn
+
+WATCH_HOST = "127.0.0.1"
+# Shared secret of the running daemon (mode 0600); the CLI sends it as TOKEN_HEADER
+TOKEN_PATH = os.path.join("data", "watch_token")
+TOKEN_HEADER = "X-Watch-Token"
+
+
+def watch_url() -> str:
+    """Where CLI commands look for a running `watch` daemon ("" = never)."""
+    return os.getenv("WATCH_URL", f"http://{WATCH_HOST}:{os.getenv('WATCH_PORT', '8765')}")
+
+
+def new_token(path: str = TOKEN_PATH) -> str:
+    """Generate the daemon's API token and write it readable by this user only."""
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, path)
+    return token
+
+
+def read_token(path: str = TOKEN_PATH) -> Optional[str]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class Daemon:
+    """
+    `watch` mode: one warm `Session` (Gmail service, agent, Chroma) for the
+    life of the process, a poll loop that drafts newly arrived mail (and
+    sends outbox retries that came due), and a local HTTP API the CLI
+    commands use as thin clients.
+
+      GET  /health                    status, uptime, last poll
+      POST /notify                    wake the poll loop now (Gmail Pub/Sub push envelope or empty)
+      POST /fetch                     also pre-drafts the top `predraft` rows in a background thread
+      POST /fetch /triage /memory     JSON in, JSON out
+      POST /compact /approve /send    JSON in, JSON out
+      POST /retry                     JSON in, JSON out
+      POST /reply /suggest            JSON in, newline-delimited JSON render events out
+
+    Every POST must carry the token from data/watch_token (rewritten, 0600,
+    at each start) in `X-Watch-Token` and an application/json body; requests
+    with an Origin header are refused, so web pages cannot drive the API.
+    """
+
+    def __init__(self, session, interval: float = 60.0, draft: bool = True):
+        self.session = session
+        self.interval = interval
+        self.draft = draft
+        self.started = time.time()
+        self.last_poll: Optional[float] = None
+        self.drafted = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------------ #
+    # Poll loop
+    # ------------------------------------------------------------------ #
+    def notify(self, payload: Optional[Dict] = None):
+        """Push stand-in: a Pub/Sub message carries {"emailAddress", "historyId"}; any post wakes the loop."""
+        data = ((payload or {}).get("message") or {}).get("data")
+        if data:
+            try:
+                note = json.loads(base64.b64decode(data))
+                info(f"Push notification for {note.get('emailAddress', '?')} (historyId {note.get('historyId')}).")
+            except ValueError:
+                pass
+        self._wake.set()
+
+    def poll_once(self):
+        from src.store import MessageStore, sync
+        if self.draft:
+            self.drafted += len(self.session.poll())
+        else:
+            with self.session.gmail_lock:
+                sync(self.session.service, MessageStore())
+        self.session.deliver(wait=False)  # outbox retries whose backoff has elapsed
+        self.last_poll = time.time()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:  # keep serving; the next poll retries
+                warn(f"Poll failed: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    # ------------------------------------------------------------------ #
+    # HTTP API
+    # ------------------------------------------------------------------ #
+    def health(self) -> Dict:
+        return {"status": "ok", "pid": os.getpid(), "uptime_s": round(time.time() - self.started, 1),
+                "last_poll": self.last_poll, "drafted": self.drafted}
+
+    def handle(self, path: str, body: Dict):
+        """Result for a JSON endpoint, or an iterator of events for a streaming one."""
+        s = self.session
+        if path == "/notify":
+            self.notify(body)
+            return {"status": "ok"}
+        if path == "/fetch":
+            rows = s.fetch(body.get("q", ""), int(body.get("n", 5)))
+            ids = s.queue_predrafts([r["id"] for r in rows], int(body.get("predraft", 0))) if body.get("predraft") else []
+            if ids:
+                threading.Thread(target=s.predraft, args=(ids,), name="predraft", daemon=True).start()
+            return {"rows": rows, "predrafting": ids}
+        if path == "/triage":
+            return {"drafts": s.triage(body.get("q", ""), int(body.get("n", 20)), int(body.get("workers", 2)))}
+        if path == "/memory":
+            return s.memory(body["query"], int(body.get("k", 5)), body.get("where"))
+        if path == "/compact":
+            return s.compact(**body)
+        if path == "/approve":
+            return s.approve(body.get("ids", []), bool(body.get("all")))
+        if path == "/send":
+            return s.deliver()
+        if path == "/retry":
+            return s.retry(body.get("ids", []), bool(body.get("all")))
+        if path == "/reply":
+            return s.reply_events(body["msg_id"], body.get("feedback", ""), bool(body.get("send")))
+        if path == "/suggest":
+            return s.suggest_events(body["subject"], body["body"])
+        return None
+
+    def serve(self, port: int):
+        """Start the API on 127.0.0.1:`port` (daemon threads); returns the server."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        daemon = self
+        token = new_token()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, code: int, obj):
+                data = json.dumps(obj, default=str).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _chunk(self, obj):
+                data = (json.dumps(obj, default=str) + "\n").encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/health":
+                    return self._json(200, daemon.health())
+                self._json(404, {"error": f"unknown endpoint {self.path}"})
+
+            def _refusal(self) -> Optional[tuple]:
+                if self.headers.get("Origin"):  # a browser page, not the CLI
+                    return 403, "cross-origin requests are not allowed"
+                content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+                if content_type != "application/json":
+                    return 415, "Content-Type must be application/json"
+                if not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), token):
+                    return 401, f"missing or wrong {TOKEN_HEADER} (see {TOKEN_PATH})"
+                return None
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                refusal = self._refusal()
+                if refusal:
+                    self.close_connection = True  # the body is never read
+                    return self._json(refusal[0], {"error": refusal[1]})
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    result = daemon.handle(self.path, body)
+                except Exception as e:
+                    return self._json(500, {"error": str(e)})
+                if result is None:
+                    return self._json(404, {"error": f"unknown endpoint {self.path}"})
+                if isinstance(result, dict):
+                    return self._json(200, result)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for event in result:
+                        self._chunk(event)
+                except Exception as e:  # headers are out; report in-band
+                    self._chunk({"event": "error", "text": str(e)})
+                self.wfile.write(b"0\r\n\r\n")
+
+        server = ThreadingHTTPServer((WATCH_HOST, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="watch-api", daemon=True).start()
+        return server
+
+
+class DaemonClient:
+    """Thin client for a running `watch` daemon; `available()` is a cheap local probe."""
+
+    def __init__(self, url: Optional[str] = None, timeout: float = 600):
+        self.url = (url if url is not None else watch_url()).rstrip("/")
+        self.timeout = timeout
+
+    def available(self) -> bool:
+        if not self.url:
+            return False
+        try:
+            with urllib.request.urlopen(f"{self.url}/health", timeout=0.5) as r:
+                return r.status == 200
+        except (OSError, ValueError):
+            return False
+
+    def _post(self, path: str, payload: Dict):
+        headers = {"Content-Type": "application/json", TOKEN_HEADER: read_token() or ""}
+        req = urllib.request.Request(f"{self.url}{path}", data=json.dumps(payload).encode(),
+                                     headers=headers, method="POST")
+        try:
+            return urllib.request.urlopen(req, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            message = json.loads(e.read() or b"{}").get("error", e.reason)
+            raise RuntimeError(f"watch daemon: {message}") from None
+
+    def call(self, path: str, payload: Dict) -> Dict:
+        with self._post(path, payload) as r:
+            return json.loads(r.read())
+
+    def stream(self, path: str, payload: Dict) -> Iterator[Dict]:
+        with self._post(path, payload) as r:
+            for line in r:
+                if line.strip():
+                    yield json.loads(line)
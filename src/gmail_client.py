@@ -1,12 +1,24 @@
 import os
+import json
+import time
 import base64
+import random
+import threading
+from datetime import datetime, timezone
 from email.mime.text import MIMEText
-from typing import List, Dict, Optional
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from typing import Iterator, List, Dict, Optional, Tuple
 from src.utils.logger import info
+from src.utils.metrics import span
+
+# Gmail batch endpoint accepts up to 100 calls; 50 keeps us clear of per-batch rate limits
+BATCH_SIZE = 50
+# Headers needed to render a listing row (see `fetch`)
+LIST_HEADERS = ["From", "Subject"]
+# Calls failing with these (or a 403 rate-limit reason) are retried with backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+# Rounds a batched call is attempted before it is left to the caller
+BATCH_ATTEMPTS = 5
 
 # Gmail OAuth Scopes Mapping
 SCOPES_MAP = {
@@ -19,26 +31,127 @@ def _load_scopes() -> List[str]:
     raw = os.getenv("GMAIL_SCOPES", "read_only,send").split(",")
     return [SCOPES_MAP[s.strip()] for s in raw if s.strip() in SCOPES_MAP]
 
+# Refresh the access token this long before it expires (Google tokens last an hour)
+REFRESH_MARGIN_SECONDS = 300
+TOKEN_PATH = os.path.join("data", "token.json")
+CLIENT_SECRETS_PATH = "credentials.json"
+
+# Process-wide Gmail objects (see `get_service`)
+_state: Dict = {}
+_state_lock = threading.RLock()
+
+
+def discovery_document() -> Dict:
+    """
+    The Gmail v1 discovery document, parsed once per process. It ships with
+    google-api-python-client (static discovery), so no network is needed.
+    """
+    with _state_lock:
+        if "discovery" not in _state:
+            from googleapiclient import discovery_cache
+            doc = discovery_cache.get_static_doc("gmail", "v1")
+            if doc is None:
+                raise RuntimeError("google-api-python-client has no bundled Gmail discovery document; upgrade it")
+            _state["discovery"] = json.loads(doc)
+        return _state["discovery"]
+
+
+def _save_token(creds):
+    os.makedirs(os.path.dirname(TOKEN_PATH), exist_ok=True)
+    tmp = TOKEN_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as token:
+        token.write(creds.to_json())
+    os.replace(tmp, TOKEN_PATH)
+
+
+def credentials():
+    """
+    OAuth credentials kept for the life of the process: token.json is read
+    once, the access token is refreshed when it is within
+    `REFRESH_MARGIN_SECONDS` of expiry (so no call is made with a token that
+    dies in flight), and every refresh is written back to token.json. Runs
+    the browser consent flow when there is no usable token.
+    """
+    from google.auth.transport.requests import Request
+
+    with _state_lock:
+        creds = _state.get("creds")
+        scopes = _load_scopes()
+        if creds is None and os.path.exists(TOKEN_PATH):
+            from google.oauth2.credentials import Credentials
+            creds = Credentials.from_authorized_user_file(TOKEN_PATH, scopes)
+        expiring = creds is not None and creds.expiry is not None and \
+            (creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds() < REFRESH_MARGIN_SECONDS
+        if creds is None or not creds.valid or expiring:
+            if creds and creds.refresh_token:
+                with span("gmail.refresh_token"):
+                    creds.refresh(Request())
+            else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRETS_PATH, scopes)
+                creds = flow.run_local_server(port=0)
+            _save_token(creds)
+        _state["creds"] = creds
+        return creds
+
+
+def transport(creds):
+    """
+    The authorized HTTP transport every Gmail call of this process goes
+    through: one httplib2 connection pool, so TLS handshakes happen once per
+    host instead of once per command step. Each request first runs
+    `credentials()`, so a long-lived service (the `watch` daemon) refreshes
+    ahead of expiry too. Like the service, it is not thread-safe; callers
+    serialise Gmail calls (see `Session.gmail_lock`).
+    """
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+
+    class RefreshingHttp(AuthorizedHttp):
+        def request(self, *args, **kwargs):
+            credentials()
+            return super().request(*args, **kwargs)
+
+    with _state_lock:
+        http = _state.get("http")
+        if http is None or http.credentials is not creds:
+            timeout = float(os.getenv("GMAIL_HTTP_TIMEOUT", "60"))
+            http = RefreshingHttp(creds, http=httplib2.Http(timeout=timeout))
+            _state["http"] = http
+        return http
+
+
+def build_service(creds=None, http=None):
+    """
+    A Gmail service from the bundled discovery document – no discovery
+    fetch, no network at all until a request runs. Pass `http` (e.g. an
+    `HttpMock`) to build one offline in tests; with `creds` only, requests go
+    through the shared `transport`.
+    """
+    from googleapiclient.discovery import build_from_document
+
+    if http is None and creds is not None:
+        http = transport(creds)
+    return build_from_document(discovery_document(), http=http)
+
+
+@span("gmail.get_service")
 def get_service():
-    creds = None
-    token_path = os.path.join("data", "token.json")
-    cred_path = os.path.join("credentials.json")  # Fixed: was in data/
-    scopes = _load_scopes()
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, scopes)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(cred_path, scopes)
-            creds = flow.run_local_server(port=0)
-        os.makedirs("data", exist_ok=True)
-        with open(token_path, "w", encoding="utf-8") as token:
-            token.write(creds.to_json())
-    service = build("gmail", "v1", credentials=creds)
-    info("Gmail service initialized successfully.")
-    return service
+    """
+    The process-wide Gmail service: built once from the cached discovery
+    document over the shared transport, with credentials checked (and
+    refreshed ahead of expiry) on every call.
+    """
+    creds = credentials()
+    with _state_lock:
+        service = _state.get("service")
+        if service is None or _state.get("service_creds") is not creds:
+            service = build_service(creds)
+            _state.update(service=service, service_creds=creds)
+            info("Gmail service initialized successfully.")
+        return service
 
+@span("gmail.list_messages")
 def list_messages(service, query: str = None, max_results: int = 10) -> List[Dict]:
     user = os.getenv("GMAIL_USER", "me")
     resp = service.users().messages().list(
@@ -48,19 +161,183 @@ def list_messages(service, query: str = None, max_results: int = 10) -> List[Dic
     ).execute()
     return resp.get("messages", [])
 
-def get_message(service, msg_id: str) -> Dict:
+def list_message_pages(service, query: str = None, page_size: int = 500,
+                       page_token: Optional[str] = None) -> Iterator[Tuple[List[Dict], Optional[str]]]:
+    """
+    Walk every message matching `query` one page at a time, yielding
+    (messages, next_page_token); the token is None after the last page. Pass a
+    saved token back as `page_token` to resume a walk (see src/ingest.py).
+    """
+    user = os.getenv("GMAIL_USER", "me")
+    while True:
+        with span("gmail.list_page"):
+            resp = service.users().messages().list(
+                userId=user,
+                q=query or "",
+                maxResults=page_size,
+                pageToken=page_token
+            ).execute()
+        page_token = resp.get("nextPageToken")
+        yield resp.get("messages", []), page_token
+        if not page_token:
+            return
+
+def _get_request(service, msg_id: str, fmt: str, headers: Optional[List[str]]):
     user = os.getenv("GMAIL_USER", "me")
-    return service.users().messages().get(
+    kwargs = {"userId": user, "id": msg_id, "format": fmt}
+    if fmt == "metadata" and headers:
+        kwargs["metadataHeaders"] = headers
+    return service.users().messages().get(**kwargs)
+
+@span("gmail.get_message")
+def get_message(service, msg_id: str, fmt: str = "full", headers: Optional[List[str]] = None) -> Dict:
+    return _get_request(service, msg_id, fmt, headers).execute()
+
+def backoff(attempt: int, base: float, cap: float, retry_after: Optional[float] = None) -> float:
+    """Exponential backoff with full jitter; never sooner than the server's Retry-After."""
+    delay = random.uniform(0, min(cap, base * 2 ** max(attempt - 1, 0)))
+    return max(delay, retry_after or 0.0)
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """Seconds from a Retry-After header on an HttpError, if any."""
+    try:
+        return float(e.resp.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _retryable(e: Exception) -> bool:
+    """Quota/rate-limit and transient server errors; a 404 or 400 will fail the same way again."""
+    status = getattr(getattr(e, "resp", None), "status", None)
+    if status is None:
+        return False
+    status = int(status)
+    return status in RETRY_STATUSES or (status == 403 and any(r in str(e) for r in RATE_LIMIT_REASONS))
+
+def _execute_batched(service, requests: List, batch_size: int, attempts: int = BATCH_ATTEMPTS,
+                     base_delay: float = 1.0, max_delay: float = 32.0) -> Tuple[List[Optional[Dict]], List[int]]:
+    """
+    Run `requests` as Gmail batch calls; returns (responses in order, indexes
+    of failed calls). Calls that fail with a rate-limit or 5xx error (inside a
+    batch, or the whole batch) are re-batched after an exponential backoff,
+    for up to `attempts` rounds.
+    """
+    results: List[Optional[Dict]] = [None] * len(requests)
+    errors: Dict[int, Exception] = {}
+
+    def _callback(request_id, response, exception):
+        idx = int(request_id)
+        if exception is not None:
+            errors[idx] = exception
+        else:
+            results[idx] = response
+
+    pending = list(range(len(requests)))
+    for attempt in range(1, attempts + 1):
+        errors.clear()
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=_callback)
+            for idx in chunk:
+                batch.add(requests[idx], request_id=str(idx))
+            try:
+                batch.execute()
+            except Exception as e:
+                if not _retryable(e):
+                    raise
+                errors.update((idx, e) for idx in chunk if results[idx] is None)
+        pending = sorted(idx for idx, e in errors.items() if _retryable(e))
+        if not pending or attempt == attempts:
+            break
+        retry_after = max((_retry_after(errors[idx]) or 0.0) for idx in pending)
+        delay = backoff(attempt, base_delay, max_delay, retry_after)
+        info(f"{len(pending)} Gmail call(s) rate-limited or failed; retrying in {delay:.1f}s.")
+        time.sleep(delay)
+    return results, sorted(errors)
+
+@span("gmail.get_messages")
+def get_messages(service, msg_ids: List[str], fmt: str = "metadata",
+                 headers: Optional[List[str]] = None, batch_size: int = BATCH_SIZE) -> List[Dict]:
+    """
+    Hydrate many messages with Gmail batch requests (one HTTP round trip per
+    `batch_size` ids). Results come back in the order of `msg_ids`; calls that
+    still fail after the batch retries (see `_execute_batched`) are tried once
+    more on their own, so a permanent error surfaces as itself.
+    """
+    results, failed = _execute_batched(
+        service, [_get_request(service, msg_id, fmt, headers) for msg_id in msg_ids], batch_size)
+    for idx in failed:
+        results[idx] = get_message(service, msg_ids[idx], fmt, headers)
+    return results
+
+@span("gmail.get_threads")
+def get_threads(service, thread_ids: List[str], fmt: str = "full", batch_size: int = BATCH_SIZE) -> List[Dict]:
+    """Whole threads (every message, oldest first) for `thread_ids`, batched like `get_messages`."""
+    user = os.getenv("GMAIL_USER", "me")
+
+    def _request(thread_id):
+        return service.users().threads().get(userId=user, id=thread_id, format=fmt)
+
+    results, failed = _execute_batched(service, [_request(t) for t in thread_ids], batch_size)
+    for idx in failed:
+        results[idx] = _request(thread_ids[idx]).execute()
+    return results
+
+def get_profile(service) -> Dict:
+    user = os.getenv("GMAIL_USER", "me")
+    return service.users().getProfile(userId=user).execute()
+
+@span("gmail.list_history")
+def list_history(service, start_history_id: str) -> Tuple[List[Dict], str]:
+    """All history records since `start_history_id` plus the latest historyId seen."""
+    user = os.getenv("GMAIL_USER", "me")
+    records, token, latest = [], None, start_history_id
+    while True:
+        resp = service.users().history().list(
+            userId=user,
+            startHistoryId=start_history_id,
+            pageToken=token
+        ).execute()
+        records.extend(resp.get("history", []))
+        latest = resp.get("historyId", latest)
+        token = resp.get("nextPageToken")
+        if not token:
+            return records, latest
+
+@span("gmail.get_attachment")
+def get_attachment(service, msg_id: str, attachment_id: str) -> Dict:
+    """Body of a large part or attachment (`{"size", "data"}`, data base64url)."""
+    user = os.getenv("GMAIL_USER", "me")
+    return service.users().messages().attachments().get(
         userId=user,
-        id=msg_id,
-        format="full"
+        messageId=msg_id,
+        id=attachment_id
     ).execute()
 
-def send_message(service, to_addr: str, subject: str, body: str, thread_id: Optional[str] = None):
+def header_map(msg: Dict) -> Dict[str, str]:
+    """Lower-cased header name -> value for a message resource."""
+    return {h["name"].lower(): h["value"] for h in msg.get("payload", {}).get("headers", [])}
+
+@span("gmail.send_message")
+def send_message(service, to_addr: str, subject: str, body: str, thread_id: Optional[str] = None,
+                 in_reply_to: Optional[str] = None, references: Optional[str] = None,
+                 message_id: Optional[str] = None, outbox_id: Optional[str] = None):
+    """
+    One `messages.send` call (no retries – src/outbox.py paces and retries).
+    A reply needs `thread_id` plus the parent's Message-ID as `in_reply_to` and
+    its References chain for Gmail and other clients to thread it. `outbox_id`
+    goes out as an X-Outbox-Id header, so the outbox can find the sent copy.
+    """
     user = os.getenv("GMAIL_USER", "me")
     message = MIMEText(body)
     message["to"] = to_addr
     message["subject"] = subject
+    if message_id:
+        message["Message-ID"] = message_id
+    if outbox_id:
+        message["X-Outbox-Id"] = outbox_id
+    if in_reply_to:
+        message["In-Reply-To"] = in_reply_to
+        message["References"] = references or in_reply_to
     raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
     body_dict = {"raw": raw}
     if thread_id:
@@ -70,4 +347,4 @@ def send_message(service, to_addr: str, subject: str, body: str, thread_id: Opti
         body=body_dict
     ).execute()
     info(f"Sent email to {to_addr} with subject: '{subject}'")
-    return sent
\ No newline at end of file
+    return sent
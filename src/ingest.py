@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import threading
+from queue import Empty, Full, Queue
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from src.classifier import classify_email
+from src.gmail_client import BATCH_SIZE, get_threads, header_map, list_message_pages
+from src.memory import MEMORY_BODY_CHARS, Memory
+from src.mime import message_text
+from src.utils.html_text import extract_text
+from src.utils.logger import info, warn
+from src.utils.metrics import count, span
+
+CHECKPOINT_PATH = os.path.join("data", "ingest_checkpoint.json")
+SENT_QUERY = "in:sent"
+# Longest stored reply: your own words are what `suggest` retrieves as style examples
+REPLY_CHARS = 2000
+
+
+class PageDone(NamedTuple):
+    """Pipeline marker: every record of a listed page has been yielded."""
+    token: Optional[str]  # page token of the next page (None after the last)
+    listed: int
+
+
+# ---------------------------------------------------------------------- #
+# Checkpoint
+# ---------------------------------------------------------------------- #
+def load_checkpoint(path: str = CHECKPOINT_PATH) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except ValueError:
+        warn(f"Ignoring unreadable ingest checkpoint {path}.")
+        return None
+
+
+def save_checkpoint(state: Dict, path: str = CHECKPOINT_PATH):
+    """Atomic replace, so a crash leaves the previous checkpoint or the new one."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+# ---------------------------------------------------------------------- #
+# Pipeline stages (generators; nothing holds more than a page of ids)
+# ---------------------------------------------------------------------- #
+def _parent(msg: Dict, earlier: List[Dict], by_message_id: Dict[str, Dict]) -> Optional[Dict]:
+    """The message `msg` replies to: its In-Reply-To, else the latest earlier received message."""
+    parent = by_message_id.get(header_map(msg).get("in-reply-to"))
+    if parent is not None and parent is not msg:
+        return parent
+    return next((m for m in reversed(earlier) if "SENT" not in m.get("labelIds", [])), None)
+
+
+def reply_pairs(service, messages: List[Dict], batch: int = BATCH_SIZE) -> Iterator[Tuple[Dict, Optional[Dict]]]:
+    """
+    (sent message, message it answers or None) for one listed page. Whole
+    threads come back in one batched call per `batch` sent messages, so the
+    parent costs no extra round trip.
+    """
+    for start in range(0, len(messages), batch):
+        chunk = messages[start:start + batch]
+        wanted = {m["id"] for m in chunk}
+        thread_ids = list(dict.fromkeys(m["threadId"] for m in chunk))
+        for thread in get_threads(service, thread_ids, batch_size=batch):
+            msgs = thread.get("messages", [])
+            by_message_id = {header_map(m).get("message-id"): m for m in msgs}
+            for i, msg in enumerate(msgs):
+                if msg["id"] in wanted:
+                    yield msg, _parent(msg, msgs[:i], by_message_id)
+
+
+def to_record(service, sent: Dict, parent: Optional[Dict]) -> Optional[Dict]:
+    """Decode, clean and classify a sent reply into a memory record (same layout as agent drafts)."""
+    sent_headers = header_map(sent)
+    reply = extract_text(message_text(service, sent), limit=REPLY_CHARS).text
+    if not reply:
+        return None
+    if parent is not None:
+        parent_headers = header_map(parent)
+        raw = message_text(service, parent)
+        body = extract_text(raw, limit=MEMORY_BODY_CHARS).text
+        sender = parent_headers.get("from", "")
+        subject = parent_headers.get("subject") or sent_headers.get("subject", "(no subject)")
+    else:  # a conversation you started: file it under the recipient
+        raw, body = reply, ""
+        sender = sent_headers.get("to", "")
+        subject = sent_headers.get("subject", "(no subject)")
+    label = classify_email(subject, (body or reply)[:200], sender, raw).get("label", "general")
+    return {
+        "document": f"SUBJECT: {subject}\nLABEL: {label}\nFROM: {sender}\nBODY: {body}\nDRAFT: {reply}",
+        "metadata": {"label": label, "sender": sender, "type": "sent"},
+        "id": f"sent::{sent['id']}",
+    }
+
+
+def records(service, query: str, page_token: Optional[str], page_size: int, batch: int) -> Iterator:
+    """pages → (sent, parent) pairs → records, with a `PageDone` after each page."""
+    for messages, next_token in list_message_pages(service, query, page_size, page_token):
+        for sent, parent in reply_pairs(service, messages, batch):
+            try:
+                record = to_record(service, sent, parent)
+            except Exception as e:  # one undecodable message must not stop a 100k backfill
+                warn(f"Skipping {sent['id']}: {e}")
+                continue
+            if record:
+                yield record
+        yield PageDone(next_token, len(messages))
+
+
+def _prefetch(items: Iterator, depth: int) -> Iterator:
+    """
+    Run `items` in a background thread, at most `depth` ahead of the consumer,
+    so Gmail I/O and decoding overlap embedding. Errors re-raise in the consumer.
+    """
+    q: Queue = Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+    error: List[BaseException] = []
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+        except BaseException as e:
+            error.append(e)
+        put(done)
+
+    worker = threading.Thread(target=run, name="ingest-fetch", daemon=True)
+    worker.start()
+    try:
+        while True:
+            try:
+                item = q.get(timeout=0.5)
+            except Empty:
+                if worker.is_alive():
+                    continue
+                break
+            if item is done:
+                break
+            yield item
+        if error:
+            raise error[0]
+    finally:
+        stop.set()
+        worker.join()
+
+
+# ---------------------------------------------------------------------- #
+# Driver
+# ---------------------------------------------------------------------- #
+@span("ingest")
+def ingest(service, mem: Memory, query: str = SENT_QUERY, limit: int = 0, restart: bool = False,
+           page_size: int = 500, batch: int = BATCH_SIZE, write_batch: int = 256,
+           checkpoint_path: str = CHECKPOINT_PATH) -> Dict:
+    """
+    Backfill memory from sent mail and the messages they answer.
+
+    Streams `query` page by page (Gmail page tokens), fetches each page's
+    threads in batches, and embeds + upserts records `write_batch` at a time,
+    bypassing the write-behind journal. After every page the records are
+    stored and the next page token is checkpointed, so an interrupted run
+    resumes at the page it stopped in (records are keyed by message id, so
+    redoing a page is an idempotent upsert – and the embedding cache makes
+    it cheap). `limit` stops at the first page boundary past that many
+    listed messages. Returns the checkpoint state.
+    """
+    state = None if restart else load_checkpoint(checkpoint_path)
+    if state and state.get("query") != query:
+        warn(f"Checkpoint is for {state.get('query')!r}; starting {query!r} from the beginning.")
+        state = None
+    if state and state.get("complete"):
+        info(f"Ingest of {query!r} already complete ({state['stored']} records); use --restart to redo it.")
+        return state
+    state = state or {"query": query, "page_token": None, "listed": 0, "stored": 0, "complete": False}
+    if state["page_token"]:
+        info(f"Resuming ingest after {state['listed']} message(s).")
+
+    page_size = min(page_size, limit) if limit else page_size
+    start_listed, started = state["listed"], time.perf_counter()
+    pending: List[Dict] = []
+
+    def write():
+        if not pending:
+            return
+        mem.add([r["document"] for r in pending], [r["metadata"] for r in pending],
+                [r["id"] for r in pending], defer=False)
+        count("ingest_records", len(pending))
+        state["stored"] += len(pending)
+        pending.clear()
+
+    pipeline = _prefetch(records(service, query, state["page_token"], page_size, batch), depth=write_batch * 2)
+    try:
+        for item in pipeline:
+            if not isinstance(item, PageDone):
+                pending.append(item)
+                if len(pending) >= write_batch:
+                    write()
+                continue
+            write()
+            state.update(page_token=item.token, listed=state["listed"] + item.listed,
+                         complete=item.token is None, updated=int(time.time()))
+            save_checkpoint(state, checkpoint_path)
+            done = state["listed"] - start_listed
+            info(f"Ingested {state['listed']} sent message(s), {state['stored']} record(s) "
+                 f"({done / (time.perf_counter() - started):.0f} msg/s).")
+            if limit and done >= limit:
+                break
+    finally:
+        pipeline.close()
+    return state
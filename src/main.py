@@ -1,16 +1,15 @@
 import os
-import base64
 import re
 import click
 from dotenv import load_dotenv
 from rich.table import Table
 from rich.console import Console
+from rich.live import Live
+from rich.text import Text
 from rich import box
 
-from src.gmail_client import get_message, list_messages, get_service, send_message
-from src.classifier import classify_email
-from src.agent import EmailAgent
-from src.utils.text import clean_html
+# Subsystems (Gmail stack, chromadb, agent) are imported inside each command so
+# that a command only pays for what it uses; keep it that way (see bench/startup.py).
 from src.utils.logger import info
 
 console = Console()
@@ -22,10 +21,100 @@ def short_id(full_id: str) -> str:
     return full_id[:8]
 
 
+def render_events(events):
+    """
+    Print the events of a `Session` command, whether it ran in-process or in
+    the `watch` daemon. Streamed tokens render with rich Live (transient); the
+    cleaned text that follows them is printed. Returns the last streamed text.
+    """
+    live, parts, final = None, [], None
+    try:
+        for ev in events:
+            kind = ev["event"]
+            if kind == "token":
+                if live is None:
+                    live = Live(Text("…", style="dim"), console=console, refresh_per_second=15, transient=True)
+                    live.start()
+                parts.append(ev["text"])
+                live.update(Text("".join(parts)))
+                continue
+            if live is not None:
+                live.stop()
+                live, parts = None, []
+            if kind == "text":
+                final = ev["text"]
+                if final:
+                    console.print(final)
+            elif kind == "rule":
+                console.rule(ev["text"])
+            elif kind == "print":
+                console.print(ev["text"])
+            elif kind == "info":
+                info(ev["text"])
+            elif kind == "error":
+                console.print(f"[bold red]Error: {ev['text']}[/]")
+    finally:
+        if live is not None:
+            live.stop()
+    return final
+
+
+def _daemon():
+    """Client for a running `watch` daemon, or None to run the command in-process."""
+    if click.get_current_context().find_root().params.get("local"):
+        return None
+    from src.daemon import DaemonClient
+    client = DaemonClient()
+    return client if client.available() else None
+
+
+def _session():
+    from src.session import Session
+    return Session()
+
+
 @click.group()
-def cli():
+@click.option('--warm/--no-warm', default=os.getenv("OLLAMA_WARMUP", "0") == "1",
+              help='Load the Ollama models in the background while the command starts up')
+@click.option('--debug', is_flag=True, default=os.getenv("RICH_TRACEBACKS", "0") == "1",
+              help='Install rich tracebacks with local variables')
+@click.option('--timings', is_flag=True, default=os.getenv("METRICS_SUMMARY", "0") == "1",
+              help='Print a per-stage timing table when the command finishes')
+@click.option('--metrics-port', type=int, default=lambda: int(os.getenv("METRICS_PORT", "0")),
+              help='Serve Prometheus metrics on this local port while the command runs (0 = off)')
+@click.option('--local', is_flag=True, help='Run in-process even if a `watch` daemon is running')
+@click.pass_context
+def cli(ctx, warm, debug, timings, metrics_port, local):
     """Automated Email Responder Agent CLI"""
-    pass
+    if debug:
+        from src.utils.logger import install_tracebacks
+        install_tracebacks()
+    if warm:
+        from models.ollama_client import warm_up_background
+        warm_up_background()
+    if metrics_port:
+        from src.utils.metrics import metrics
+        metrics.serve_prometheus(metrics_port)
+        info(f"Prometheus metrics on http://127.0.0.1:{metrics_port}/metrics")
+    if timings:
+        ctx.call_on_close(_print_timings)
+
+
+def _print_timings():
+    from src.utils.metrics import metrics
+    table = Table(title="Stage Timings", box=box.ROUNDED)
+    for col in ("Stage", "Calls", "Total ms", "p50 ms", "p95 ms", "Max ms"):
+        table.add_column(col, justify="left" if col == "Stage" else "right")
+    for row in metrics.summary():
+        labels = ",".join(f"{k}={v}" for k, v in row["labels"].items())
+        table.add_row(row["span"] + (f" [dim]{labels}[/]" if labels else ""), str(row["count"]),
+                      f"{row['total_ms']:.1f}", f"{row['p50_ms']:.1f}", f"{row['p95_ms']:.1f}",
+                      f"{row['max_ms']:.1f}")
+    console.print(table)
+    counters = metrics.counters()
+    if counters:
+        console.print("  ".join(f"{name}={value:g}" + (f" [dim]({','.join(v for _, v in labels)})[/]" if labels else "")
+                                for (name, labels), value in sorted(counters.items())))
 
 
 # ──────────────────────────────── FETCH COMMAND ────────────────────────────────
@@ -33,26 +122,40 @@ def cli():
 @click.option('--q', default='-in:chats -category:social -category:promotions newer_than:2d',
               help='Gmail search query (default: recent personal mails)')
 @click.option('--n', default=5, help='Max results to fetch')
-def fetch(q, n):
+@click.option('--predraft', type=int, default=lambda: int(os.getenv("PREDRAFT_N", "0")),
+              help='Draft replies for the N most urgent rows in the background, for an instant `reply`')
+def fetch(q, n, predraft):
     """Fetch and display recent emails (short IDs)."""
-    svc = get_service()
-    msgs = list_messages(svc, q, n)
+    client = _daemon()
+    if client:
+        rows = client.call("/fetch", {"q": q, "n": n, "predraft": predraft})["rows"]
+    else:
+        session = _session()
+        rows = session.fetch(q, n)
+        ids = session.queue_predrafts([r["id"] for r in rows], predraft) if predraft else []
+        if ids:
+            from src.predraft import spawn
+            spawn(ids)
+
     table = Table(title="Recent Emails", box=box.ROUNDED)
     table.add_column("#", style="cyan")
     table.add_column("Short ID", style="magenta")
     table.add_column("From", style="green")
     table.add_column("Subject", style="yellow")
-
-    for i, m in enumerate(msgs, 1):
-        full = get_message(svc, m['id'])
-        hdrs = {h['name'].lower(): h['value'] for h in full['payload'].get('headers', [])}
-        frm = hdrs.get('from', '')[:40]
-        subj = hdrs.get('subject', '')[:60]
-        table.add_row(str(i), short_id(m['id']), frm, subj)
+    for i, row in enumerate(rows, 1):
+        table.add_row(str(i), short_id(row['id']), row['sender'][:40], row['subject'][:60])
 
     console.print(table)
 
 
+@cli.command(hidden=True)
+@click.argument('msg_ids', nargs=-1, required=True)
+def predraft(msg_ids):
+    """Draft replies for MSG_IDS into the pre-draft cache (started by `fetch --predraft`)."""
+    made = _session().predraft(list(msg_ids))
+    info(f"Pre-drafted {made} of {len(msg_ids)} message(s).")
+
+
 # ──────────────────────────────── REPLY COMMAND ────────────────────────────────
 @cli.command()
 @click.argument('msg_id')
@@ -60,99 +163,203 @@ def fetch(q, n):
 @click.option('--feedback', default='', help='Free-text feedback to refine the draft')
 def reply(msg_id, send, feedback):
     """Classify → draft → (optional refine) → (optional send)."""
-    svc = get_service()
-
-    # === Resolve short ID to full ===
-    if len(msg_id) < 16:
-        recent_msgs = list_messages(svc, query=None, max_results=20)
-        matching_ids = [m['id'] for m in recent_msgs if m['id'].startswith(msg_id)]
-        if not matching_ids:
-            console.print(f"[bold red]Error: No recent message found with ID starting with '{msg_id}'[/]")
-            return
-        if len(matching_ids) > 1:
-            console.print(f"[bold red]Error: Multiple messages match '{msg_id}'; use full ID or a longer prefix[/]")
-            return
-        msg_id = matching_ids[0]
-        info(f"Resolved short ID to full: {msg_id}")
-
-    full = get_message(svc, msg_id)
-
-    hdrs = {h['name'].lower(): h['value'] for h in full['payload'].get('headers', [])}
-    frm = hdrs.get('from', '')
-    subj = hdrs.get('subject', '(no subject)')
-
-    # ---------- extract email body ----------
-    payload = full.get('payload', {})
-    body_html = ''
-    if 'data' in payload.get('body', {}):
-        body_html = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', errors='ignore')
+    client = _daemon()
+    if client:
+        events = client.stream("/reply", {"msg_id": msg_id, "feedback": feedback, "send": send})
     else:
-        for p in payload.get('parts', []) or []:
-            mt = p.get('mimeType', '')
-            if mt.startswith('text/'):
-                data = p['body'].get('data', '') or ''
-                body_html = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                break
-
-    snippet = clean_html(body_html)[:140]
-    cat = classify_email(subj, snippet, frm, body_html)
-
-    agent = EmailAgent()
-
-    console.rule("Classification")
-    console.print(cat)
-
-    # --- Generate draft ---
-    draft = agent.draft_reply(subj, frm, body_html)
-
-    # --- Optional refinement with feedback ---
-    if feedback:
-        console.rule("Refined Draft (based on feedback)")
-        refined = agent.refine(draft, feedback)
-        console.print(refined)
-        final_text = refined
+        events = _session().reply_events(msg_id, feedback, send)
+    render_events(events)
+
+
+# ──────────────────────────────── TRIAGE COMMAND ────────────────────────────────
+@cli.command()
+@click.option('--q', default='-in:chats -category:social -category:promotions newer_than:2d',
+              help='Gmail search query')
+@click.option('--n', default=20, help='Max messages to draft')
+@click.option('--workers', default=2, help='Concurrent LLM drafting workers')
+def triage(q, n, workers):
+    """Draft replies for every matching message into the review queue."""
+    client = _daemon()
+    if client:
+        drafted = client.call("/triage", {"q": q, "n": n, "workers": workers})["drafts"]
     else:
-        console.rule("Draft Reply")
-        console.print(draft)
-        final_text = draft
+        drafted = _session().triage(q, n, workers)
+    _print_queue(drafted, title="Triage Results")
+
+
+def _print_queue(drafts, title="Review Queue"):
+    table = Table(title=title, box=box.ROUNDED)
+    table.add_column("Short ID", style="magenta")
+    table.add_column("Label", style="cyan")
+    table.add_column("From", style="green")
+    table.add_column("Subject", style="yellow")
+    table.add_column("Draft", style="white")
+    for d in drafts:
+        first = next((l for l in d["draft"].splitlines()[1:] if l.strip()), "")
+        table.add_row(short_id(d["msg_id"]), d["label"], d["sender"][:30], d["subject"][:40], first[:50])
+    console.print(table)
 
-    # --- Optional sending ---
-    if send:
-        to_addr = agent._extract_email(frm)
-        info(f"Sending to {to_addr} ...")
-        send_message(svc, to_addr, f"Re: {subj}", final_text)
-        info("Sent!")
+
+@cli.command()
+@click.option('--show', default=None, help='Print the full queued draft for this (short) message ID')
+@click.option('--approve', multiple=True, help='Send the queued draft for this (short) message ID (repeatable)')
+@click.option('--approve-all', is_flag=True, help='Send every pending draft')
+def queue(show, approve, approve_all):
+    """List drafts waiting for review (filled by `triage`); approve them to send."""
+    from src.store import MessageStore
+    store = MessageStore()
+    if approve or approve_all:
+        client = _daemon()
+        payload = {"ids": list(approve), "all": approve_all}
+        stats = client.call("/approve", payload) if client else _session().approve(payload["ids"], approve_all)
+        _print_send_stats(stats)
+        return
+    if show:
+        for msg_id in store.resolve_prefix(show):
+            d = store.get_draft(msg_id)
+            if d:
+                console.rule(f"{d['subject']} — {d['sender']}")
+                console.print(d["draft"])
+        return
+    _print_queue(store.drafts("pending"))
+
+
+def _print_send_stats(stats):
+    console.print(f"[bold green]{stats['sent']}[/] sent, {stats['retried']} retry(ies) scheduled, "
+                  f"[red]{stats['failed']}[/] failed" + (f", {stats['sending']} unconfirmed" if stats["sending"] else ""))
+
+
+@cli.command()
+@click.option('--list', 'list_only', is_flag=True, help='Only show the outbox, send nothing')
+@click.option('--retry', multiple=True, help='Re-queue and send the failed reply to this (short) message ID (repeatable)')
+@click.option('--retry-all', is_flag=True, help='Re-queue and send every failed reply')
+def outbox(list_only, retry, retry_all):
+    """Send queued replies (paced to the Gmail quota, retried with backoff) and show what is left."""
+    from src.store import MessageStore
+    if retry or retry_all:
+        client = _daemon()
+        payload = {"ids": list(retry), "all": retry_all}
+        stats = client.call("/retry", payload) if client else _session().retry(payload["ids"], retry_all)
+        console.print(f"{stats['requeued']} failed reply(ies) re-queued.")
+        _print_send_stats(stats)
+    elif not list_only:
+        client = _daemon()
+        _print_send_stats(client.call("/send", {}) if client else _session().deliver())
+    rows = [r for r in MessageStore().sends() if r["status"] != "sent"]
+    table = Table(title="Outbox", box=box.ROUNDED)
+    for col, style in (("Short ID", "magenta"), ("Status", "cyan"), ("To", "green"), ("Subject", "yellow"),
+                       ("Attempts", "white"), ("Last error", "red")):
+        table.add_column(col, style=style)
+    for r in rows:
+        table.add_row(short_id(r["msg_id"]), r["status"], r["to_addr"][:30], r["subject"][:40],
+                      str(r["attempts"]), (r["error"] or "")[:50])
+    console.print(table)
+    failed = sum(r["status"] == "failed" for r in rows)
+    if failed:
+        console.print(f"[red]{failed} failed[/] reply(ies) will not be sent again on their own; "
+                      f"`outbox --retry <id>` (or `--retry-all`) re-queues them.")
 
 
 # ──────────────────────────────── MEMORY COMMAND (Improved) ────────────────────────────────
 @cli.command()
 @click.argument('query')
 @click.option('--k', default=5)
-def memory(query, k):
+@click.option('--label', default=None, help='Only entries with this label (urgent/work/personal/general)')
+@click.option('--sender', default=None, help='Only entries from this exact sender header')
+@click.option('--type', 'type_', default=None, help='Only entries of this type (draft/refine/sent)')
+def memory(query, k, label, sender, type_):
     """
-    Search local vector memory (Chroma) for similar or matching emails/drafts.
-    Filters results to show only those containing the search term, with fallback to top semantic matches.
+    Search local memory for similar or matching emails/drafts.
+    Keyword (BM25) and semantic (vector) rankings are fused, so exact keyword
+    matches are found even when they are not among the nearest vectors.
     """
-    from src.memory import Memory
-    mem = Memory("emails")
-    results = mem.search(query, k=k)
+    where = {"label": label, "sender": sender, "type": type_}
+    client = _daemon()
+    found = client.call("/memory", {"query": query, "k": k, "where": where}) if client \
+        else _session().memory(query, k, where)
+    results = found["results"]
 
-    query_lower = query.lower()
-    matched = []
-    for r in results:
-        doc = r["document"].lower()
-        # Filter by keyword presence
-        if query_lower in doc:
-            matched.append(r)
-
-    if not matched:
+    if results and not any("keyword" in r["sources"] for r in results):
         console.print("[bold yellow]No exact keyword matches found — showing closest semantic results.[/]")
-        matched = results  # fallback to semantic matches
 
-    for r in matched:
+    for r in results:
         console.print("-" * 60)
         console.print(r["document"][:600])
         console.print(r["metadata"])
+        console.print(f"[dim]matched by: {', '.join(r['sources'])}[/]")
+
+    stats = found["cache"]
+    console.print(f"[dim]embedding cache: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+                  f"{stats['entries']} entries[/]")
+
+
+# ──────────────────────────────── COMPACT COMMAND ────────────────────────────────
+@cli.command()
+@click.option('--ttl-days', type=float, default=None, help='Drop memory entries older than this')
+@click.option('--per-sender', type=int, default=None, help='Keep at most this many drafts per sender')
+@click.option('--dup-distance', type=float, default=0.02,
+              help='Collapse drafts from one sender within this cosine distance (-1 disables)')
+@click.option('--body-chars', type=int, default=None, help='Truncate stored email bodies to this length')
+def compact(ttl_days, per_sender, dup_distance, body_chars):
+    """Expire, deduplicate and rebuild the memory store (memory compaction)."""
+    from src.memory import MEMORY_BODY_CHARS
+    options = dict(
+        ttl_days=ttl_days,
+        per_sender=per_sender,
+        dup_distance=None if dup_distance < 0 else dup_distance,
+        body_chars=MEMORY_BODY_CHARS if body_chars is None else body_chars,
+    )
+    # A running daemon holds the collection open, so it must do the rebuild itself
+    client = _daemon()
+    result = client.call("/compact", options) if client else _session().compact(**options)
+
+    table = Table(title="Memory Compaction", box=box.ROUNDED)
+    table.add_column("", style="cyan")
+    table.add_column("Before", style="yellow")
+    table.add_column("After", style="green")
+    b, a = result["before"], result["after"]
+    table.add_row("Entries", str(b["entries"]), str(a["entries"]))
+    table.add_row("Size on disk", f"{b['bytes'] / 1024:.0f} KB", f"{a['bytes'] / 1024:.0f} KB")
+    table.add_row("Query latency", f"{b['query_ms']:.1f} ms", f"{a['query_ms']:.1f} ms")
+    console.print(table)
+
+
+# ──────────────────────────────── INGEST COMMAND ────────────────────────────────
+@cli.command()
+@click.option('--q', default='in:sent', help='Gmail search query for your past replies')
+@click.option('--limit', default=0, help='Stop after about this many messages (0 = all)')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the newest message')
+@click.option('--page-size', default=500, help='Messages listed per Gmail page (max 500)')
+@click.option('--batch-size', default=256, help='Records per embedding + upsert batch')
+def ingest(q, limit, restart, page_size, batch_size):
+    """Backfill memory from sent mail and the messages they answer (resumable)."""
+    if _daemon():
+        raise click.ClickException("A `watch` daemon holds the memory store; stop it before ingesting.")
+    from src.ingest import ingest as run_ingest
+    session = _session()
+    state = run_ingest(session.service, session.mem, q, limit=limit, restart=restart,
+                       page_size=page_size, write_batch=batch_size)
+    status = "complete" if state["complete"] else "paused (run again to resume)"
+    console.print(f"[bold green]{state['stored']}[/] record(s) from {state['listed']} message(s); {status}.")
+
+
+# ──────────────────────────────── MIGRATE-MEMORY COMMAND ────────────────────────────────
+@cli.command(name="migrate-memory")
+@click.option('--from', 'source', type=click.Choice(["chroma", "mmap"]), default="chroma", help='Backend to copy from')
+@click.option('--to', 'target', type=click.Choice(["chroma", "mmap"]), default="mmap", help='Backend to copy into')
+@click.option('--dtype', type=click.Choice(["float32", "float16", "int8"]), default=None,
+              help='Vector storage type for the mmap backend (default: MEMORY_VECTOR_DTYPE or float16)')
+@click.option('--index', type=click.Choice(["flat", "ivf"]), default=None,
+              help='Search index for the mmap backend (default: MEMORY_INDEX or flat)')
+def migrate_memory(source, target, dtype, index):
+    """Copy the memory store (with its vectors, no re-embedding) to another backend."""
+    if _daemon():
+        raise click.ClickException("A `watch` daemon holds the memory store; stop it before migrating.")
+    from src.memory import migrate
+    options = {k: v for k, v in (("dtype", dtype), ("index", index)) if v and target == "mmap"}
+    copied = migrate(source=source, target=target, **options)
+    console.print(f"[bold green]{copied}[/] record(s) copied from {source} to {target}. "
+                  f"Set MEMORY_BACKEND={target} to use it.")
 
 
 # ──────────────────────────────── SUGGEST COMMAND ────────────────────────────────
@@ -161,16 +368,42 @@ def memory(query, k):
 @click.argument('body')
 def suggest(subject, body):
     """Generate a new reply suggestion based on memory-similar past emails."""
-    from src.agent import EmailAgent
-    agent = EmailAgent()
-    suggestion = agent.suggest_with_memory(subject, body)
-
-    console.rule("Memory-Based Suggestion")
-    if suggestion:
-        console.print(suggestion)
+    client = _daemon()
+    if client:
+        events = client.stream("/suggest", {"subject": subject, "body": body})
     else:
+        events = _session().suggest_events(subject, body)
+    if not render_events(events):
         console.print("[bold yellow]No similar drafts found in memory.[/]")
 
 
+# ──────────────────────────────── WATCH COMMAND ────────────────────────────────
+@cli.command()
+@click.option('--interval', type=float, default=lambda: float(os.getenv("WATCH_INTERVAL", "60")),
+              help='Seconds between mailbox history polls')
+@click.option('--port', type=int, default=lambda: int(os.getenv("WATCH_PORT", "8765")),
+              help='Port of the local API the other commands use')
+@click.option('--draft/--no-draft', default=True, help='Draft replies for newly arrived inbox mail')
+def watch(interval, port, draft):
+    """Run as a daemon: keep Gmail, Chroma and the models warm, draft new mail, serve the CLI."""
+    # Keep the models loaded for as long as the daemon runs, unless configured otherwise
+    os.environ.setdefault("OLLAMA_KEEP_ALIVE", "-1")
+    from models.ollama_client import warm_up_background
+    from src.daemon import Daemon
+    warm_up_background()
+    session = _session()
+    session.warm()
+    daemon = Daemon(session, interval=interval, draft=draft)
+    server = daemon.serve(port)
+    info(f"Watching the mailbox every {interval:.0f}s; API on http://127.0.0.1:{port} (Ctrl+C to stop)")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+        server.shutdown()
+
+
 if __name__ == '__main__':
     cli()
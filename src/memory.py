@@ -1,33 +1,668 @@
 import os
-from typing import List, Dict
-import chromadb
-from chromadb.config import Settings
-from models.embeddings import OllamaEmbeddingFunction
+import re
+import glob
+import json
+import time
+import atexit
+import shutil
+import sqlite3
+import threading
+import statistics
+from typing import Dict, Iterator, List, Optional
+from models.embedding_cache import CachedEmbeddingFunction
+from src.utils.logger import info, warn
+from src.utils.metrics import span
 
 CHROMA_DIR = os.path.join("data", "chroma")
+# Collection metadata flag: every stored vector is unit length (see ChromaStore._normalize_stored)
+UNIT_MARKER = "unit_vectors"
+# Chroma names each segment's directory after its UUID (the id in its `segments` table)
+_SEGMENT_DIR = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+FTS_PATH = os.path.join("data", "memory_fts.sqlite3")
+JOURNAL_DIR = "data"
+BACKENDS = ("chroma", "mmap")
 
+# Metadata fields that can be used as search filters (pushed into both indexes)
+FILTER_FIELDS = ("label", "sender", "type")
+# Reciprocal-rank-fusion constant (Cormack et al.); larger = flatter blend
+RRF_K = 60
 
-class Memory:
-    def __init__(self, collection_name: str = "emails"):
-        self.client = chromadb.PersistentClient(
-            path=CHROMA_DIR, settings=Settings(anonymized_telemetry=False)
+# Stored draft documents keep at most this much of the original body
+MEMORY_BODY_CHARS = 1000
+_BODY_SECTION = re.compile(r"(\nBODY: )(.*?)(\nDRAFT: )", re.DOTALL)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class KeywordIndex:
+    """
+    SQLite FTS5 (BM25) index over memory documents, kept in sync with the
+    vector store by `Memory.add`. Filter fields are stored as columns so
+    metadata filters run inside the same query as the text match.
+    """
+
+    def __init__(self, collection: str, path: str = FTS_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.collection = collection
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5(
+                id UNINDEXED, collection UNINDEXED, document,
+                label UNINDEXED, sender UNINDEXED, type UNINDEXED, metadata UNINDEXED
+            )
+            """
         )
-        self.embed_fn = OllamaEmbeddingFunction()
-        # Pass the actual embedding function object
-        self.col = self.client.get_or_create_collection(
-            name=collection_name,
+
+    def count(self) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM memory_fts WHERE collection = ?", (self.collection,)
+        ).fetchone()[0]
+
+    def upsert(self, docs: List[str], metadatas: List[Dict], ids: List[str]):
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM memory_fts WHERE collection = ? AND id = ?", [(self.collection, i) for i in ids]
+            )
+            self.conn.executemany(
+                "INSERT INTO memory_fts (id, collection, document, label, sender, type, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (i, self.collection, d, *((m or {}).get(f) for f in FILTER_FIELDS), json.dumps(m or {}))
+                    for i, d, m in zip(ids, docs, metadatas)
+                ],
+            )
+
+    def delete(self, ids: List[str]):
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM memory_fts WHERE collection = ? AND id = ?", [(self.collection, i) for i in ids]
+            )
+
+    def rebuild(self, pages: Iterator[List[Dict]]):
+        """Replace this collection's rows with `pages` of records, then merge FTS segments and vacuum the file."""
+        with self.conn:
+            self.conn.execute("DELETE FROM memory_fts WHERE collection = ?", (self.collection,))
+        for page in pages:
+            self.upsert([r["document"] for r in page], [r["metadata"] for r in page], [r["id"] for r in page])
+        with self.conn:
+            self.conn.execute("INSERT INTO memory_fts (memory_fts) VALUES ('optimize')")
+        self.conn.execute("VACUUM")
+
+    @span("memory.keyword_search")
+    def search(self, query: str, k: int, where: Optional[Dict] = None) -> List[Dict]:
+        """Best BM25 matches for any query term, best first."""
+        terms = _TOKEN.findall(query.lower())[:32]
+        if not terms:
+            return []
+        match = " OR ".join(f'"{t}"' for t in dict.fromkeys(terms))
+        sql = ("SELECT id, document, metadata FROM memory_fts "
+               "WHERE memory_fts MATCH ? AND collection = ?")
+        params: list = [match, self.collection]
+        for field, value in (where or {}).items():
+            sql += f" AND {field} = ?"
+            params.append(value)
+        sql += " ORDER BY bm25(memory_fts) LIMIT ?"
+        params.append(k)
+        return [
+            {"id": i, "document": d, "metadata": json.loads(m)}
+            for i, d, m in self.conn.execute(sql, params)
+        ]
+
+
+class WriteBehind:
+    """
+    Write-behind queue in front of the vector and keyword indexes.
+
+    `put` appends the records to an fsynced journal and returns; a background
+    thread coalesces pending records (last write per id wins) into one batched
+    embed + upsert once `max_batch` are pending or the oldest has waited
+    `max_delay` seconds. `flush()` drains synchronously and also runs at exit.
+    Records leave the journal only after they are stored.
+
+    Each process journals to its own file (`<prefix>.<pid>.jsonl`), so a
+    rewrite never pulls a file from under another process's append handle.
+    `recover()` claims the journals of processes that are gone by renaming
+    them (exactly one claimant wins each) and replays them.
+    """
+
+    def __init__(self, write, prefix: str, max_batch: Optional[int] = None, max_delay: Optional[float] = None):
+        self.write = write
+        self.prefix = prefix
+        self.path = f"{prefix}.{os.getpid()}.jsonl"
+        self.max_batch = max_batch or int(os.getenv("MEMORY_FLUSH_SIZE", "32"))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("MEMORY_FLUSH_SECONDS", "2"))
+        self.pending: Dict[str, Dict] = {}
+        self._oldest: Optional[float] = None  # monotonic time of the oldest pending write
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._journal = None
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    def put(self, docs: List[str], metadatas: List[Dict], ids: List[str]):
+        records = [{"id": i, "document": d, "metadata": m} for d, m, i in zip(docs, metadatas, ids)]
+        lines = "".join(json.dumps(rec) + "\n" for rec in records)
+        with self._cond:
+            if self._journal is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._journal = open(self.path, "a", encoding="utf-8")
+            self._journal.write(lines)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            for rec in records:
+                self.pending[rec["id"]] = rec
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-write-behind", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def get(self, ids: List[str]) -> List[Dict]:
+        """Pending (not yet stored) records among `ids`."""
+        with self._cond:
+            return [dict(self.pending[i]) for i in ids if i in self.pending]
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _orphans(self) -> List[str]:
+        """Journals whose writer has exited (the pre-per-process `<prefix>.jsonl` included)."""
+        paths = []
+        for path in sorted(glob.glob(glob.escape(self.prefix) + ".*.jsonl")):
+            owner = path[len(self.prefix) + 1:-len(".jsonl")].split("-")[0]
+            if path == self.path or not owner.isdigit():
+                continue
+            if int(owner) == os.getpid() or not self._alive(int(owner)):
+                paths.append(path)
+        if os.path.exists(self.prefix + ".jsonl"):
+            paths.append(self.prefix + ".jsonl")
+        return paths
+
+    def recover(self) -> int:
+        """Store the records that exited processes journaled but never flushed."""
+        records, claimed = {}, []
+        for path in self._orphans():
+            claim = f"{self.prefix}.{os.getpid()}-{time.time_ns()}.jsonl"
+            try:
+                os.rename(path, claim)
+            except FileNotFoundError:  # another process claimed it first
+                continue
+            claimed.append(claim)
+            with open(claim, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:  # torn final line from a crash mid-append
+                        continue
+                    records[rec["id"]] = rec
+        if not claimed:
+            return 0
+        with self._cond:
+            for rec_id, rec in records.items():
+                self.pending.setdefault(rec_id, rec)  # a write made by this process is newer
+            self._rewrite_journal()  # claimed records are in our own journal before theirs is deleted
+        for claim in claimed:
+            os.remove(claim)
+        if records:
+            info(f"Replaying {len(records)} journaled memory write(s).")
+        self.flush()
+        return len(records)
+
+    def flush(self) -> bool:
+        """Store everything pending, in the calling thread. False if the write failed (records stay queued)."""
+        with self._flush_lock:
+            with self._cond:
+                batch = list(self.pending.values())
+            if batch:
+                try:
+                    self.write([r["document"] for r in batch], [r["metadata"] for r in batch],
+                               [r["id"] for r in batch])
+                except Exception as e:
+                    warn(f"Memory write of {len(batch)} record(s) failed; kept in the journal: {e}")
+                    return False
+            with self._cond:
+                # Records re-written while we were storing stay pending
+                for rec in batch:
+                    if self.pending.get(rec["id"]) is rec:
+                        del self.pending[rec["id"]]
+                self._oldest = time.monotonic() if self.pending else None
+                self._rewrite_journal()
+            return True
+
+    def _rewrite_journal(self):
+        # Only what is still pending has to survive a crash
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if not self.pending:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(rec) + "\n" for rec in self.pending.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Coalesce until the batch is full or the oldest write has waited long enough
+                while True:
+                    if not self.pending:  # nothing queued, or a caller flushed it meanwhile
+                        self._cond.wait()
+                        continue
+                    left = self._oldest + self.max_delay - time.monotonic()
+                    if len(self.pending) >= self.max_batch or left <= 0:
+                        break
+                    self._cond.wait(left)
+            if not self.flush():
+                time.sleep(max(self.max_delay, 1.0))  # e.g. Ollama down: retry later, not in a hot loop
+
+
+class ChromaStore:
+    """
+    Vector backend on a persistent Chroma collection (HNSW, l2) under
+    data/chroma. chromadb is imported on first use, so the `mmap` backend
+    never pays for it.
+    """
+
+    def __init__(self, name: str, embed_fn, path: str = CHROMA_DIR):
+        import chromadb
+        from chromadb.config import Settings
+
+        self.name = name
+        self.path = path
+        self.embed_fn = embed_fn
+        self.client = chromadb.PersistentClient(path=path, settings=Settings(anonymized_telemetry=False))
+        self._recover_compaction()
+        self.col = self._collection(name)
+        self._normalize_stored()
+
+    def _collection(self, name: str):
+        return self.client.get_or_create_collection(
+            name=name,
             metadata={"hnsw:space": "l2"},
             embedding_function=self.embed_fn,
         )
 
-    def add(self, docs: List[str], metadatas: List[Dict], ids: List[str]):
-        embeddings = self.embed_fn(docs) if docs else None
+    def _recover_compaction(self):
+        """Finish a compaction interrupted between dropping the old and renaming the new collection."""
+        names = {getattr(c, "name", c) for c in self.client.list_collections()}
+        tmp = f"{self.name}__compact"
+        if tmp in names and self.name not in names:
+            self.client.get_collection(tmp, embedding_function=self.embed_fn).modify(name=self.name)
+        elif tmp in names:
+            self.client.delete_collection(tmp)
+
+    def _normalize_stored(self):
+        """
+        One-time upgrade of a collection written before embeddings were
+        normalised: its raw /api/embeddings vectors (norm ≈ 20) rank wrongly
+        against unit-length queries in l2 space, so every stored vector is
+        rescaled to unit length, then UNIT_MARKER is set in the collection
+        metadata so later opens skip the check.
+        """
+        if (self.col.metadata or {}).get(UNIT_MARKER):
+            return
+        import numpy as np
+        rescaled = 0
+        for page in self.scan(embeddings=True):
+            vectors = np.asarray([r["embedding"] for r in page], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1)
+            stale = np.flatnonzero((np.abs(norms - 1.0) > 1e-3) & (norms > 0))
+            if len(stale):
+                self.col.update(ids=[page[i]["id"] for i in stale],
+                                embeddings=(vectors[stale] / norms[stale, None]).tolist())
+                rescaled += len(stale)
+        self._mark_unit()
+        if rescaled:
+            info(f"Rescaled {rescaled} stored memory vector(s) in '{self.name}' to unit length.")
+
+    def _mark_unit(self):
+        # hnsw:* keys must not be passed to modify (Chroma reads them as a distance change)
+        meta = {k: v for k, v in (self.col.metadata or {}).items() if not k.startswith("hnsw:")}
+        self.col.modify(metadata={**meta, UNIT_MARKER: True})
+
+    def count(self) -> int:
+        return self.col.count()
+
+    @span("memory.chroma_upsert")
+    def upsert(self, docs: List[str], metadatas: List[Dict], ids: List[str], embeddings: List[List[float]]):
         self.col.upsert(documents=docs, embeddings=embeddings, metadatas=metadatas, ids=ids)
 
-    def search(self, query: str, k: int = 5):
-        q_emb = self.embed_fn([query])[0]
-        res = self.col.query(query_embeddings=[q_emb], n_results=k)
+    def get(self, ids: List[str]) -> List[Dict]:
+        res = self.col.get(ids=ids, include=["documents", "metadatas"])
+        return [
+            {"id": i, "document": d, "metadata": m}
+            for i, d, m in zip(res.get("ids", []), res.get("documents", []), res.get("metadatas", []))
+        ]
+
+    def scan(self, page: int = 500, embeddings: bool = False) -> Iterator[List[Dict]]:
+        """Every record, `page` at a time (with vectors if asked)."""
+        include = ["documents", "metadatas"] + (["embeddings"] if embeddings else [])
+        offset = 0
+        while True:
+            res = self.col.get(include=include, limit=page, offset=offset)
+            if not res["ids"]:
+                return
+            vectors = res["embeddings"] if embeddings else [None] * len(res["ids"])
+            yield [
+                {"id": i, "document": d, "metadata": m or {}, **({"embedding": list(e)} if embeddings else {})}
+                for i, d, m, e in zip(res["ids"], res["documents"], res["metadatas"], vectors)
+            ]
+            offset += len(res["ids"])
+
+    def sample(self, n: int) -> List[List[float]]:
+        return [list(e) for e in self.col.get(include=["embeddings"], limit=n)["embeddings"]]
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(self.path) for f in files)
+
+    @staticmethod
+    def _where(where: Optional[Dict]) -> Optional[Dict]:
+        if not where:
+            return None
+        clauses = [{field: value} for field, value in where.items()]
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def query(self, embedding: List[float], k: int, where: Optional[Dict] = None) -> List[Dict]:
+        res = self.col.query(query_embeddings=[embedding], n_results=k, where=self._where(where))
         docs = res.get("documents", [[]])[0]
         metas = res.get("metadatas", [[]])[0]
         ids = res.get("ids", [[]])[0]
-        return [{"id": i, "document": d, "metadata": m} for i, d, m in zip(ids, docs, metas)]
\ No newline at end of file
+        return [{"id": i, "document": d, "metadata": m} for i, d, m in zip(ids, docs, metas)]
+
+    def replace(self, pages: Iterator[List[Dict]]):
+        """
+        Swap in a collection holding exactly `pages` of records (each with an
+        "embedding"): copied into a fresh HNSW index, then the old collection
+        is deleted and the new one renamed. Chroma never reuses the slots of
+        deleted ids, so rebuilding (rather than deleting in place) is what keeps
+        the index at the size of what is kept; `_reclaim` then frees the disk
+        space the dropped collection held.
+        """
+        tmp = self._collection(f"{self.name}__compact")
+        for chunk in pages:
+            tmp.add(
+                ids=[r["id"] for r in chunk],
+                documents=[r["document"] for r in chunk],
+                metadatas=[r["metadata"] for r in chunk],
+                embeddings=[r["embedding"] for r in chunk],
+            )
+        self.client.delete_collection(self.name)
+        tmp.modify(name=self.name)
+        self.col = self._collection(self.name)
+        self._mark_unit()  # `pages` are unit length (see Memory.compact)
+        self._reclaim()
+
+    def _reclaim(self):
+        """
+        Delete segment directories Chroma no longer lists (it leaves a dropped
+        collection's HNSW files behind) and VACUUM chroma.sqlite3.
+        """
+        try:
+            conn = sqlite3.connect(os.path.join(self.path, "chroma.sqlite3"))
+            try:
+                live = {row[0] for row in conn.execute("SELECT id FROM segments")}
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            warn(f"Could not reclaim space in {self.path}: {e}")
+            return
+        for entry in os.listdir(self.path):
+            path = os.path.join(self.path, entry)
+            if os.path.isdir(path) and _SEGMENT_DIR.fullmatch(entry) and entry not in live:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def open_store(name: str, embed_fn, backend: Optional[str] = None, **options):
+    """
+    The vector backend for collection `name`: `chroma` (default) or `mmap`
+    (NumPy memory-mapped matrix, see src/mmap_store.py), chosen by
+    MEMORY_BACKEND. `options` go to MmapStore (dtype, index, nprobe).
+    """
+    backend = backend or os.getenv("MEMORY_BACKEND", "chroma")
+    if backend == "mmap":
+        from src.mmap_store import MmapStore
+        return MmapStore(name, **options)
+    if backend == "chroma":
+        return ChromaStore(name, embed_fn)
+    raise ValueError(f"MEMORY_BACKEND must be one of {', '.join(BACKENDS)}, not {backend!r}")
+
+
+def migrate(collection: str = "emails", source: str = "chroma", target: str = "mmap", **options) -> int:
+    """
+    Copy every record of `collection`, stored vectors included (nothing is
+    re-embedded), from the `source` backend into a fresh `target` store.
+    The keyword index is shared by both backends and left as is. Returns
+    the number of records copied.
+    """
+    if source == target:
+        raise ValueError("source and target backends are the same")
+    embed_fn = CachedEmbeddingFunction()
+    src = open_store(collection, embed_fn, source)
+    dst = open_store(collection, embed_fn, target, **options)
+    total = src.count()
+    copied = 0
+
+    def pages():
+        nonlocal copied
+        for page in src.scan(embeddings=True):
+            copied += len(page)
+            info(f"Copied {copied}/{total} record(s).")
+            yield page
+
+    dst.replace(pages())
+    return copied
+
+
+class Memory:
+    def __init__(self, collection_name: str = "emails", backend: Optional[str] = None):
+        self.name = collection_name
+        self.embed_fn = CachedEmbeddingFunction()
+        self.store = open_store(collection_name, self.embed_fn, backend)
+        self.fts = KeywordIndex(collection_name)
+        if self.fts.count() == 0 and self.store.count() > 0:
+            self._backfill_fts()
+        # Serialises index writes (write-behind thread, compaction)
+        self._write_lock = threading.RLock()
+        self.writes = None
+        if os.getenv("MEMORY_WRITE_BEHIND", "1") == "1":
+            self.writes = WriteBehind(self._write, os.path.join(JOURNAL_DIR, f"memory_journal.{collection_name}"))
+            self.writes.recover()
+
+    def _backfill_fts(self):
+        """Index documents stored before the keyword index existed."""
+        for page in self.store.scan():
+            self.fts.upsert([r["document"] for r in page], [r["metadata"] for r in page], [r["id"] for r in page])
+
+    @span("memory.add")
+    def add(self, docs: List[str], metadatas: List[Dict], ids: List[str], defer: bool = True):
+        """
+        Queue records for storage (write-behind) – or store them now if it is
+        disabled or `defer` is False (bulk loads that checkpoint themselves).
+        """
+        if not docs:
+            return
+        # Creation time drives TTL expiry and per-sender caps in `compact`
+        now = int(time.time())
+        metadatas = [{"ts": now, **(m or {})} for m in metadatas]
+        if self.writes is not None and defer:
+            self.writes.put(docs, metadatas, ids)
+        else:
+            self._write(docs, metadatas, ids)
+
+    @span("memory.write")
+    def _write(self, docs: List[str], metadatas: List[Dict], ids: List[str]):
+        with self._write_lock:
+            embeddings = self.embed_fn(docs)
+            self.store.upsert(docs, metadatas, ids, embeddings)
+            with span("memory.fts_upsert"):
+                self.fts.upsert(docs, metadatas, ids)
+
+    def flush(self):
+        """Store queued writes now (searches and compaction call this first)."""
+        if self.writes is not None:
+            self.writes.flush()
+
+    @span("memory.get")
+    def get(self, ids: List[str]) -> List[Dict]:
+        """Fetch records by id, including queued ones (missing ids are skipped)."""
+        found = self.writes.get(ids) if self.writes is not None else []
+        rest = [i for i in ids if i not in {f["id"] for f in found}]
+        if not rest:
+            return found
+        return found + self.store.get(rest)
+
+    @span("memory.vector_search")
+    def vector_search(self, query: str, k: int = 5, where: Optional[Dict] = None) -> List[Dict]:
+        self.flush()
+        q_emb = self.embed_fn([query])[0]
+        return self.store.query(q_emb, k, where)
+
+    @span("memory.search")
+    def search(self, query: str, k: int = 5, where: Optional[Dict] = None) -> List[Dict]:
+        """
+        Hybrid search: BM25 keyword hits and vector neighbours fused with
+        reciprocal-rank fusion. `where` ({"label": ..., "sender": ..., "type": ...})
+        filters both indexes. Each result lists the index(es) it came from
+        under "sources" ("keyword", "vector"). Queued writes are stored first.
+        """
+        self.flush()
+        where = {f: v for f, v in (where or {}).items() if f in FILTER_FIELDS and v}
+        pool = max(k * 4, 20)
+        ranked = {}
+        for source, hits in (("keyword", self.fts.search(query, pool, where)),
+                             ("vector", self.vector_search(query, pool, where))):
+            for rank, hit in enumerate(hits):
+                entry = ranked.setdefault(hit["id"], {**hit, "score": 0.0, "sources": []})
+                entry["score"] += 1.0 / (RRF_K + rank + 1)
+                entry["sources"].append(source)
+        return sorted(ranked.values(), key=lambda r: r["score"], reverse=True)[:k]
+
+    # ------------------------------------------------------------------ #
+    # Compaction
+    # ------------------------------------------------------------------ #
+    def stats(self, probes: int = 5) -> Dict:
+        """Entry count, on-disk size and median vector-query latency (no embedding calls)."""
+        size = self.store.size_bytes() + (os.path.getsize(FTS_PATH) if os.path.exists(FTS_PATH) else 0)
+        count = self.store.count()
+        latency = 0.0
+        if count:
+            times = []
+            for emb in self.store.sample(probes):
+                t0 = time.perf_counter()
+                self.store.query(emb, min(5, count))
+                times.append((time.perf_counter() - t0) * 1000)
+            latency = statistics.median(times)
+        return {"entries": count, "bytes": size, "query_ms": latency}
+
+    def compact(self, ttl_days: Optional[float] = None, per_sender: Optional[int] = None,
+                dup_distance: Optional[float] = 0.02, body_chars: int = MEMORY_BODY_CHARS) -> Dict:
+        """
+        Shrink the store to what is worth keeping, then rebuild both indexes:
+
+        - drop entries older than `ttl_days` (entries without a timestamp are kept)
+        - keep only the newest `per_sender` drafts per sender
+        - collapse drafts from the same sender whose embeddings are within
+          `dup_distance` (cosine) of a newer draft
+        - cut the BODY section of stored drafts to `body_chars` (vectors are kept,
+          scaled to unit length like every vector embedded since batching)
+
+        The vector store is rebuilt from the kept records (a fresh HNSW index
+        or mmap generation, see `replace`), the space the old one held is
+        freed, and the keyword index is vacuumed.
+        Returns stats before/after.
+        """
+        self.flush()
+        with self._write_lock:  # no write-behind batch lands mid-rebuild
+            return self._compact(ttl_days, per_sender, dup_distance, body_chars)
+
+    def _compact(self, ttl_days, per_sender, dup_distance, body_chars) -> Dict:
+        """
+        Streams the store instead of loading it: one pass over metadata picks
+        what to drop, a second spools draft vectors (float16) to a temporary
+        memmap for the near-duplicate check, and the kept records are read a
+        page at a time straight into `replace`.
+        """
+        import tempfile
+        import numpy as np
+
+        before = self.stats()
+        now = time.time()
+        cutoff = now - ttl_days * 86400 if ttl_days is not None else None
+        dropped, drafts = set(), {}  # drafts: sender -> [(ts, id)]
+        for page in self.store.scan():
+            for r in page:
+                meta = r["metadata"] or {}
+                if cutoff is not None and meta.get("ts", now) < cutoff:
+                    dropped.add(r["id"])
+                elif meta.get("type") == "draft":
+                    drafts.setdefault(meta.get("sender", ""), []).append((meta.get("ts", 0), r["id"]))
+
+        position = {i: n for n, i in enumerate(i for group in drafts.values() for _, i in group)}
+        with tempfile.TemporaryFile() as spool:
+            vectors = None
+            if dup_distance is not None and position:
+                for page in self.store.scan(embeddings=True):
+                    for r in page:
+                        if r["id"] not in position:
+                            continue
+                        vec = np.asarray(r["embedding"], dtype=np.float32)
+                        if vectors is None:
+                            vectors = np.memmap(spool, dtype=np.float16, mode="w+", shape=(len(position), len(vec)))
+                        norm = np.linalg.norm(vec)
+                        vectors[position[r["id"]]] = vec / norm if norm else vec
+            for group in drafts.values():
+                group.sort(key=lambda d: d[0], reverse=True)  # newest first
+                kept = []
+                for _, i in group:
+                    if per_sender is not None and len(kept) >= per_sender:
+                        dropped.add(i)
+                        continue
+                    if vectors is not None:
+                        vec = np.asarray(vectors[position[i]], dtype=np.float32)
+                        if kept and float(np.max(np.stack(kept) @ vec)) >= 1.0 - dup_distance:
+                            dropped.add(i)
+                            continue
+                        kept.append(vec)
+                    else:
+                        kept.append(None)
+            del vectors
+
+        stored = 0
+
+        def pages() -> Iterator[List[Dict]]:
+            nonlocal stored
+            for page in self.store.scan(embeddings=True):
+                page = [r for r in page if r["id"] not in dropped]
+                for r in page:
+                    r["document"] = _BODY_SECTION.sub(
+                        lambda m: m.group(1) + m.group(2)[:body_chars] + m.group(3), r["document"], count=1
+                    )
+                    # Stores written before embeddings were normalised hold raw /api/embeddings
+                    # vectors; unit length makes them the /api/embed vectors new records get
+                    vec = np.asarray(r["embedding"], dtype=np.float32)
+                    norm = np.linalg.norm(vec)
+                    r["embedding"] = (vec / norm if norm else vec).tolist()
+                stored += len(page)
+                if page:
+                    yield page
+
+        self.store.replace(pages())
+        self.fts.rebuild(self.store.scan())
+        after = self.stats()
+        info(f"Compacted memory '{self.name}': {before['entries']} → {after['entries']} entries.")
+        return {"before": before, "after": after, "removed": before["entries"] - stored}
@@ -0,0 +1,89 @@
+import re
+import base64
+from typing import Dict, Iterator, List, Optional
+from src.gmail_client import get_attachment
+
+_CHARSET = re.compile(r"charset\s*=\s*\"?([\w.:-]+)", re.IGNORECASE)
+
+
+def _headers(part: Dict) -> Dict[str, str]:
+    return {h["name"].lower(): h["value"] for h in part.get("headers", [])}
+
+
+def is_attachment(part: Dict) -> bool:
+    disposition = _headers(part).get("content-disposition", "").lower()
+    return bool(part.get("filename")) or disposition.startswith("attachment")
+
+
+def walk_parts(payload: Dict) -> Iterator[Dict]:
+    """Yield leaf parts depth-first, lazily – callers can stop at the first match."""
+    children = payload.get("parts")
+    if not children:
+        yield payload
+        return
+    for child in children:
+        yield from walk_parts(child)
+
+
+def find_body_part(payload: Dict) -> Optional[Dict]:
+    """
+    The part holding the readable body: the first inline text/plain anywhere in
+    the tree (e.g. inside multipart/alternative nested in multipart/mixed),
+    else the first inline text/html.
+    """
+    html = None
+    for part in walk_parts(payload):
+        if is_attachment(part):
+            continue
+        mime_type = part.get("mimeType", "").lower()
+        if mime_type == "text/plain":
+            return part
+        if mime_type == "text/html" and html is None:
+            html = part
+    return html
+
+
+def decode_part(service, msg_id: str, part: Dict) -> str:
+    """
+    Decoded text of one part. Gmail inlines small parts; large ones carry only an
+    attachmentId and are downloaded here, for this part alone.
+    """
+    body = part.get("body", {})
+    data = body.get("data")
+    if data is None and body.get("attachmentId"):
+        data = get_attachment(service, msg_id, body["attachmentId"]).get("data")
+    if not data:
+        return ""
+    raw = base64.urlsafe_b64decode(data)
+    m = _CHARSET.search(_headers(part).get("content-type", ""))
+    try:
+        return raw.decode(m.group(1) if m else "utf-8", errors="ignore")
+    except LookupError:
+        return raw.decode("utf-8", errors="ignore")
+
+
+def message_text(service, msg: Dict) -> str:
+    """Readable body of a `format="full"` message; attachments are never downloaded."""
+    part = find_body_part(msg.get("payload", {}))
+    return decode_part(service, msg["id"], part) if part else ""
+
+
+def list_attachments(msg: Dict) -> List[Dict]:
+    """Attachment metadata only (filename, type, size, ids); fetch with `fetch_attachment`."""
+    return [
+        {
+            "partId": p.get("partId"),
+            "filename": p.get("filename", ""),
+            "mimeType": p.get("mimeType", ""),
+            "size": p.get("body", {}).get("size", 0),
+            "attachmentId": p.get("body", {}).get("attachmentId"),
+        }
+        for p in walk_parts(msg.get("payload", {}))
+        if is_attachment(p)
+    ]
+
+
+def fetch_attachment(service, msg_id: str, attachment_id: str) -> bytes:
+    """Download one attachment's bytes – only when explicitly asked for."""
+    data = get_attachment(service, msg_id, attachment_id).get("data", "")
+    return base64.urlsafe_b64decode(data)
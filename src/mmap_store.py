@@ -0,0 +1,497 @@
+import os
+import json
+import fcntl
+import shutil
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from src.utils.logger import info
+from src.utils.metrics import span
+
+VECTOR_DIR = os.path.join("data", "vectors")
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+INT8_SCALE = 127.0
+# Rows scored per step of a scan (bounds the float32 working set to SCAN_ROWS × dim)
+SCAN_ROWS = 32768
+# IVF: train the k-means cells once this many vectors exist; retrain after this much growth
+IVF_MIN_VECTORS = 4096
+IVF_RETRAIN_GROWTH = 4
+IVF_ITERATIONS = 10
+# Columns of the sidecar table that filters hit directly (others go through json_extract)
+FILTER_COLUMNS = ("label", "sender", "type")
+
+
+
+class WriterLock:
+    """
+    Exclusive writer lock for one store directory, shared by every
+    `MmapStore` of this process (see `writer_lock`): a re-entrant thread lock
+    inside the process plus `flock` on `<dir>/LOCK` across processes, so
+    `ingest`, `watch`, a `predraft` process and `compact` never allocate the
+    same slots or build over each other. The thread lock alone (`.thread`)
+    guards reads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.thread = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if not self.thread.acquire(blocking):
+            return False
+        if self._depth == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                self.thread.release()
+                return False
+            self._fd = fd
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self.thread.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+_writer_locks: Dict[str, WriterLock] = {}
+_writer_locks_guard = threading.Lock()
+
+
+def writer_lock(root: str) -> WriterLock:
+    with _writer_locks_guard:
+        key = os.path.abspath(root)
+        if key not in _writer_locks:
+            _writer_locks[key] = WriterLock(os.path.join(root, "LOCK"))
+        return _writer_locks[key]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    slot     INTEGER PRIMARY KEY,  -- row of the vector matrix
+    id       TEXT NOT NULL UNIQUE,
+    document TEXT,
+    label    TEXT,
+    sender   TEXT,
+    type     TEXT,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS rows_label ON rows (label);
+CREATE INDEX IF NOT EXISTS rows_sender ON rows (sender);
+CREATE INDEX IF NOT EXISTS rows_type ON rows (type);
+CREATE TABLE IF NOT EXISTS info (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class MmapStore:
+    """
+    Vector backend in plain files, for one mailbox's worth of memory.
+
+    Unit-normalised vectors live in a NumPy memory-mapped matrix (float32,
+    float16 or int8 – int8 is the vector × 127, a quarter of float32's size);
+    ids, documents and the filter fields live in a small SQLite sidecar whose
+    `slot` column is the matrix row. Opening maps the file without reading it,
+    so it is near-instant at any size, and only the pages a query touches are
+    paged in. `flat` queries score every row (or only the rows a filter
+    selects) in chunks of `SCAN_ROWS`; `ivf` queries score the rows of the
+    k-means cells closest to the query, trained once `IVF_MIN_VECTORS` exist.
+
+    Each build lives in its own generation directory (`<name>/<gen>/`) named
+    by `<name>/CURRENT`; `replace` (compaction, migration) writes a new
+    generation and swaps the pointer atomically. SQLite is the commit point:
+    a vector written without its row is simply overwritten by the next insert.
+    Writers (and `replace`, for the whole build) hold the directory's
+    `WriterLock`; readers only need the rows to be committed.
+    """
+
+    def __init__(self, name: str, path: str = VECTOR_DIR, dtype: Optional[str] = None,
+                 index: Optional[str] = None, nprobe: Optional[int] = None, generation: Optional[str] = None):
+        self.name = name
+        self.root = os.path.join(path, name)
+        os.makedirs(self.root, exist_ok=True)
+        self.index = index or os.getenv("MEMORY_INDEX", "flat")
+        if self.index not in ("flat", "ivf"):
+            raise ValueError(f"MEMORY_INDEX must be 'flat' or 'ivf', not {self.index!r}")
+        self.nprobe = nprobe or int(os.getenv("MEMORY_IVF_NPROBE", "8"))
+        self._dtype = dtype  # an explicit choice also applies to the next `replace`
+        self._default_dtype = dtype or os.getenv("MEMORY_VECTOR_DTYPE", "float16")
+        if self._default_dtype not in DTYPES:
+            raise ValueError(f"vector dtype must be one of {', '.join(DTYPES)}, not {self._default_dtype!r}")
+        self._writer = writer_lock(self.root)
+        self._lock = self._writer.thread
+        self._pinned = generation is not None  # a generation being built by `replace`
+        self.conn = None
+        self._load(generation or self._pointer() or "0")
+        if generation is None:
+            self._remove_stale_generations()
+
+    # ------------------------------------------------------------------ #
+    # Files
+    # ------------------------------------------------------------------ #
+    def _pointer(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, "CURRENT"), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _load(self, generation: str):
+        if self.conn is not None:
+            self.conn.close()
+        self.generation = generation
+        self.dir = os.path.join(self.root, generation)
+        os.makedirs(self.dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.dir, "rows.sqlite3"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        meta = dict(self.conn.execute("SELECT key, value FROM info").fetchall())
+        self.dtype = meta.get("dtype", self._default_dtype)
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        self._trained_on = int(meta.get("trained_on", 0))
+        self._assigned = int(meta.get("assigned", 0))
+        self._vecs = None
+        self._cells = None
+        self._centroids = None
+
+    def _remove_stale_generations(self):
+        """
+        Leftovers of a `replace` that crashed before (or after) swapping the
+        pointer. Only when no writer holds the lock: a generation being built
+        right now by another process's `replace` is not stale.
+        """
+        if not self._writer.acquire(blocking=False):
+            return
+        try:
+            self._fresh()
+            for entry in os.listdir(self.root):
+                path = os.path.join(self.root, entry)
+                if os.path.isdir(path) and entry != self.generation:
+                    shutil.rmtree(path, ignore_errors=True)
+        finally:
+            self._writer.release()
+
+    def _reload_ivf(self):
+        """Pick up IVF training or assignment done by another process (call with the writer lock)."""
+        meta = dict(self.conn.execute("SELECT key, value FROM info").fetchall())
+        if int(meta.get("trained_on", 0)) != self._trained_on:
+            self._centroids = None
+        self._trained_on = int(meta.get("trained_on", 0))
+        self._assigned = int(meta.get("assigned", 0))
+
+    def _fresh(self):
+        """Follow a `replace` done by another process (e.g. `compact` while `watch` runs)."""
+        current = None if self._pinned else self._pointer()
+        if current and current != self.generation:
+            self._load(current)
+
+    def _set_info(self, **values):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                                  [(k, str(v)) for k, v in values.items()])
+
+    def _matrix(self, rows: int):
+        """Map the vector file with room for at least `rows` rows (grown by doubling)."""
+        path = os.path.join(self.dir, f"vectors.{self.dtype}")
+        row_bytes = np.dtype(DTYPES[self.dtype]).itemsize * self.dim
+        capacity = os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+        if rows > capacity:
+            capacity = max(1024, rows, capacity * 2)
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+            self._vecs = None
+        if self._vecs is None or self._vecs.shape[0] != capacity:
+            self._vecs = np.memmap(path, dtype=DTYPES[self.dtype], mode="r+", shape=(capacity, self.dim))
+        return self._vecs
+
+    def _cell_map(self, rows: int):
+        path = os.path.join(self.dir, "cells.i32")
+        capacity = os.path.getsize(path) // 4 if os.path.exists(path) else 0
+        if rows > capacity:
+            capacity = max(1024, rows, capacity * 2)
+            with open(path, "ab") as f:
+                f.truncate(capacity * 4)
+            self._cells = None
+        if self._cells is None or self._cells.shape[0] != capacity:
+            self._cells = np.memmap(path, dtype=np.int32, mode="r+", shape=(capacity,))
+        return self._cells
+
+    # ------------------------------------------------------------------ #
+    # Encoding
+    # ------------------------------------------------------------------ #
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dtype == "int8":
+            return np.clip(np.rint(vectors * INT8_SCALE), -INT8_SCALE, INT8_SCALE).astype(np.int8)
+        return vectors.astype(DTYPES[self.dtype])
+
+    def _decode(self, block: np.ndarray) -> np.ndarray:
+        block = np.asarray(block, dtype=np.float32)
+        return block / INT8_SCALE if self.dtype == "int8" else block
+
+    # ------------------------------------------------------------------ #
+    # Records
+    # ------------------------------------------------------------------ #
+    def count(self) -> int:
+        with self._lock:
+            self._fresh()
+            return self.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    @span("memory.mmap_upsert")
+    def upsert(self, docs: List[str], metadatas: List[Dict], ids: List[str], embeddings: List[List[float]]):
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        with self._writer:  # slots are allocated from MAX(slot): one writer at a time, across processes
+            self._fresh()
+            self._reload_ivf()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_info(dim=self.dim, dtype=self.dtype)
+            existing = {}
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                existing.update(self.conn.execute(f"SELECT id, slot FROM rows WHERE id IN ({marks})", chunk))
+            n = start_n = self.conn.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM rows").fetchone()[0]
+            slots = []
+            for i in ids:
+                if i not in existing:
+                    existing[i], n = n, n + 1
+                slots.append(existing[i])
+
+            encoded = self._encode(vectors)
+            matrix = self._matrix(n)
+            matrix[slots] = encoded
+            matrix.flush()
+            if self._trained():
+                cells = self._cell_map(n)
+                cells[slots] = self._nearest_cell(self._decode(encoded))
+                cells.flush()
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO rows (slot, id, document, label, sender, type, metadata) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(s, i, d, *((m or {}).get(f) for f in FILTER_COLUMNS), json.dumps(m or {}))
+                     for s, i, d, m in zip(slots, ids, docs, metadatas)],
+                )
+            if self._trained() and self._assigned == start_n < n:  # new rows got their cells above
+                self._assigned = n
+                self._set_info(assigned=n)
+
+    def get(self, ids: List[str]) -> List[Dict]:
+        with self._lock:
+            self._fresh()
+            found = []
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                found += [{"id": i, "document": d, "metadata": json.loads(m)} for i, d, m in self.conn.execute(
+                    f"SELECT id, document, metadata FROM rows WHERE id IN ({marks})", chunk)]
+            return found
+
+    def scan(self, page: int = 500, embeddings: bool = False) -> Iterator[List[Dict]]:
+        """Every record, `page` at a time, in slot order (with decoded vectors if asked)."""
+        last = -1
+        while True:
+            with self._lock:
+                self._fresh()
+                rows = self.conn.execute(
+                    "SELECT slot, id, document, metadata FROM rows WHERE slot > ? ORDER BY slot LIMIT ?", (last, page)
+                ).fetchall()
+                if not rows:
+                    return
+                out = [{"id": i, "document": d, "metadata": json.loads(m)} for _, i, d, m in rows]
+                if embeddings:
+                    vectors = self._decode(self._matrix(rows[-1][0] + 1)[[r[0] for r in rows]])
+                    for rec, vec in zip(out, vectors):
+                        rec["embedding"] = vec.tolist()
+            last = rows[-1][0]
+            yield out
+
+    def sample(self, n: int) -> List[List[float]]:
+        with self._lock:
+            count = self.count()
+            if not count:
+                return []
+            return self._decode(self._matrix(count)[:min(n, count)]).tolist()
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(self.root) for f in files)
+
+    # ------------------------------------------------------------------ #
+    # Search
+    # ------------------------------------------------------------------ #
+    def _filtered_slots(self, where: Dict) -> np.ndarray:
+        sql, params = "SELECT slot FROM rows WHERE 1", []
+        for field, value in where.items():
+            if field in FILTER_COLUMNS:
+                sql += f" AND {field} = ?"
+            else:
+                sql += " AND json_extract(metadata, ?) = ?"
+                params.append(f"$.{field}")
+            params.append(value)
+        return np.fromiter((r[0] for r in self.conn.execute(sql + " ORDER BY slot", params)), dtype=np.int64)
+
+    def _top(self, q: np.ndarray, k: int, n: int, slots: Optional[np.ndarray]):
+        """Best (score, slot) pairs over all `n` rows or just `slots`, scanning in chunks."""
+        matrix = self._matrix(n)
+        best_scores = np.empty(0, dtype=np.float32)
+        best_slots = np.empty(0, dtype=np.int64)
+        total = n if slots is None else len(slots)
+        for start in range(0, total, SCAN_ROWS):
+            if slots is None:
+                chunk_slots = np.arange(start, min(start + SCAN_ROWS, n))
+                block = matrix[start:start + SCAN_ROWS][:len(chunk_slots)]
+            else:
+                chunk_slots = slots[start:start + SCAN_ROWS]
+                block = matrix[chunk_slots]
+            scores = self._decode(block) @ q
+            best_scores = np.concatenate([best_scores, scores])
+            best_slots = np.concatenate([best_slots, chunk_slots])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k)[:k]
+                best_scores, best_slots = best_scores[keep], best_slots[keep]
+        order = np.argsort(-best_scores)
+        return best_scores[order], best_slots[order]
+
+    @span("memory.mmap_query")
+    def query(self, embedding: List[float], k: int, where: Optional[Dict] = None) -> List[Dict]:
+        """Nearest `k` records by cosine distance (exact when filtered or `flat`, IVF otherwise)."""
+        with self._lock:
+            self._fresh()
+            n = self.conn.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM rows").fetchone()[0]
+            if not n or self.dim is None:
+                return []
+            q = np.asarray(embedding, dtype=np.float32)
+            q = q / (np.linalg.norm(q) or 1.0)
+            slots = None
+            if where:
+                slots = self._filtered_slots(where)
+            elif self.index == "ivf" and self._ensure_ivf(n):
+                slots = self._probe(q, k, n)
+            scores, found = self._top(q, k, n, slots)
+            if not len(found):
+                return []
+            marks = ",".join("?" * len(found))
+            rows = {s: (i, d, m) for s, i, d, m in self.conn.execute(
+                f"SELECT slot, id, document, metadata FROM rows WHERE slot IN ({marks})", [int(s) for s in found])}
+            return [
+                {"id": rows[s][0], "document": rows[s][1], "metadata": json.loads(rows[s][2]), "distance": 1.0 - float(sc)}
+                for sc, s in zip(scores, found.tolist()) if s in rows
+            ]
+
+    # ------------------------------------------------------------------ #
+    # IVF
+    # ------------------------------------------------------------------ #
+    def _trained(self) -> bool:
+        return self.index == "ivf" and self._trained_on > 0
+
+    def _load_centroids(self) -> np.ndarray:
+        if self._centroids is None:
+            self._centroids = np.load(os.path.join(self.dir, "centroids.npy"))
+        return self._centroids
+
+    def _nearest_cell(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._load_centroids().T, axis=1).astype(np.int32)
+
+    def _ensure_ivf(self, n: int) -> bool:
+        """Train, retrain or catch up the cell assignments; False while the store is too small for IVF."""
+        if n < IVF_MIN_VECTORS:
+            return False
+        if not self._trained_on or n > self._trained_on * IVF_RETRAIN_GROWTH or self._assigned < n:
+            with self._writer:
+                self._reload_ivf()
+                if not self._trained_on or n > self._trained_on * IVF_RETRAIN_GROWTH:
+                    self._train(n)
+                elif self._assigned < n:  # rows written while the store was `flat`
+                    self._assign(self._assigned, n)
+        return True
+
+    def _assign(self, start: int, n: int):
+        matrix, cells = self._matrix(n), self._cell_map(n)
+        for a in range(start, n, SCAN_ROWS):
+            cells[a:min(a + SCAN_ROWS, n)] = self._nearest_cell(self._decode(matrix[a:min(a + SCAN_ROWS, n)]))
+        cells.flush()
+        self._assigned = n
+        self._set_info(assigned=n)
+
+    def _train(self, n: int):
+        """Spherical k-means on a sample: ~sqrt(n) cells, then assign every row."""
+        nlist = int(min(4096, max(16, np.sqrt(n))))
+        rng = np.random.default_rng(0)
+        matrix = self._matrix(n)
+        sample = self._decode(matrix[np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(IVF_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            centroids = np.where(empty[:, None], centroids, sums / np.where(norms == 0, 1, norms))
+        np.save(os.path.join(self.dir, "centroids.npy"), centroids.astype(np.float32))
+        self._centroids = None
+        self._trained_on = n
+        self._set_info(trained_on=n)
+        self._assign(0, n)
+        info(f"Trained IVF index for '{self.name}': {nlist} cells over {n} vectors.")
+
+    def _probe(self, q: np.ndarray, k: int, n: int) -> np.ndarray:
+        """Slots in the `nprobe` closest cells (more cells if those hold fewer than `k` rows)."""
+        cells = np.asarray(self._cell_map(n)[:n])
+        order = np.argsort(-(self._load_centroids() @ q))
+        sizes = np.bincount(cells, minlength=len(order))[order]
+        probes = max(self.nprobe, int(np.searchsorted(np.cumsum(sizes), k)) + 1)
+        return np.flatnonzero(np.isin(cells, order[:probes]))
+
+    # ------------------------------------------------------------------ #
+    # Rebuild
+    # ------------------------------------------------------------------ #
+    def replace(self, pages: Iterator[List[Dict]]):
+        """
+        Swap in a store holding exactly `pages` of records (each with an
+        "embedding"): written to a new generation, then the pointer moves.
+        Holds the writer lock throughout, so `pages` may be read lazily from
+        this store (no write can land in between) and other processes wait.
+        """
+        with self._writer:
+            self._fresh()
+            new = MmapStore(self.name, os.path.dirname(self.root), dtype=self._dtype or self.dtype, index=self.index,
+                            nprobe=self.nprobe, generation=str(int(self.generation) + 1))
+            for page in pages:
+                new.upsert([r["document"] for r in page], [r["metadata"] for r in page],
+                           [r["id"] for r in page], [r["embedding"] for r in page])
+            if new.index == "ivf":
+                n = new.count()
+                if n >= IVF_MIN_VECTORS:
+                    new._train(n)
+            new.conn.close()
+            tmp = os.path.join(self.root, "CURRENT.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(new.generation)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(self.root, "CURRENT"))
+            old = self.dir
+            self._load(new.generation)
+            shutil.rmtree(old, ignore_errors=True)
@@ -0,0 +1,246 @@
+import os
+import time
+import threading
+from email.utils import make_msgid
+from typing import Callable, Dict, List, Optional, Tuple
+from src.gmail_client import (
+    RATE_LIMIT_REASONS, RETRY_STATUSES, backoff, get_message, get_threads, header_map, list_messages,
+    send_message,
+)
+from src.store import MessageStore
+from src.utils.logger import info, warn
+from src.utils.metrics import count, span
+
+# Gmail per-user quota: 250 units/second; messages.send costs 100 of them
+QUOTA_UNITS_PER_SECOND = 250
+SEND_COST = 100
+# Headers a reply needs from the message it answers
+REPLY_HEADERS = ["From", "Reply-To", "Subject", "Message-ID", "References"]
+# A 'sending' row untouched this long belongs to a process that died mid-send
+STALE_SENDING_SECONDS = 300
+
+
+class TokenBucket:
+    """
+    Token-bucket limiter in quota units: refills at `rate` per second up to
+    `capacity`; `take(cost)` blocks until `cost` units are available.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self, cost: float) -> float:
+        """Wait for and consume `cost` units; returns the seconds waited."""
+        waited = 0.0
+        with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= cost - 1e-9:  # float rounding must not leave a waiter a hair short forever
+                    self.tokens = max(self.tokens - cost, 0.0)
+                    return waited
+                delay = (cost - self.tokens) / self.rate
+                self.sleep(delay)
+                waited += delay
+
+    def drain(self):
+        """Empty the bucket (Gmail said we are over quota, whatever our count says)."""
+        with self._lock:
+            self._refill()
+            self.tokens = 0.0
+
+
+_shared_bucket: Optional[TokenBucket] = None
+_shared_lock = threading.Lock()
+
+
+def shared_bucket() -> TokenBucket:
+    """The process-wide send limiter (quota is per user, so every `Outbox` draws from one bucket)."""
+    global _shared_bucket
+    with _shared_lock:
+        if _shared_bucket is None:
+            _shared_bucket = TokenBucket(float(os.getenv("GMAIL_QUOTA_UNITS", QUOTA_UNITS_PER_SECOND)))
+        return _shared_bucket
+
+
+def classify_error(e: Exception) -> Tuple[bool, bool, bool, Optional[float]]:
+    """(retryable, rate limited, maybe delivered, Retry-After seconds) for a failed send."""
+    resp = getattr(e, "resp", None)
+    status = getattr(resp, "status", None)
+    if status is None:  # connection reset, timeout …: Gmail may or may not have the message
+        return True, False, True, None
+    status = int(status)
+    text = str(e)
+    rate_limited = status == 429 or (status == 403 and any(r in text for r in RATE_LIMIT_REASONS))
+    retry_after = None
+    try:
+        retry_after = float(resp.get("retry-after")) if resp.get("retry-after") else None
+    except (TypeError, ValueError, AttributeError):
+        pass
+    return rate_limited or status in RETRY_STATUSES, rate_limited, status >= 500, retry_after
+
+
+def reply_item(service, store: MessageStore, msg_id: str, body: str, to_addr: Optional[str] = None) -> Dict:
+    """Outbox row for a reply to `msg_id`: recipient, Re: subject, threadId and threading headers."""
+    row = store.get(msg_id)
+    if row is None or "message-id" not in row["headers"]:
+        msg = get_message(service, msg_id, fmt="metadata", headers=REPLY_HEADERS)
+        store.upsert(msg)
+        row = store.get(msg_id)
+    hdrs = row["headers"]
+    subject = hdrs.get("subject", "")
+    if not subject.lower().startswith("re:"):
+        subject = f"Re: {subject}"
+    parent_id = hdrs.get("message-id")
+    refs = " ".join(r for r in (hdrs.get("references", ""), parent_id or "") if r) or None
+    return {
+        "msg_id": msg_id, "thread_id": row["thread_id"],
+        "to_addr": to_addr or hdrs.get("reply-to") or hdrs.get("from", ""),
+        "subject": subject, "body": body, "in_reply_to": parent_id, "refs": refs,
+        "message_id": make_msgid(domain="email-responder.local"),
+    }
+
+
+class Outbox:
+    """
+    Sends queued replies (the SQLite `outbox` table) at Gmail's quota limit.
+
+    Every send first takes `SEND_COST` units from a token bucket refilled at
+    the per-user quota rate, so bulk approval runs at the limit instead of
+    tripping it. A 429/5xx (or a rate-limit 403, or a dropped connection) is
+    retried with exponential backoff and full jitter, at most `max_attempts`
+    times; other errors fail the row. A row is claimed ('sending') in its own
+    committed transaction before the API call, so a process that dies mid-send
+    leaves a marker: `recover()` looks for the sent copy (see `_find_sent`)
+    and only re-queues the row if Gmail never got it – no double sends. The
+    Gmail id of a send is stored the moment the API call returns.
+    """
+
+    def __init__(self, service, store: MessageStore, bucket: Optional[TokenBucket] = None,
+                 max_attempts: Optional[int] = None, base_delay: float = 1.0, max_delay: float = 60.0,
+                 lock=None):
+        self.service = service
+        self.store = store
+        self.bucket = bucket or shared_bucket()
+        self.max_attempts = max_attempts or int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = lock or threading.RLock()  # the Gmail client is not thread-safe (see Session)
+
+    def recover(self, stale_after: float = STALE_SENDING_SECONDS) -> int:
+        """Settle rows left 'sending' by a crashed process; returns how many were re-queued."""
+        requeued = 0
+        for row in self.store.sends("sending"):
+            if time.time() - row["updated_at"] < stale_after:
+                continue  # probably another process sending right now
+            sent_id = self._find_sent(row)
+            if sent_id:
+                self._sent(row, sent_id)
+            else:
+                self.store.update_send(row["msg_id"], status="queued", next_at=0)
+                requeued += 1
+        return requeued
+
+    def _find_sent(self, row: Dict) -> Optional[str]:
+        """
+        Id of the sent copy of this row's reply, if Gmail has it. Gmail keeps a
+        client-set Message-ID on sent mail, but does not document that, so a
+        miss on the `rfc822msgid:` search falls back to the row's thread: a SENT
+        message there with our X-Outbox-Id header (Gmail does not touch custom
+        X- headers) or our Message-ID is the one.
+        """
+        token = row["message_id"].strip("<>")
+        with self.lock:
+            found = list_messages(self.service, f"in:sent rfc822msgid:{token}", 1)
+            if found:
+                return found[0]["id"]
+            if not row["thread_id"]:
+                return None
+            thread = get_threads(self.service, [row["thread_id"]], fmt="metadata")[0]
+        for msg in (thread or {}).get("messages", []):
+            hdrs = header_map(msg)
+            if "SENT" in msg.get("labelIds", []) and token in (
+                    hdrs.get("x-outbox-id"), hdrs.get("message-id", "").strip("<>")):
+                return msg["id"]
+        return None
+
+    def _sent(self, row: Dict, sent_id: str):
+        self.store.update_send(row["msg_id"], status="sent", sent_id=sent_id, error=None)
+        if self.store.get_draft(row["msg_id"]):
+            self.store.set_draft_status(row["msg_id"], "sent")
+        count("outbox_sent")
+
+    @span("outbox.send")
+    def send(self, row: Dict) -> str:
+        """One attempt for a claimed row; returns its new status."""
+        self.bucket.take(SEND_COST)
+        try:
+            with self.lock:
+                sent = send_message(self.service, row["to_addr"], row["subject"], row["body"], row["thread_id"],
+                                    in_reply_to=row["in_reply_to"], references=row["refs"],
+                                    message_id=row["message_id"], outbox_id=row["message_id"].strip("<>"))
+        except Exception as e:
+            retryable, rate_limited, maybe_delivered, retry_after = classify_error(e)
+            if maybe_delivered:
+                try:
+                    sent_id = self._find_sent(row)
+                except Exception as lookup_error:  # leave it 'sending'; `recover` settles it later
+                    warn(f"Could not tell whether the reply to {row['msg_id']} went out: {lookup_error}")
+                    return "sending"
+                if sent_id:
+                    self._sent(row, sent_id)
+                    return "sent"
+            if rate_limited:
+                self.bucket.drain()
+                count("outbox_rate_limited")
+            attempts = row["attempts"] + 1
+            if retryable and attempts < self.max_attempts:
+                delay = backoff(attempts, self.base_delay, self.max_delay, retry_after)
+                self.store.update_send(row["msg_id"], status="queued", next_at=time.time() + delay, error=str(e))
+                count("outbox_retries")
+                return "queued"
+            self.store.update_send(row["msg_id"], status="failed", error=str(e))
+            warn(f"Giving up on the reply to {row['msg_id']} after {attempts} attempt(s): {e}")
+            count("outbox_failed")
+            return "failed"
+        self._sent(row, sent["id"])
+        return "sent"
+
+    def run(self, wait: bool = True, only: Optional[List[str]] = None) -> Dict[str, int]:
+        """
+        Send everything due (limited to the `only` message ids when given).
+        With `wait`, also sleeps through backoff delays until nothing is queued.
+        Returns counts per outcome.
+        """
+        self.recover()
+        stats = {"sent": 0, "failed": 0, "retried": 0, "sending": 0}
+        if only is not None and not only:
+            return stats
+        while True:
+            due = self.store.due_sends(time.time(), only=only)
+            for row in due:
+                if not self.store.claim_send(row["msg_id"]):
+                    continue
+                status = self.send(row)
+                stats["retried" if status == "queued" else status] += 1
+            if due:
+                continue
+            queued = [r for r in self.store.sends("queued") if only is None or r["msg_id"] in only]
+            if not wait or not queued:
+                return stats
+            delay = min(r["next_at"] for r in queued) - time.time()
+            if delay <= 0:  # due, yet not returned above (claimed elsewhere meanwhile): don't spin
+                return stats
+            info(f"{len(queued)} reply(ies) backing off; retrying in {delay:.1f}s.")
+            time.sleep(delay)
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import hashlib
+import subprocess
+from typing import Dict, List, Optional
+from src.classifier import classify_emails
+from src.prompts import PROMPT_VERSION
+from src.store import MessageStore, hydrate_bodies
+from src.utils.logger import info, warn
+from src.utils.metrics import count, span
+
+# Most urgent first; unknown labels go last
+URGENCY = {"urgent": 0, "work": 1, "personal": 2, "general": 3}
+# A 'drafting' claim older than this belongs to a drafter that died
+DRAFTING_STALE_SECONDS = 180
+LOG_PATH = os.path.join("data", "predraft.log")
+
+
+def rank(rows: List[Dict]) -> List[str]:
+    """Ids of stored message rows, most urgent first (heuristic classifier; listing order breaks ties)."""
+    labels = classify_emails([(r["subject"] or "", r["snippet"] or "", r["sender"] or "") for r in rows])
+    order = sorted(range(len(rows)), key=lambda i: URGENCY.get(labels[i].get("label"), len(URGENCY)))
+    return [rows[i]["id"] for i in order]
+
+
+def draft_key(row: Dict, model: str) -> str:
+    """What a cached draft depends on: the stored message plus model and prompt version."""
+    parts = (row["id"], row["subject"] or "", row["sender"] or "", row["body"] or "", model, PROMPT_VERSION)
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+@span("predraft")
+def predraft(service, store: MessageStore, agent, msg_ids: List[str], gmail_lock=None) -> int:
+    """
+    Draft replies for `msg_ids` into the pre-draft cache, in the given order.
+    Bodies come in one batched call; each message is claimed first, so a
+    `reply` that got there earlier (or another drafter) is never duplicated.
+    Memory records ride along in the cache and are written by the `reply`
+    that uses the draft. Returns the number of drafts made.
+    """
+    if gmail_lock is not None:
+        with gmail_lock:
+            rows = hydrate_bodies(service, store, msg_ids)
+    else:
+        rows = hydrate_bodies(service, store, msg_ids)
+    made = 0
+    for row in rows:
+        if row is None:
+            continue
+        key = draft_key(row, agent.llm.model)
+        cached = store.get_predraft(row["id"])
+        if cached and cached["status"] == "ready" and cached["key"] == key:
+            continue
+        if not store.claim_predraft(row["id"], DRAFTING_STALE_SECONDS):
+            continue
+        try:
+            draft, record = agent.compose_reply(row["subject"] or "(no subject)", row["sender"] or "", row["body"] or "")
+        except Exception as e:
+            warn(f"Pre-drafting {row['id']} failed: {e}")
+            store.save_predraft(row["id"], key, None)
+            continue
+        store.save_predraft(row["id"], key, draft, record)
+        count("predrafts")
+        made += 1
+    return made
+
+
+def cached_draft(store: MessageStore, msg_id: str, key: str, wait: float = DRAFTING_STALE_SECONDS) -> Optional[Dict]:
+    """
+    The ready pre-draft for this exact message content, or None. While a
+    background drafter is generating it, waits (up to `wait` seconds) – the
+    LLM is busy with that draft anyway, so waiting is never slower than
+    starting a second generation.
+    """
+    deadline = time.time() + wait
+    while True:
+        row = store.get_predraft(msg_id)
+        if row is None:
+            return None
+        if row["status"] == "ready":
+            if row["key"] == key:
+                count("predraft_hits")
+                return row
+            return None
+        if row["status"] != "drafting" or time.time() - row["updated_at"] > DRAFTING_STALE_SECONDS \
+                or time.time() >= deadline:
+            return None
+        time.sleep(0.2)
+
+
+def spawn(msg_ids: List[str]):
+    """Pre-draft in a detached `predraft` process so the calling command can exit (output: data/predraft.log)."""
+    os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+    with open(LOG_PATH, "a", encoding="utf-8") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", "src.main", "--local", "predraft", *msg_ids],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True,
+        )
+    info(f"Pre-drafting {len(msg_ids)} message(s) in the background.")
@@ -0,0 +1,95 @@
+import os
+import re
+import math
+from typing import Dict, List, Optional, Union
+
+_PIECE = re.compile(r"\w+|[^\w\s]")
+
+Field = Union[str, List[str]]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimated token count. Ollama exposes no tokenizer for every model, so this
+    takes the larger of ~4 chars/token and ~0.75 words/token – a safe
+    overestimate for the SentencePiece/BPE vocabularies of small local models.
+    """
+    if not text:
+        return 0
+    return max(math.ceil(len(text) / 4), math.ceil(len(_PIECE.findall(text)) * 4 / 3))
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Longest word-aligned prefix of `text` estimated to fit in `budget` tokens."""
+    if budget <= 0:
+        return ""
+    if count_tokens(text) <= budget:
+        return text
+    cut = text[:budget * 4]
+    while cut and count_tokens(cut + " …") > budget:
+        cut = cut[:int(len(cut) * 0.9)]
+    cut = cut.rsplit(None, 1)[0] if " " in cut else cut
+    return cut + " …" if cut else ""
+
+
+class PromptBuilder:
+    """
+    Fits prompts into the model's context window.
+
+    Every prompt starts with the same `preamble` (identity, voice, signature),
+    byte-for-byte, so Ollama can reuse the KV cache of that prefix between
+    calls and only evaluate the per-email suffix. What is left of
+    `num_ctx` after the preamble, the template text and the reserved output
+    tokens is shared between the budgeted fields (email body, memory
+    examples, draft…) in proportion to their weights; fields that need less
+    than their share hand the rest to the others.
+    """
+
+    def __init__(self, preamble: str, num_ctx: Optional[int] = None, reserve: Optional[int] = None):
+        self.preamble = preamble
+        self.num_ctx = num_ctx or int(os.getenv("OLLAMA_NUM_CTX", "2048"))
+        self.reserve = reserve if reserve is not None else int(os.getenv("PROMPT_RESERVE_TOKENS", "256"))
+        self.preamble_tokens = count_tokens(preamble)
+
+    def build(self, template: str, fields: Dict[str, str], budgeted: Dict[str, Field],
+              weights: Optional[Dict[str, float]] = None) -> str:
+        """
+        `fields` are inserted as-is; `budgeted` values (a string, or a list of
+        strings sharing one allotment, joined by blank lines) are truncated to fit.
+        """
+        empty = {name: "" for name in budgeted}
+        fixed = self.preamble_tokens + count_tokens(template.format(**fields, **empty))
+        available = max(0, self.num_ctx - self.reserve - fixed)
+        allot = self._allocate(budgeted, weights or {}, available)
+
+        filled = {}
+        for name, value in budgeted.items():
+            if isinstance(value, list):
+                shares = self._allocate({str(i): v for i, v in enumerate(value)}, {}, allot[name])
+                parts = [truncate_tokens(v, shares[str(i)]) for i, v in enumerate(value)]
+                filled[name] = "\n\n".join(p for p in parts if p)
+            else:
+                filled[name] = truncate_tokens(value, allot[name])
+        return self.preamble + template.format(**fields, **filled)
+
+    @staticmethod
+    def _allocate(items: Dict[str, Field], weights: Dict[str, float], available: int) -> Dict[str, int]:
+        """Water-filling: split `available` by weight, re-sharing what small items do not use."""
+        need = {
+            k: sum(count_tokens(x) for x in v) if isinstance(v, list) else count_tokens(v)
+            for k, v in items.items()
+        }
+        allot, open_items, left = {}, set(items), available
+        while open_items:
+            total_w = sum(weights.get(k, 1.0) for k in open_items)
+            share = {k: left * weights.get(k, 1.0) / total_w for k in open_items}
+            satisfied = {k for k in open_items if need[k] <= share[k]}
+            if not satisfied:
+                for k in open_items:
+                    allot[k] = int(share[k])
+                break
+            for k in satisfied:
+                allot[k] = need[k]
+                left -= need[k]
+            open_items -= satisfied
+        return allot
@@ -1,3 +1,6 @@
+# Bump when the drafting prompt changes so memoized drafts are not reused
+PROMPT_VERSION = "draft-v2"
+
 CLASSIFY_TEMPLATE = (
     "You are a helpful email triage assistant. "
     "Classify the email into one of: urgent, personal, work, general.\n"
@@ -7,23 +10,61 @@ CLASSIFY_TEMPLATE = (
     "Body: {body}\n"
 )
 
-DRAFT_TEMPLATE = """You are a polite and concise email assistant.
-Read the following email and write a clear, professional, and friendly reply (under 120 words).
+# Static prefix of every agent prompt. It must not contain per-email values:
+# identical prefixes let Ollama reuse the cached KV state instead of re-evaluating it.
+AGENT_PREAMBLE = """You are {name}, {title} at {org}.
+You write email replies in your own voice — direct, polite, and confident.
+Avoid robotic phrasing or unnecessary explanations.
+Every reply ends with this signature exactly:
+{signature}
+"""
+
+DRAFT_TEMPLATE = """
+You are replying to an email from {sender_name}.
+The sender wrote the message below — you are responding to them.
+Assume you fully understand their request already.
 
+Tone: {tone}
+{context_line}Greeting: {greeting}
+
+Original Email:
 Subject: {subject}
-Sender: {sender}
-Body:
-{body}
+Body: {body}
+
+Write a short reply (≤120 words) that:
+- Sounds conversational and natural
+- Directly answers or acknowledges the sender
+- Uses short, clear sentences
+- Ends with the exact signature above
+"""
 
-Organization: {org_name}
+REFINE_TEMPLATE = """
+You are improving a reply you drafted earlier.
 
-Your reply should sound human and end with this signature:
-{signature}
+Original draft:
+{draft}
+
+Feedback from you (the author):
+"{feedback}"
+
+Task:
+- Apply the feedback directly to the draft.
+- Keep the same meaning and tone — do not rewrite it entirely.
+- Do NOT repeat the feedback text literally.
+- Preserve the greeting and closing signature exactly as they were.
+- Make the final version sound natural and human.
+
+Output ONLY the improved email text.
 """
 
-REFINE_TEMPLATE = (
-    "Improve the draft based on the feedback.\n\n"
-    "Draft:\n{draft}\n\n"
-    "Feedback:\n{feedback}\n\n"
-    "Return **only** the improved draft."
-)
+SUGGEST_TEMPLATE = """
+Use similar phrasing or tone from these past drafts:
+{examples}
+
+Email to answer:
+Subject: {subject}
+Body: {body}
+
+Write a concise (≤120 words) and human-like reply in your tone.
+Always end with your real signature.
+"""
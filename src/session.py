@@ -0,0 +1,339 @@
+import threading
+from queue import Queue
+from typing import Callable, Dict, Iterator, List, Optional
+from src.utils.logger import info, warn
+
+# Labels of mail that never gets an automatic draft
+NO_DRAFT_LABELS = {"SENT", "DRAFT", "SPAM", "TRASH", "CATEGORY_PROMOTIONS", "CATEGORY_SOCIAL"}
+
+_DONE = object()
+
+
+def streamed(produce: Callable[[Callable[[str], None]], Optional[str]]) -> Iterator[Dict]:
+    """
+    Turn `produce(on_token) -> text` into events: one {"event": "token"} per
+    token as it is generated, then {"event": "text"} with the final text.
+    """
+    tokens: Queue = Queue()
+    result: Dict = {}
+
+    def run():
+        try:
+            result["text"] = produce(tokens.put)
+        except Exception as e:
+            result["error"] = e
+        finally:
+            tokens.put(_DONE)
+
+    worker = threading.Thread(target=run, name="generate", daemon=True)
+    worker.start()
+    while True:
+        tok = tokens.get()
+        if tok is _DONE:
+            break
+        yield {"event": "token", "text": tok}
+    worker.join()
+    if "error" in result:
+        raise result["error"]
+    yield {"event": "text", "text": result["text"]}
+
+
+class Session:
+    """
+    The objects a command needs – Gmail service, `EmailAgent` (LLM client +
+    Chroma memory) – created on first use and kept for the life of the session.
+
+    A CLI invocation builds a session, runs one command and exits; `watch`
+    keeps one session warm and serves the same methods over its local API.
+    The Gmail client is not thread-safe, so every Gmail call goes through
+    `gmail_lock`; memory writes and compaction go through `memory_lock`.
+    Each call opens its own `MessageStore` (SQLite connections are per thread).
+    """
+
+    def __init__(self):
+        self.gmail_lock = threading.RLock()
+        self.memory_lock = threading.RLock()
+        self._service = None
+        self._agent = None
+        self._mem = None
+        self._init_lock = threading.Lock()
+
+    # ------------------------------------------------------------------ #
+    # Warm objects
+    # ------------------------------------------------------------------ #
+    def warm(self):
+        """Build the Gmail service and the agent (with its memory) now rather than on the first request."""
+        self.load_service()
+        self.load_agent()
+
+    def load_service(self):
+        if self._service is None:
+            from src.gmail_client import get_service
+            with self.gmail_lock:
+                if self._service is None:
+                    self._service = get_service()
+        return self._service
+
+    def load_agent(self):
+        if self._agent is None:
+            from src.agent import EmailAgent
+            with self._init_lock:
+                if self._agent is None:
+                    self._agent = EmailAgent()
+        return self._agent
+
+    @property
+    def service(self):
+        return self.load_service()
+
+    @property
+    def agent(self):
+        return self.load_agent()
+
+    @property
+    def mem(self):
+        # `memory` and `compact` need only the store, not the agent; reuse the agent's once it exists
+        if self._agent is not None:
+            return self._agent.mem
+        if self._mem is None:
+            from src.memory import Memory
+            with self._init_lock:
+                if self._mem is None:
+                    self._mem = Memory("emails")
+        return self._mem
+
+    # ------------------------------------------------------------------ #
+    # Commands
+    # ------------------------------------------------------------------ #
+    def fetch(self, q: str, n: int) -> List[Dict]:
+        """
+        Sync the store and return header rows of the newest `n` messages for `q`,
+        straight from the store when it can answer `q` (see `MessageStore.search`).
+        """
+        from src.gmail_client import list_messages
+        from src.store import MessageStore, hydrate, sync
+        store = MessageStore()
+        with self.gmail_lock:
+            sync(self.service, store)
+            rows = store.search(q, n)
+            if rows is None:
+                # Headers come from the local store; only unseen ids hit Gmail (one batched call)
+                rows = hydrate(self.service, store, [m["id"] for m in list_messages(self.service, q, n)])
+        return [{"id": row["id"], "sender": row["sender"], "subject": row["subject"]} for row in rows]
+
+    def queue_predrafts(self, msg_ids: List[str], n: int) -> List[str]:
+        """Mark the `n` most urgent of `msg_ids` (already stored) for pre-drafting; returns them in order."""
+        from src.predraft import rank
+        from src.store import MessageStore
+        store = MessageStore()
+        chosen = rank([r for r in store.get_many(msg_ids) if r])[:n]
+        store.queue_predrafts(chosen)
+        return chosen
+
+    def predraft(self, msg_ids: List[str]) -> int:
+        """Draft replies for `msg_ids` into the pre-draft cache (see src/predraft.py)."""
+        from src.predraft import predraft as run_predraft
+        from src.store import MessageStore
+        return run_predraft(self.service, MessageStore(), self.agent, msg_ids, gmail_lock=self.gmail_lock)
+
+    def reply_events(self, msg_id: str, feedback: str = "", send: bool = False) -> Iterator[Dict]:
+        """Classify → draft → (optional refine) → (optional send), as render events."""
+        from src.gmail_client import get_message, list_messages
+        from src.mime import message_text
+        from src.store import MessageStore, hydrate
+        from src.classifier import classify_email
+        from src.predraft import DRAFTING_STALE_SECONDS, cached_draft, draft_key
+        from src.utils.text import clean_html
+        store = MessageStore()
+
+        # === Resolve short ID to full (local prefix index first, Gmail on a miss) ===
+        if len(msg_id) < 16:
+            matching_ids = store.resolve_prefix(msg_id)
+            if not matching_ids:
+                with self.gmail_lock:
+                    recent_msgs = list_messages(self.service, query=None, max_results=100)
+                    matching_ids = [m['id'] for m in recent_msgs if m['id'].startswith(msg_id)]
+                    hydrate(self.service, store, matching_ids)
+            if not matching_ids:
+                yield {"event": "error", "text": f"No known message found with ID starting with '{msg_id}'"}
+                return
+            if len(matching_ids) > 1:
+                yield {"event": "error", "text": f"Multiple messages match '{msg_id}'; use full ID or a longer prefix:"}
+                for row in store.get_many(matching_ids):
+                    if row:
+                        yield {"event": "print", "text": f"  {row['id']}  {row['sender'][:40]}  {row['subject'][:60]}"}
+                return
+            msg_id = matching_ids[0]
+            yield {"event": "info", "text": f"Resolved short ID to full: {msg_id}"}
+
+        row = store.get(msg_id)
+        if row is None or row['body'] is None:
+            with self.gmail_lock:
+                full = get_message(self.service, msg_id)
+                store.upsert(full, message_text(self.service, full))
+            row = store.get(msg_id)
+
+        hdrs = row['headers']
+        frm = hdrs.get('from', '')
+        subj = hdrs.get('subject', '(no subject)')
+        body_html = row['body']
+
+        snippet = clean_html(body_html, limit=140)
+        cat = classify_email(subj, snippet, frm, body_html)
+        agent = self.agent
+
+        yield {"event": "rule", "text": "Classification"}
+        yield {"event": "print", "text": cat}
+
+        # --- Draft: pre-drafted by `fetch --predraft` if unchanged, else generated live ---
+        yield {"event": "rule", "text": "Draft Reply"}
+        key = draft_key(row, agent.llm.model)
+        pre = store.get_predraft(msg_id)
+        if pre and pre["status"] == "drafting":
+            yield {"event": "info", "text": "Waiting for the background draft of this message…"}
+        pre = cached_draft(store, msg_id, key)
+
+        if pre:
+            final_text = pre["draft"]
+            if pre["record"]:
+                with self.memory_lock:
+                    agent.remember([pre["record"]])
+                store.save_predraft(msg_id, key, final_text)  # remembered once
+            yield {"event": "info", "text": "Using the pre-drafted reply."}
+            yield {"event": "text", "text": final_text}
+        else:
+            # Claim it so a background drafter does not start the same message meanwhile
+            claimed = store.claim_predraft(msg_id, DRAFTING_STALE_SECONDS)
+
+            def produce_draft(on_token):
+                text, record = agent.compose_reply(subj, frm, body_html, on_token=on_token)
+                with self.memory_lock:
+                    agent.remember([record])
+                return text
+
+            final_text = None
+            try:
+                for event in streamed(produce_draft):
+                    final_text = event["text"] if event["event"] == "text" else final_text
+                    yield event
+            finally:
+                if claimed:
+                    store.save_predraft(msg_id, key, final_text)
+
+        # --- Optional refinement with feedback ---
+        if feedback:
+            yield {"event": "rule", "text": "Refined Draft (based on feedback)"}
+            draft_text = final_text
+            for event in streamed(lambda on_token: agent.refine(draft_text, feedback, on_token=on_token)):
+                final_text = event["text"] if event["event"] == "text" else final_text
+                yield event
+
+        # --- Optional sending (through the outbox: paced, retried, threaded) ---
+        if send:
+            from src.outbox import reply_item
+            with self.gmail_lock:
+                item = reply_item(self.service, store, msg_id, final_text)
+            if not store.enqueue_send(item):
+                yield {"event": "error", "text": "A reply to this message has already been sent."}
+                return
+            yield {"event": "info", "text": f"Sending to {item['to_addr']} ..."}
+            self.deliver(only=[msg_id])
+            sent = store.get_send(msg_id)
+            if sent["status"] == "sent":
+                yield {"event": "info", "text": "Sent!"}
+            else:
+                yield {"event": "error", "text": f"Not sent ({sent['status']}): {sent['error']}"}
+
+    def triage(self, q: str, n: int, workers: int = 2) -> List[Dict]:
+        """Draft replies for every matching message into the review queue."""
+        from src.store import MessageStore
+        from src.triage import triage as run_triage
+        return run_triage(self.service, MessageStore(), self.agent, q, n, draft_workers=workers,
+                          gmail_lock=self.gmail_lock, memory_lock=self.memory_lock)
+
+    def approve(self, prefixes: List[str], all_pending: bool = False) -> Dict:
+        """Queue pending review-queue drafts (by id prefix, or all) for sending, then send them."""
+        from src.outbox import reply_item
+        from src.store import MessageStore
+        store = MessageStore()
+        if all_pending:
+            drafts = store.drafts("pending")
+        else:
+            ids = dict.fromkeys(i for p in prefixes for i in store.resolve_prefix(p))
+            drafts = [d for d in (store.get_draft(i) for i in ids) if d and d["status"] == "pending"]
+        queued = []
+        with self.gmail_lock:
+            for d in drafts:
+                if store.enqueue_send(reply_item(self.service, store, d["msg_id"], d["draft"])):
+                    store.set_draft_status(d["msg_id"], "approved")
+                    queued.append(d["msg_id"])
+        return {"queued": len(queued), **self.deliver(only=queued)}
+
+    def retry(self, prefixes: List[str], all_failed: bool = False) -> Dict:
+        """Re-queue failed outbox replies (by id prefix, or all) with fresh attempts, then send them."""
+        from src.store import MessageStore
+        store = MessageStore()
+        failed = [r["msg_id"] for r in store.sends("failed")]
+        ids = failed if all_failed else [i for i in failed if any(i.startswith(p) for p in prefixes)]
+        requeued = store.requeue_sends(ids)
+        return {"requeued": len(requeued), **self.deliver(only=requeued)}
+
+    def deliver(self, wait: bool = True, only: Optional[List[str]] = None) -> Dict:
+        """Send due outbox replies at the quota limit (see `Outbox.run`)."""
+        from src.outbox import Outbox
+        from src.store import MessageStore
+        return Outbox(self.service, MessageStore(), lock=self.gmail_lock).run(wait=wait, only=only)
+
+    def memory(self, query: str, k: int, where: Optional[Dict] = None) -> Dict:
+        """Hybrid memory search plus embedding-cache stats."""
+        mem = self.mem
+        return {"results": mem.search(query, k=k, where=where), "cache": mem.embed_fn.stats()}
+
+    def compact(self, **options) -> Dict:
+        """Memory compaction; blocks memory writes from other threads meanwhile."""
+        with self.memory_lock:
+            return self.mem.compact(**options)
+
+    def suggest_events(self, subject: str, body: str) -> Iterator[Dict]:
+        agent = self.agent
+        yield {"event": "rule", "text": "Memory-Based Suggestion"}
+        yield from streamed(lambda on_token: agent.suggest_with_memory(subject, body, on_token=on_token))
+
+    # ------------------------------------------------------------------ #
+    # Watching
+    # ------------------------------------------------------------------ #
+    def poll(self) -> List[Dict]:
+        """
+        Pull the history delta and draft a reply for each newly arrived inbox
+        message (into the review queue). Gmail I/O happens under `gmail_lock`;
+        generation does not hold it, so API calls are served meanwhile.
+        """
+        from src.store import MessageStore, hydrate_bodies, sync
+        store = MessageStore()
+        with self.gmail_lock:
+            new_ids = sync(self.service, store)
+            wanted = [
+                row["id"] for row in store.get_many(new_ids)
+                if row and "INBOX" in row["labels"] and not NO_DRAFT_LABELS & set(row["labels"])
+                and store.get_draft(row["id"]) is None
+            ]
+            rows = hydrate_bodies(self.service, store, wanted) if wanted else []
+
+        drafted = []
+        for row in rows:
+            subject = row["headers"].get("subject", "(no subject)")
+            sender = row["headers"].get("from", "")
+            body = row["body"] or ""
+            try:
+                draft, record = self.agent.compose_reply(subject, sender, body)
+                with self.memory_lock:
+                    self.agent.remember([record])
+            except Exception as e:
+                warn(f"Drafting {row['id']} failed: {e}")
+                continue
+            drafted.append({"msg_id": row["id"], "thread_id": row["thread_id"], "sender": sender,
+                            "subject": subject, "label": record["metadata"].get("label", "general"), "draft": draft})
+        if drafted:
+            store.save_drafts(drafted)
+            info(f"Drafted {len(drafted)} new message(s) into the review queue.")
+        return drafted
@@ -0,0 +1,507 @@
+import os
+import re
+import json
+import time
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+from src.gmail_client import (
+    LIST_HEADERS, get_messages, get_profile, header_map, list_history, list_message_pages,
+)
+from src.mime import message_text
+from src.utils.logger import info, warn
+
+STORE_PATH = os.path.join("data", "messages.sqlite3")
+# Messages the first sync stores headers for; older ones are listed through Gmail on demand
+BASELINE_MESSAGES = 500
+
+# Gmail search terms the store can answer itself (see `MessageStore.search`)
+_IN = {"inbox": "INBOX", "sent": "SENT", "chats": "CHAT", "spam": "SPAM", "trash": "TRASH",
+       "starred": "STARRED", "important": "IMPORTANT", "drafts": "DRAFT"}
+_IS = {"unread": "UNREAD", "starred": "STARRED", "important": "IMPORTANT"}
+_CATEGORY = {"primary": "CATEGORY_PERSONAL", "personal": "CATEGORY_PERSONAL", "social": "CATEGORY_SOCIAL",
+             "promotions": "CATEGORY_PROMOTIONS", "updates": "CATEGORY_UPDATES", "forums": "CATEGORY_FORUMS"}
+_AGE = {"d": 86400, "m": 30 * 86400, "y": 365 * 86400}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id            TEXT PRIMARY KEY,
+    thread_id     TEXT,
+    history_id    TEXT,
+    internal_date INTEGER,
+    sender        TEXT,
+    subject       TEXT,
+    snippet       TEXT,
+    headers       TEXT,
+    labels        TEXT,
+    body          TEXT,
+    updated_at    REAL
+);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (internal_date);
+CREATE TABLE IF NOT EXISTS drafts (
+    msg_id     TEXT PRIMARY KEY,
+    thread_id  TEXT,
+    sender     TEXT,
+    subject    TEXT,
+    label      TEXT,
+    draft      TEXT,
+    status     TEXT NOT NULL DEFAULT 'pending',
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    msg_id      TEXT PRIMARY KEY,  -- the message answered: at most one reply each
+    thread_id   TEXT,
+    to_addr     TEXT,
+    subject     TEXT,
+    body        TEXT,
+    in_reply_to TEXT,
+    refs        TEXT,
+    message_id  TEXT,              -- our Message-ID, to find a send that outlived a crash
+    status      TEXT NOT NULL DEFAULT 'queued',  -- queued / sending / sent / failed
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    next_at     REAL NOT NULL DEFAULT 0,
+    sent_id     TEXT,
+    error       TEXT,
+    created_at  REAL,
+    updated_at  REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_at);
+CREATE TABLE IF NOT EXISTS predrafts (
+    msg_id     TEXT PRIMARY KEY,
+    key        TEXT,              -- content + model + prompt version the draft was made for
+    status     TEXT NOT NULL DEFAULT 'pending',  -- pending / drafting / ready / failed
+    draft      TEXT,
+    record     TEXT,              -- memory record (JSON), remembered when the draft is used
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class MessageStore:
+    """
+    Local SQLite copy of the mailbox (headers, decoded bodies, labels).
+    Kept current through the Gmail history API – see `sync`.
+    """
+
+    def __init__(self, path: str = STORE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        # WAL lets pipeline stages read and write through separate connections
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    # ------------------------------------------------------------------ #
+    # Sync state
+    # ------------------------------------------------------------------ #
+    def _state(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _set_state(self, key: str, value):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def history_id(self) -> Optional[str]:
+        return self._state("history_id")
+
+    def set_history_id(self, history_id: str):
+        self._set_state("history_id", history_id)
+
+    def baseline_since(self) -> Optional[int]:
+        """internalDate (ms) from which the store holds every message; 0 = the whole mailbox, None = no baseline."""
+        value = self._state("baseline_since")
+        return int(value) if value is not None else None
+
+    def set_baseline_since(self, since: int):
+        self._set_state("baseline_since", since)
+
+    # ------------------------------------------------------------------ #
+    # Messages
+    # ------------------------------------------------------------------ #
+    def upsert(self, msg: Dict, body: Optional[str] = None):
+        """Store a Gmail message resource (any format). A known body is never cleared."""
+        self.upsert_many([msg], [body])
+
+    def upsert_many(self, msgs: List[Dict], bodies: Optional[List[Optional[str]]] = None):
+        """Headers are merged into the stored set, so a metadata-only get never drops full headers."""
+        bodies = bodies or [None] * len(msgs)
+        now = time.time()
+        rows = []
+        for msg, body in zip(msgs, bodies):
+            hdrs = header_map(msg)
+            rows.append((
+                msg["id"], msg.get("threadId"), msg.get("historyId"), int(msg.get("internalDate", 0) or 0),
+                hdrs.get("from", ""), hdrs.get("subject", ""), msg.get("snippet", ""),
+                json.dumps(hdrs), json.dumps(msg.get("labelIds", [])), body, now,
+            ))
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO messages (id, thread_id, history_id, internal_date, sender, subject,
+                                      snippet, headers, labels, body, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    thread_id = excluded.thread_id,
+                    history_id = excluded.history_id,
+                    internal_date = excluded.internal_date,
+                    sender = excluded.sender,
+                    subject = excluded.subject,
+                    snippet = excluded.snippet,
+                    headers = json_patch(COALESCE(messages.headers, '{}'), excluded.headers),
+                    labels = excluded.labels,
+                    body = COALESCE(excluded.body, messages.body),
+                    updated_at = excluded.updated_at
+                """,
+                rows,
+            )
+
+    def set_labels(self, msg_id: str, labels: List[str]):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE messages SET labels = ?, updated_at = ? WHERE id = ?",
+                (json.dumps(labels), time.time(), msg_id),
+            )
+
+    def delete(self, msg_ids: Iterable[str]):
+        with self.conn:
+            self.conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in msg_ids])
+
+    def get(self, msg_id: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def get_many(self, msg_ids: List[str]) -> List[Optional[Dict]]:
+        """Rows for `msg_ids` in the same order; unknown ids map to None."""
+        found = {}
+        for start in range(0, len(msg_ids), 500):
+            chunk = msg_ids[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            for row in self.conn.execute(f"SELECT * FROM messages WHERE id IN ({marks})", chunk):
+                found[row["id"]] = self._row(row)
+        return [found.get(i) for i in msg_ids]
+
+    def missing(self, msg_ids: List[str]) -> List[str]:
+        return [i for i, row in zip(msg_ids, self.get_many(msg_ids)) if row is None]
+
+    def search(self, q: str, n: int) -> Optional[List[Dict]]:
+        """
+        The newest `n` rows matching Gmail query `q`, answered locally, or None
+        when Gmail has to: `q` uses a term `local_query` can't evaluate, there
+        is no baseline yet, or the answer reaches past what the baseline covers.
+        """
+        since, parsed = self.baseline_since(), local_query(q)
+        if since is None or parsed is None:
+            return None
+        where, params, cutoff = parsed
+        rows = self.conn.execute(
+            f"SELECT * FROM messages WHERE {where} ORDER BY internal_date DESC, id DESC LIMIT ?", (*params, n)
+        ).fetchall()
+        full = len(rows) == n and (not rows or rows[-1]["internal_date"] >= since)
+        if since and not full and (cutoff or 0) < since:
+            return None
+        return [self._row(r) for r in rows]
+
+    def resolve_prefix(self, prefix: str, limit: int = 10) -> List[str]:
+        """
+        Ids starting with `prefix`, via a range scan on the primary-key B-tree
+        (O(log n), offline). At most `limit` candidates are returned.
+        """
+        if not prefix:
+            return []
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self.conn.execute(
+            "SELECT id FROM messages WHERE id >= ? AND id < ? ORDER BY id LIMIT ?",
+            (prefix, upper, limit),
+        )
+        return [r["id"] for r in rows]
+
+    # ------------------------------------------------------------------ #
+    # Review queue (drafts awaiting approval)
+    # ------------------------------------------------------------------ #
+    def save_drafts(self, drafts: List[Dict]):
+        """Queue drafts for review; a re-drafted message replaces its earlier pending draft."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO drafts (msg_id, thread_id, sender, subject, label, draft, status, created_at)
+                VALUES (:msg_id, :thread_id, :sender, :subject, :label, :draft, 'pending', :created_at)
+                """,
+                [{**d, "created_at": now} for d in drafts],
+            )
+
+    def drafts(self, status: str = "pending") -> List[Dict]:
+        rows = self.conn.execute(
+            "SELECT * FROM drafts WHERE status = ? ORDER BY created_at, msg_id", (status,)
+        )
+        return [dict(r) for r in rows]
+
+    def get_draft(self, msg_id: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM drafts WHERE msg_id = ?", (msg_id,)).fetchone()
+        return dict(row) if row else None
+
+    def set_draft_status(self, msg_id: str, status: str):
+        with self.conn:
+            self.conn.execute("UPDATE drafts SET status = ? WHERE msg_id = ?", (status, msg_id))
+
+    # ------------------------------------------------------------------ #
+    # Outbox (approved replies waiting to be sent – see src/outbox.py)
+    # ------------------------------------------------------------------ #
+    def enqueue_send(self, item: Dict) -> bool:
+        """
+        Queue a reply to `item["msg_id"]`. A queued or failed reply is replaced;
+        one that is being sent or was sent is left alone (returns False).
+        """
+        now = time.time()
+        with self.conn:
+            cur = self.conn.execute(
+                """
+                INSERT INTO outbox (msg_id, thread_id, to_addr, subject, body, in_reply_to, refs, message_id,
+                                    status, attempts, next_at, created_at, updated_at)
+                VALUES (:msg_id, :thread_id, :to_addr, :subject, :body, :in_reply_to, :refs, :message_id,
+                        'queued', 0, 0, :now, :now)
+                ON CONFLICT(msg_id) DO UPDATE SET
+                    thread_id = excluded.thread_id, to_addr = excluded.to_addr, subject = excluded.subject,
+                    body = excluded.body, in_reply_to = excluded.in_reply_to, refs = excluded.refs,
+                    message_id = excluded.message_id, status = 'queued', attempts = 0, next_at = 0,
+                    error = NULL, updated_at = excluded.updated_at
+                WHERE outbox.status IN ('queued', 'failed')
+                """,
+                {**item, "now": now},
+            )
+        return cur.rowcount > 0
+
+    def due_sends(self, now: float, limit: int = 50, only: Optional[List[str]] = None) -> List[Dict]:
+        """Queued replies whose backoff has elapsed, oldest first (just the `only` message ids when given)."""
+        sql, params = "SELECT * FROM outbox WHERE status = 'queued' AND next_at <= ?", [now]
+        if only is not None:
+            sql += f" AND msg_id IN ({','.join('?' * len(only))})"
+            params += only
+        rows = self.conn.execute(sql + " ORDER BY next_at, created_at LIMIT ?", (*params, limit))
+        return [dict(r) for r in rows]
+
+    def requeue_sends(self, msg_ids: List[str]) -> List[str]:
+        """Move failed replies back to 'queued' with a fresh attempt budget; returns the ids moved."""
+        now, moved = time.time(), []
+        with self.conn:
+            for msg_id in msg_ids:
+                cur = self.conn.execute(
+                    "UPDATE outbox SET status = 'queued', attempts = 0, next_at = 0, error = NULL, updated_at = ? "
+                    "WHERE msg_id = ? AND status = 'failed'",
+                    (now, msg_id),
+                )
+                if cur.rowcount:
+                    moved.append(msg_id)
+        return moved
+
+    def claim_send(self, msg_id: str) -> bool:
+        """Atomically move a queued reply to 'sending' (False if another process got it first)."""
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE outbox SET status = 'sending', attempts = attempts + 1, updated_at = ? "
+                "WHERE msg_id = ? AND status = 'queued'",
+                (time.time(), msg_id),
+            )
+        return cur.rowcount == 1
+
+    def update_send(self, msg_id: str, **fields):
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = :{k}" for k in fields)
+        with self.conn:
+            self.conn.execute(f"UPDATE outbox SET {cols} WHERE msg_id = :msg_id", {**fields, "msg_id": msg_id})
+
+    def sends(self, status: Optional[str] = None) -> List[Dict]:
+        if status is None:
+            rows = self.conn.execute("SELECT * FROM outbox ORDER BY created_at, msg_id")
+        else:
+            rows = self.conn.execute("SELECT * FROM outbox WHERE status = ? ORDER BY created_at, msg_id", (status,))
+        return [dict(r) for r in rows]
+
+    def get_send(self, msg_id: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM outbox WHERE msg_id = ?", (msg_id,)).fetchone()
+        return dict(row) if row else None
+
+    # ------------------------------------------------------------------ #
+    # Pre-draft cache (speculative drafts for listed messages – see src/predraft.py)
+    # ------------------------------------------------------------------ #
+    def queue_predrafts(self, msg_ids: List[str]):
+        """Mark messages for background drafting; ready or in-flight drafts are kept."""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO predrafts (msg_id, status, updated_at) VALUES (?, 'pending', ?)
+                ON CONFLICT(msg_id) DO UPDATE SET status = 'pending', updated_at = excluded.updated_at
+                WHERE predrafts.status = 'failed'
+                """,
+                [(i, now) for i in msg_ids],
+            )
+
+    def claim_predraft(self, msg_id: str, stale_after: float) -> bool:
+        """
+        Atomically take a message for drafting: pending, or a 'drafting' claim older
+        than `stale_after` seconds (its process died). False if someone else has it.
+        """
+        now = time.time()
+        with self.conn:
+            cur = self.conn.execute(
+                """
+                INSERT INTO predrafts (msg_id, status, updated_at) VALUES (?, 'drafting', ?)
+                ON CONFLICT(msg_id) DO UPDATE SET status = 'drafting', updated_at = excluded.updated_at
+                WHERE predrafts.status IN ('pending', 'failed', 'ready')
+                   OR (predrafts.status = 'drafting' AND predrafts.updated_at < ?)
+                """,
+                (msg_id, now, now - stale_after),
+            )
+        return cur.rowcount == 1
+
+    def save_predraft(self, msg_id: str, key: str, draft: Optional[str], record: Optional[Dict] = None):
+        """Store a finished draft (`draft` None marks the attempt failed)."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE predrafts SET key = ?, status = ?, draft = ?, record = ?, updated_at = ? WHERE msg_id = ?",
+                (key, "ready" if draft is not None else "failed", draft,
+                 json.dumps(record) if record else None, time.time(), msg_id),
+            )
+
+    def get_predraft(self, msg_id: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM predrafts WHERE msg_id = ?", (msg_id,)).fetchone()
+        if row is None:
+            return None
+        d = dict(row)
+        d["record"] = json.loads(d["record"]) if d["record"] else None
+        return d
+
+    @staticmethod
+    def _row(row: sqlite3.Row) -> Dict:
+        d = dict(row)
+        d["headers"] = json.loads(d["headers"] or "{}")
+        d["labels"] = json.loads(d["labels"] or "[]")
+        return d
+
+
+def local_query(q: Optional[str]) -> Optional[Tuple[str, List, Optional[int]]]:
+    """
+    SQL WHERE clause and params for a Gmail query made only of `in:`, `is:`,
+    `category:` (each optionally negated) and `newer_than:` terms, plus the
+    newer_than cutoff in ms. Spam and trash are left out unless asked for,
+    as Gmail does. None if any term needs Gmail's own search.
+    """
+    clauses, params, cutoff, hidden = [], [], None, {"SPAM", "TRASH"}
+    for term in (q or "").split():
+        negate = term.startswith("-")
+        op, _, value = term.lstrip("-").lower().partition(":")
+        if op == "newer_than" and not negate:
+            age = re.fullmatch(r"(\d+)([dmy])", value)
+            if not age:
+                return None
+            cutoff = max(cutoff or 0, int((time.time() - int(age[1]) * _AGE[age[2]]) * 1000))
+            continue
+        label = {"in": _IN, "is": _IS, "category": _CATEGORY}.get(op, {}).get(value)
+        if label is None:
+            return None
+        if not negate:
+            hidden.discard(label)
+        clauses.append("labels NOT LIKE ?" if negate else "labels LIKE ?")
+        params.append(f'%"{label}"%')
+    if cutoff:
+        clauses.append("internal_date >= ?")
+        params.append(cutoff)
+    for label in sorted(hidden):
+        clauses.append("labels NOT LIKE ?")
+        params.append(f'%"{label}"%')
+    return " AND ".join(clauses), params, cutoff
+
+
+# ---------------------------------------------------------------------- #
+# Sync
+# ---------------------------------------------------------------------- #
+def hydrate_bodies(service, store: MessageStore, msg_ids: List[str]) -> List[Dict]:
+    """Like `hydrate`, but makes sure decoded bodies are stored (batched `full` gets)."""
+    rows = store.get_many(msg_ids)
+    need = [i for i, row in zip(msg_ids, rows) if row is None or row["body"] is None]
+    if need:
+        full = get_messages(service, need, fmt="full")
+        store.upsert_many(full, [message_text(service, m) for m in full])
+        rows = store.get_many(msg_ids)
+    return rows
+
+
+def hydrate(service, store: MessageStore, msg_ids: List[str]) -> List[Dict]:
+    """Return stored rows for `msg_ids`, fetching headers only for ids not seen before."""
+    missing = store.missing(msg_ids)
+    if missing:
+        store.upsert_many(get_messages(service, missing, fmt="metadata", headers=LIST_HEADERS))
+    return store.get_many(msg_ids)
+
+
+def backfill(service, store: MessageStore, limit: Optional[int] = None) -> int:
+    """
+    Initial sync: store headers and labels for the newest `limit` messages
+    (SYNC_BASELINE, default 500; 0 = the whole mailbox), one list page and one
+    batched metadata call per 500 ids; ids already stored are skipped, so an
+    interrupted backfill resumes cheaply. The historyId is read before the
+    walk, so mail that changes meanwhile arrives with the next delta.
+    Returns the number of messages listed.
+    """
+    limit = int(os.getenv("SYNC_BASELINE", str(BASELINE_MESSAGES))) if limit is None else limit
+    history_id = get_profile(service)["historyId"]
+    listed, oldest, complete = 0, None, True
+    for msgs, token in list_message_pages(service, None, 500):
+        if limit and listed + len(msgs) >= limit:
+            complete = token is None and listed + len(msgs) == limit
+            msgs = msgs[:limit - listed]
+        for row in hydrate(service, store, [m["id"] for m in msgs]):
+            oldest = row["internal_date"] if oldest is None else min(oldest, row["internal_date"])
+        listed += len(msgs)
+        if limit and listed >= limit:
+            break
+    store.set_baseline_since(0 if complete else oldest or 0)
+    store.set_history_id(history_id)
+    info(f"Baseline sync stored {listed} message(s).")
+    return listed
+
+
+def sync(service, store: MessageStore) -> List[str]:
+    """
+    Bring the store up to date with one `history.list` delta call.
+    The first call (or one after the historyId expired) runs `backfill`.
+    Returns the ids of messages added since the previous sync.
+    """
+    start = store.history_id()
+    if start is None:
+        backfill(service, store)
+        return []
+
+    try:
+        records, latest = list_history(service, start)
+    except Exception as e:  # historyId too old (404) – restart from the current mailbox state
+        if getattr(getattr(e, "resp", None), "status", None) != 404:
+            raise
+        warn("Stored historyId expired; running a fresh baseline sync.")
+        backfill(service, store)
+        return []
+
+    added, deleted = [], set()
+    for rec in records:
+        for item in rec.get("messagesAdded", []):
+            added.append(item["message"]["id"])
+        for item in rec.get("messagesDeleted", []):
+            deleted.add(item["message"]["id"])
+        for key in ("labelsAdded", "labelsRemoved"):
+            for item in rec.get(key, []):
+                msg = item["message"]
+                store.set_labels(msg["id"], msg.get("labelIds", []))
+
+    store.delete(deleted)
+    new_ids = [i for i in dict.fromkeys(added) if i not in deleted]
+    hydrate(service, store, new_ids)
+    store.set_history_id(latest)
+    if records:
+        info(f"Synced {len(records)} mailbox change(s) from history.")
+    return new_ids
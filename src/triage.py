@@ -0,0 +1,107 @@
+import threading
+from contextlib import nullcontext
+from queue import Queue
+from typing import Dict, List
+from src.agent import EmailAgent
+from src.gmail_client import list_messages
+from src.store import MessageStore, hydrate_bodies
+from src.utils.logger import info, warn
+
+_DONE = object()
+
+
+def triage(service, store: MessageStore, agent: EmailAgent, query: str, n: int,
+           draft_workers: int = 2, fetch_batch: int = 10, write_batch: int = 16,
+           gmail_lock=None, memory_lock=None) -> List[Dict]:
+    """
+    Draft replies for up to `n` messages matching `query` as a pipelined job.
+
+    Stages (each with its own concurrency bound):
+      fetch + decode             – 1 thread (the Gmail client is not thread-safe),
+                                   `fetch_batch` bodies per batched round trip
+      classify + draft           – `draft_workers` threads calling the LLM
+      write                      – 1 thread; batched memory upsert + review queue
+    Bounded queues between stages let Gmail I/O, generation and embedding overlap.
+    `gmail_lock` / `memory_lock` (see `Session`) are held only around each
+    Gmail call and memory write, never across generation. Returns the queued
+    drafts in completion order.
+    """
+    gmail = gmail_lock or nullcontext()
+    memory = memory_lock or nullcontext()
+    with gmail:
+        ids = [m["id"] for m in list_messages(service, query, n)]
+    if not ids:
+        return []
+
+    draft_q: Queue = Queue(maxsize=draft_workers * 2)
+    write_q: Queue = Queue(maxsize=write_batch * 2)
+    results: List[Dict] = []
+
+    def drafter():
+        while True:
+            item = draft_q.get()
+            if item is _DONE:
+                return
+            try:
+                draft, record = agent.compose_reply(item["subject"], item["sender"], item["body"])
+                write_q.put({**item, "draft": draft, "record": record,
+                             "label": record["metadata"].get("label", "general")})
+            except Exception as e:
+                warn(f"Drafting {item['msg_id']} failed: {e}")
+
+    def writer():
+        # Own connection: SQLite connections must not be shared across threads
+        out = MessageStore(store.path)
+        pending = []
+
+        def flush():
+            if not pending:
+                return
+            try:
+                with memory:
+                    agent.remember([p["record"] for p in pending])
+            except Exception as e:  # keep draining so drafters never block on a full queue
+                warn(f"Memory write for {len(pending)} draft(s) failed: {e}")
+            queued = [{k: p[k] for k in ("msg_id", "thread_id", "sender", "subject", "label", "draft")}
+                      for p in pending]
+            out.save_drafts(queued)
+            results.extend(queued)
+            pending.clear()
+
+        while True:
+            item = write_q.get()
+            if item is _DONE:
+                flush()
+                return
+            pending.append(item)
+            if len(pending) >= write_batch or write_q.empty():
+                flush()
+
+    drafters = [threading.Thread(target=drafter, name=f"triage-draft-{i}") for i in range(draft_workers)]
+    write_thread = threading.Thread(target=writer, name="triage-write")
+    for t in drafters + [write_thread]:
+        t.start()
+
+    try:
+        for start in range(0, len(ids), fetch_batch):
+            chunk = ids[start:start + fetch_batch]
+            with gmail:
+                rows = hydrate_bodies(service, store, chunk)
+            for row in rows:
+                body = row["body"] or ""
+                subject = row["headers"].get("subject", "(no subject)")
+                sender = row["headers"].get("from", "")
+                draft_q.put({
+                    "msg_id": row["id"], "thread_id": row["thread_id"], "subject": subject,
+                    "sender": sender, "body": body,
+                })
+    finally:
+        for _ in drafters:
+            draft_q.put(_DONE)
+        for t in drafters:
+            t.join()
+        write_q.put(_DONE)
+        write_thread.join()
+
+    info(f"Triage queued {len(results)} of {len(ids)} draft(s) for review.")
+    return results
@@ -0,0 +1,160 @@
+import re
+from html.parser import HTMLParser
+from typing import List, NamedTuple, Optional
+
+# Elements whose content is never visible in a mail client. Not "head": its
+# closing tag is optional, and its visible-text-free children are all listed
+SKIP_TAGS = {"script", "style", "title", "noscript", "template", "svg", "object"}
+# Elements that start a new line of text
+BLOCK_TAGS = {"p", "div", "br", "li", "tr", "td", "table", "ul", "ol", "hr",
+              "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "section", "article"}
+# Quoted-reply containers used by Gmail, Yahoo, Apple Mail and Outlook web
+QUOTE_CLASSES = ("gmail_quote", "yahoo_quoted", "moz-cite-prefix", "divrplyfwdmsg")
+
+# Lines that start a quoted reply chain / forwarded block / signature: stop there
+_STOP_LINE = re.compile(
+    r"^\s*(?:on\b.{0,200}\bwrote:\s*$"
+    r"|-{2,}\s*original message\s*-{2,}"
+    r"|-{2,}\s*forwarded message\s*-{2,}"
+    r"|_{10,}\s*$"
+    r"|--\s*$)",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"\b[a-zA-Z]{4,}\b")
+_WS = re.compile(r"\s+")
+# Plain-text bodies may contain "<bob@x.com>"; only real markup goes through the parser
+_HTML_HINT = re.compile(r"<\s*/?\s*(?:html|body|head|div|p|br|span|table|td|a|font|b|i|strong|img|style)(?=[\s/>])",
+                        re.IGNORECASE)
+KEYWORD_IGNORES = {"thank", "please", "email", "hello", "regards", "from", "that", "this"}
+
+CHUNK = 8192
+
+
+class Extracted(NamedTuple):
+    text: str
+    keywords: List[str]
+
+
+class _Extractor(HTMLParser):
+    """Collects visible text line by line until the quote chain, signature or budget."""
+
+    def __init__(self, limit: Optional[int], keyword_limit: int):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.keyword_limit = keyword_limit
+        self.parts: List[str] = []
+        self.length = 0
+        self.keywords: dict = {}
+        self.skip_depth = 0
+        self.quote_depth = 0
+        self.div_stack: List[bool] = []
+        self.done = False
+
+    # -- tags -------------------------------------------------------------- #
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == "blockquote":
+            self.quote_depth += 1
+        elif tag == "div":
+            cls = dict(attrs).get("class") or ""
+            is_quote = any(q in cls for q in QUOTE_CLASSES)
+            self.div_stack.append(is_quote)
+            self.quote_depth += is_quote
+        if tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == "blockquote":
+            self.quote_depth = max(0, self.quote_depth - 1)
+        elif tag == "div" and self.div_stack:
+            self.quote_depth -= self.div_stack.pop()
+        if tag in BLOCK_TAGS:
+            self._newline()
+
+    def handle_data(self, data):
+        if self.done or self.skip_depth or self.quote_depth:
+            return
+        lines = data.split("\n")
+        for i, line in enumerate(lines):
+            if i:
+                self._newline()
+            self.add_line(line)
+            if self.done:
+                return
+
+    # -- text -------------------------------------------------------------- #
+    def add_line(self, line: str):
+        stripped = line.strip()
+        if not stripped:
+            if line and self.parts and self.parts[-1] != "\n":
+                self._emit(" ")  # whitespace between inline elements
+            return
+        if stripped.startswith(">"):
+            return  # quoted line in a plain-text reply
+        if _STOP_LINE.match(line):
+            self.done = True
+            return
+        self._emit(line)
+
+    def _newline(self):
+        if self.parts and self.parts[-1] != "\n":
+            self.parts.append("\n")
+
+    def _emit(self, text: str):
+        if self.limit is not None:
+            room = self.limit - self.length
+            if room <= 0:
+                self.done = True
+                return
+            text = text[:room + 1]  # +1 keeps a trailing space that collapsing drops
+        self.parts.append(text)
+        self.length += len(text)
+        if len(self.keywords) < self.keyword_limit:
+            for w in _WORD.findall(text.lower()):
+                if w not in KEYWORD_IGNORES:
+                    self.keywords.setdefault(w, None)
+                    if len(self.keywords) >= self.keyword_limit:
+                        break
+        if self.limit is not None and self.length >= self.limit:
+            self.done = True
+
+
+def extract_text(body: str, limit: Optional[int] = None, keyword_limit: int = 0) -> Extracted:
+    """
+    Visible text of an HTML or plain-text mail body in one pass.
+
+    Skips non-visible elements (script/style/head…), decodes entities, drops
+    quoted reply chains (blockquotes, gmail_quote, "On … wrote:", "> " lines)
+    and everything after a signature delimiter ("-- "). Parsing stops as soon
+    as `limit` characters are collected, so a 500 KB newsletter costs no more
+    than its first screen. The first `keyword_limit` distinct words (4+ letters,
+    in order of appearance) are collected in the same pass.
+    """
+    parser = _Extractor(limit, keyword_limit)
+    body = body or ""
+    if not _HTML_HINT.search(body, 0, 4096):
+        # Plain text: walk lines directly so the budget can stop the scan early
+        for line in body.splitlines():
+            parser._newline()
+            parser.add_line(line)
+            if parser.done:
+                break
+    else:
+        for start in range(0, len(body), CHUNK):
+            parser.feed(body[start:start + CHUNK])
+            if parser.done:
+                break
+        if not parser.done:
+            parser.close()
+
+    text = _WS.sub(" ", "".join(parser.parts)).strip()
+    if limit is not None:
+        text = text[:limit]
+    return Extracted(text, list(parser.keywords))
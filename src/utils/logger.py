@@ -1,9 +1,13 @@
 from rich.console import Console
-from rich.traceback import install
 
 
 console = Console()
-install(show_locals=True)
+
+
+def install_tracebacks(show_locals: bool = True):
+    """Opt-in rich tracebacks (`--debug` / RICH_TRACEBACKS=1); not installed on import."""
+    from rich.traceback import install
+    install(show_locals=show_locals)
 
 
 def info(msg: str):
@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import time
+import bisect
+import threading
+from contextlib import ContextDecorator
+from typing import Dict, List, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds (Prometheus `le` values)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+PREFIX = "email_responder"
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _key(name: str, labels: Dict) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Estimate from the buckets (linear within a bucket), like Prometheus' histogram_quantile."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / c)
+            seen += c
+        return self.max
+
+
+class Span(ContextDecorator):
+    """Times a block (`with span(...)`) or a function (`@span(...)`); nested spans record their parent."""
+
+    def __init__(self, registry: "Metrics", name: str, labels: Dict):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def _recreate_cm(self):
+        return Span(self.registry, self.name, self.labels)
+
+    def __enter__(self):
+        self.registry._stack().append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        stack = self.registry._stack()
+        if stack and stack[-1] == self.name:
+            stack.pop()
+        elif self.name in stack:  # a generator closed out of order (or in another thread)
+            stack.remove(self.name)
+        self.registry.observe(self.name, elapsed, parent=stack[-1] if stack else None,
+                              error=exc_type is not None, **self.labels)
+        return False
+
+
+class Metrics:
+    """
+    In-process span histograms and counters.
+
+    Every span and counter increment is kept in memory (cheap enough to leave
+    on); with `jsonl_path` or `METRICS_JSONL` set each event is also appended
+    to that file as one JSON line. `render_prometheus()` / `serve_prometheus()`
+    expose the aggregates in the Prometheus text format.
+    """
+
+    def __init__(self, jsonl_path: Optional[str] = None):
+        self.jsonl_path = jsonl_path
+        self._hist: Dict[Key, Histogram] = {}
+        self._counters: Dict[Key, float] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._file = None
+
+    def _stack(self) -> List[str]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _emit(self, event: Dict):
+        if self._file is None:
+            # Resolved on first event so a METRICS_JSONL from .env (loaded by the CLI) applies
+            path = self.jsonl_path or os.getenv("METRICS_JSONL")
+            if not path:
+                return
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._file.write(json.dumps(event) + "\n")
+
+    # -- recording ------------------------------------------------------------ #
+    def span(self, name: str, **labels) -> Span:
+        return Span(self, name, labels)
+
+    def observe(self, name: str, seconds: float, parent: Optional[str] = None, error: bool = False, **labels):
+        with self._lock:
+            key = _key(name, labels)
+            hist = self._hist.get(key)
+            if hist is None:
+                hist = self._hist[key] = Histogram()
+            hist.observe(seconds)
+            if error:
+                ekey = _key("errors", {"stage": name, **labels})
+                self._counters[ekey] = self._counters.get(ekey, 0) + 1
+            self._emit({"ts": round(time.time(), 3), "span": name, "ms": round(seconds * 1000, 3),
+                        "parent": parent, "error": error, **labels})
+
+    def count(self, name: str, value: float = 1, **labels):
+        if not value:
+            return
+        with self._lock:
+            key = _key(name, labels)
+            self._counters[key] = self._counters.get(key, 0) + value
+            self._emit({"ts": round(time.time(), 3), "counter": name, "value": value, **labels})
+
+    def reset(self):
+        with self._lock:
+            self._hist.clear()
+            self._counters.clear()
+
+    # -- reading -------------------------------------------------------------- #
+    def summary(self) -> List[Dict]:
+        """One row per span (and label set), slowest total first."""
+        with self._lock:
+            rows = [
+                {"span": name, "labels": dict(labels), "count": h.count, "total_ms": h.sum * 1000,
+                 "p50_ms": h.quantile(0.5) * 1000, "p95_ms": h.quantile(0.95) * 1000, "max_ms": h.max * 1000}
+                for (name, labels), h in self._hist.items()
+            ]
+        return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+    def counters(self) -> Dict[Key, float]:
+        with self._lock:
+            return dict(self._counters)
+
+    def render_prometheus(self) -> str:
+        def fmt(labels) -> str:
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+        lines = [f"# TYPE {PREFIX}_stage_seconds histogram"]
+        with self._lock:
+            for (name, labels), h in sorted(self._hist.items()):
+                base = (("stage", name),) + labels
+                cumulative = 0
+                for bound, c in zip(BUCKETS + (float("inf"),), h.counts):
+                    cumulative += c
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{PREFIX}_stage_seconds_bucket{fmt(base + (('le', le),))} {cumulative}")
+                lines.append(f"{PREFIX}_stage_seconds_sum{fmt(base)} {h.sum:.6f}")
+                lines.append(f"{PREFIX}_stage_seconds_count{fmt(base)} {h.count}")
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                metric = f"{PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append(f"{metric}{fmt(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port: int, host: str = "127.0.0.1"):
+        """Serve `GET /metrics` from a daemon thread; returns the server."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+metrics = Metrics()
+span = metrics.span
+count = metrics.count
@@ -1,30 +1,30 @@
+import os
 import re
+import json
+from functools import lru_cache
 from email.utils import parseaddr
+from typing import Iterable, List, Optional, Tuple
+from src.utils.html_text import extract_text
 
 # --- Keyword and domain sets ---
 WORK_KEYWORDS = {"invoice", "meeting", "deadline", "deliverable", "sla", "client", "sow", "po"}
 URGENT_KEYWORDS = {"urgent", "asap", "immediately", "important", "priority", "escalated"}
 PERSONAL_DOMAINS = {"gmail.com", "yahoo.com", "outlook.com", "hotmail.com"}
+_PERSONAL_DOMAINS = frozenset(PERSONAL_DOMAINS)
 
 
-def clean_html(text: str) -> str:
+def clean_html(text: str, limit: Optional[int] = None) -> str:
     """
-    Remove HTML tags and extra spaces from email body or snippet.
+    Visible text of an email body or snippet: tags, scripts/styles, entities,
+    quoted replies and signatures removed, whitespace collapsed. With `limit`,
+    extraction stops once that many characters are collected.
     """
-    text = re.sub(r"<[^>]+>", " ", text)  # remove HTML tags
-    text = re.sub(r"\s+", " ", text).strip()  # collapse multiple spaces
-    return text
+    return extract_text(text, limit=limit).text
 
 
-def infer_sender_type(email_address: str) -> str:
-    """
-    Classify sender based on email domain.
-    Returns 'personal' or 'work'.
-    """
-    _, addr = parseaddr(email_address)
-    domain = addr.split("@")[-1].lower() if "@" in addr else ""
-    
-    if domain in PERSONAL_DOMAINS:
+@lru_cache(maxsize=4096)
+def _domain_type(domain: str, personal_domains: frozenset) -> str:
+    if domain in personal_domains:
         return "personal"
     elif domain:
         return "work"
@@ -32,35 +32,111 @@ def infer_sender_type(email_address: str) -> str:
         return "unknown"
 
 
+@lru_cache(maxsize=4096)
+def _sender_domain(email_address: str) -> str:
+    _, addr = parseaddr(email_address)
+    return addr.split("@")[-1].lower() if "@" in addr else ""
+
+
+def infer_sender_type(email_address: str, personal_domains: frozenset = None) -> str:
+    """
+    Classify sender based on email domain.
+    Returns 'personal' or 'work'.
+    """
+    return _domain_type(_sender_domain(email_address), _PERSONAL_DOMAINS if personal_domains is None else personal_domains)
+
+
+def load_rules(path: str = None) -> dict:
+    """
+    Classification rules: the built-in keyword/domain sets, overridden by a JSON
+    rule file (`path` or the CLASSIFY_RULES env var) shaped like:
+
+        {"urgent": ["urgent", "asap"], "work": ["invoice", "purchase order"],
+         "personal_domains": ["gmail.com"]}
+    """
+    rules = {
+        "urgent": sorted(URGENT_KEYWORDS),
+        "work": sorted(WORK_KEYWORDS),
+        "personal_domains": sorted(PERSONAL_DOMAINS),
+    }
+    path = path or os.getenv("CLASSIFY_RULES")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            rules.update(json.load(f))
+    return rules
+
+
+class RuleClassifier:
+    """
+    Heuristic classifier compiled once from a rule set.
+
+    All keywords go into one case-insensitive alternation with word boundaries,
+    so a message is scanned in a single pass and "po" no longer matches
+    "report" (nor "sla" "translate").
+    """
+
+    def __init__(self, rules: dict = None):
+        rules = rules or load_rules()
+        self.personal_domains = frozenset(d.lower() for d in rules.get("personal_domains", []))
+        groups = []
+        for label in ("urgent", "work"):
+            words = sorted({w.lower() for w in rules.get(label, [])}, key=len, reverse=True)
+            if words:
+                groups.append(f"(?P<{label}>{'|'.join(re.escape(w) for w in words)})")
+        self.pattern = re.compile(rf"(?<!\w)(?:{'|'.join(groups)})(?!\w)", re.IGNORECASE) if groups else None
+
+    def _content_label(self, text: str) -> str:
+        label = "general"
+        if self.pattern is None:
+            return label
+        for m in self.pattern.finditer(text):
+            if m.lastgroup == "urgent":
+                return "urgent"  # urgent wins; no need to scan further
+            label = "work"
+        return label
+
+    def classify(self, subject: str, snippet: str, sender: str) -> dict:
+        label = self._content_label(f"{subject} {snippet}")
+        score = {"urgent": 0.9, "work": 0.8}.get(label, 0.5)
+
+        # Infer sender type
+        sender_type = infer_sender_type(sender, self.personal_domains)
+
+        # If personal sender & general content → classify as personal
+        if sender_type == "personal" and label == "general":
+            label = "personal"
+            score = 0.7
+
+        return {
+            "label": label,
+            "score": score,
+            "sender_type": sender_type
+        }
+
+    def classify_batch(self, items: Iterable[Tuple[str, str, str]]) -> List[dict]:
+        """Classify many (subject, snippet, sender) tuples with the same compiled rules."""
+        classify = self.classify
+        return [classify(subject, snippet, sender) for subject, snippet, sender in items]
+
+
+_default_classifier = None
+
+
+def default_classifier() -> RuleClassifier:
+    global _default_classifier
+    if _default_classifier is None:
+        _default_classifier = RuleClassifier()
+    return _default_classifier
+
+
 def heuristic_classify(subject: str, snippet: str, sender: str) -> dict:
     """
     Heuristically classify an email as 'urgent', 'work', 'personal', or 'general'
     using keyword matching and sender domain.
     """
-    s = f"{subject} {snippet}".lower()
-    label = "general"
-    score = 0.5
-
-    # Check urgency
-    if any(k in s for k in URGENT_KEYWORDS):
-        label = "urgent"
-        score = 0.9
-
-    # Check work-related
-    elif any(k in s for k in WORK_KEYWORDS):
-        label = "work"
-        score = 0.8
-
-    # Infer sender type
-    sender_type = infer_sender_type(sender)
-
-    # If personal sender & general content → classify as personal
-    if sender_type == "personal" and label == "general":
-        label = "personal"
-        score = 0.7
-
-    return {
-        "label": label,
-        "score": score,
-        "sender_type": sender_type
-    }
+    return default_classifier().classify(subject, snippet, sender)
+
+
+def classify_batch(items: Iterable[Tuple[str, str, str]]) -> List[dict]:
+    """Batch form of `heuristic_classify` for (subject, snippet, sender) tuples."""
+    return default_classifier().classify_batch(items)